@@ -0,0 +1,158 @@
+import re  # operations for regular expressions, i.e. very powerful text matching
+
+# a group reference in a replacement template, e.g. \1
+GROUP_REFERENCE = re.compile(r'\\(\d)')
+
+
+class Rule():
+    """one rewrite rule: every match of the pattern is replaced with the template, as re.sub() would do it"""
+
+    def __init__(self, pattern, replacement):
+        """
+        :param pattern: the regex match pattern
+        :param replacement: the replacement template. It may refer to the groups of the pattern as \\1 to \\9.
+        """
+        self.pattern = pattern
+        self.replacement = replacement
+
+
+def compile_pass(rules):
+    """compiles the rules of one pass into a single pattern
+
+    :param rules: the rules of the pass, in order
+    :return: a tuple with the compiled pattern at index 0 and its replacement (a template or a function) at index 1
+    """
+    if len(set(rule.replacement for rule in rules)) == 1 and not GROUP_REFERENCE.search(rules[0].replacement):
+        # every match is replaced with the same text, so it doesn't matter which rule matched
+        return re.compile('|'.join(rule.pattern for rule in rules)), rules[0].replacement
+
+    alternatives = []
+    # the number of the empty group that ends each rule's alternative -> its replacement,
+    # as literal text and group numbers
+    replacements = {}
+    groups = 0
+    for rule in rules:
+        pieces = []
+        # split() alternates between literal text and the numbers of the groups it refers to
+        for i, piece in enumerate(GROUP_REFERENCE.split(rule.replacement)):
+            if i % 2:
+                pieces.append(groups + int(piece))
+            elif piece:
+                pieces.append(piece)
+        # an empty group at the end tells which alternative matched without wrapping it in a group,
+        # which would keep the compiled pattern from skipping ahead to the first character of a rule
+        alternatives.append(rule.pattern + '()')
+        groups += re.compile(rule.pattern).groups + 1
+        replacements[groups] = pieces
+
+    def replace(match):
+        # the empty group of the alternative that matched is the last one to close
+        return ''.join(piece if isinstance(piece, str) else (match.group(piece) or '')
+                       for piece in replacements[match.lastindex])
+
+    return re.compile('|'.join(alternatives)), replace
+
+
+class Rewriter():
+    """applies an ordered list of rewrite rules to a string in as few scans as possible.
+
+    The rules are grouped into passes, and each pass is compiled once into a single pattern, so a string is
+    read once per pass instead of once per rule. At each position, the rules of a pass are tried in order and the
+    match is replaced the way its own rule would replace it. This is not the same as applying the rules one by one
+    if a later rule of a pass can match further left than an earlier one, where the two matches overlap: one by
+    one, the earlier rule would have replaced its match first. Such rules, and a rule that depends on the output
+    of another one (e.g. collapsing the white space left by removed attributes), go in separate passes.
+    cleanup_benchmark.py and tests/test_app_cleanup.py check the passes against the rules one by one.
+    """
+
+    def __init__(self, *passes):
+        """
+        :param passes: the rules of each pass, in order
+        """
+        # every rule in order, i.e. what the rewriter has to be equivalent to
+        self.rules = [rule for rules in passes for rule in rules]
+        self.__passes = [compile_pass(rules) for rules in passes]
+
+    def rewrite(self, text):
+        """
+        :param text: the string to rewrite
+        :return: the string with every rule applied
+        """
+        for pattern, replacement in self.__passes:
+            text = pattern.sub(replacement, text)
+        return text
+
+
+# the placeholders that make_lem_tag() and make_rdg_tag() leave for missing data.
+# The NO ANNOTATION comment only ever follows a lemma, so removing it can't leave an empty reading behind.
+PLACEHOLDERS = [
+    Rule(r'<!-- NO ([A-Z]*) ANNOTATION -->', ''),
+    # Remove empty readings.
+    Rule(r'<rdg wit="None" source="None" xml:id="rdg-([0-9]*).([0-9]*)-([.]*)"><!-- ([A-Z(\s)?]*([\d])?) --></rdg>',
+         ''),
+    Rule(r'<rdg xml:id="rdg-([0-9]*).([0-9]*)-"></rdg>', ''),
+    # Remove empty witnesses
+    Rule(r'wit="None"', ''),
+    # Remove empty sources
+    Rule(r'source="None"', ''),
+]
+
+# Turn empty readings into self-closing tags.
+NONE_READING = [
+    Rule(r'>None</rdg>', '/>'),
+]
+
+# Remove extra white space between attributes.
+WHITESPACE = [
+    Rule(r'\s\s', ' '),
+]
+
+# Dealing with conventional symbols in critical editions.
+# Each of these rules is a pass of its own (see editorial_passes()): a rule for an element can lose to the rule for
+# an attribute that matches further left, e.g. in -†ab††</lem>, the †ab† of an xml:id would be replaced before the
+# ††</lem> of an empty crux. Every rule starts with its symbol (a lookbehind for the - of an xml:id comes after
+# it), so each pass can skip from one symbol to the next.
+EDITORIAL = [
+    # Brackets for an addtion, first as a value of <lem> or <rdg>
+    Rule(r'<([a-zA-Z]*)>([\sa-zA-Z]*)?(</rdg>|</lem>)', r'"><supplied reason="lost">\1</supplied>\2\3'),
+    # Now as part of an xml:id, where <> are not allowed.
+    Rule(r'<(?<=-<)([a-zA-Z]*(-[a-zA-Z])?)>', r'\1-addition'),
+    # †Crux†, first as a value of an element.
+    Rule(r'†([a-zA-Z(\s)?]*)†([\sa-zA-Z]*)?(</rdg>|</lem>)', r'"><sic>\1</sic>\2\3'),
+    # Now a crux as a value of an attribute, which is not allowed.
+    Rule(r'†(?<=-†)([a-zA-Z(\-)?]*)†', r'\1-crux'),
+    # Lacuna *** as a value of an element.
+    Rule(r'\*\*\*([\sa-zA-Z]*)?(</rdg>|</lem>)', r'<gap reason="lost"/>\1\2'),
+    # Lacuna *** as a value of an attribute.
+    Rule(r'\*(?<=-\*)\*\*([\sa-zA-Z]*)?', r'lacuna\1'),
+    # Editorial deletion with brackets [] as a value of an element
+    Rule(r'\[([a-zA-Z]*)\]?(</rdg>|</lem>)', r'<surplus>\1</surplus>\2'),
+    # Editorial deletion with brackets [] as a value of an attribute
+    Rule(r'\[(?<=-\[)([a-zA-Z]*)\]', r'\1-surplus'),
+]
+
+# turn omissions in to self-closing reading tags
+OMISSION = Rule(r'>om\.</rdg>', '/>')
+
+
+
+def editorial_passes(omission=OMISSION):
+    """
+    :param omission: the rule for omissions, which doesn't overlap the last editorial rule, so it shares its pass
+    :return: the passes of the EDITORIAL rules, in order, one rule each
+    """
+    return [[rule] for rule in EDITORIAL[:-1]] + [[EDITORIAL[-1], omission]]
+
+
+# the clean up for the <app> tags of every encoder
+APP_TAG = Rewriter(PLACEHOLDERS, NONE_READING, WHITESPACE, *editorial_passes())
+
+
+def cleanup_tag(entries):
+    """a function for cleaning up an <app> tag
+
+    :param entries: a tag generated by either make_lem_tag() or make_rdg_tag()
+
+    :return: the same tag, but with extraneous tags and markup removed
+    """
+    return APP_TAG.rewrite(entries)
@@ -0,0 +1,381 @@
+import re  # finds the xml:ids of the queued entries
+import bisect  # keeps the accepted spans of a section in order
+from concurrent.futures import ProcessPoolExecutor  # finds the lemmas of several sections at once
+import lxml.etree as ET  # reports entries that are not well-formed XML
+from tei_tree import FlatText, parse_fragment  # the section content as one string, mapped back to the tree
+from lemma_locator import LemmaLocator, pattern_error  # finds the nth lemma instance outside comments, tags and earlier <app>s
+from profiling import span  # times finding the lemmas and splicing them in, with --profile
+from row_budget import Watchdog, RowTimeout  # stops a lemma pattern that runs over the budget of its row
+
+# what happened to an <app> entry when its section was spliced
+INSERTED = 'inserted'  # the <app> tag replaced the lemma
+NOT_FOUND = 'not found'  # the lemma (or the requested occurrence of it) is not in the section text
+OVERLAP = 'overlap'  # the lemma partly overlaps a lemma that an earlier row of the same section already claimed,
+                     # or opens or closes a tag that is already in the text without the other
+INVALID = 'invalid'  # the <app> tag is not well-formed XML
+TIMED_OUT = 'timed out'  # finding the lemma took longer than the budget of the row, which was quarantined
+BAD_LEMMA = 'bad lemma'  # the lemma goes into its pattern unescaped, and is not a valid regex (e.g. 'a(b')
+
+# how the <app> entries are checked before they are spliced
+ROW = 'row'  # each entry is parsed when it is checked
+SECTION = 'section'  # the entries of a section are parsed together when the batch is applied
+
+# separates the entries of a section when they are parsed together
+ENTRY_MARK = 'apparatus-entry'
+# an xml:id attribute of an entry
+XML_ID = re.compile(r'xml:id="[^"]*"')
+
+
+class Fragment():
+    """an <app> entry and the nodes parsed from it. The nodes are spliced into the tree as they are, so an entry
+    is parsed once, whether or not it is valid."""
+
+    def __init__(self, markup, parsed=None):
+        """
+        :param markup: the complete <app> tag, including its comment
+        :param parsed: the (text, nodes) tuple parsed from the markup, or None if it has not been parsed yet
+        """
+        self.markup = markup
+        self.parsed = parsed
+
+
+class Insertion():
+    """one <app> entry waiting to be spliced into its section"""
+
+    def __init__(self, section, pattern, occurrence, entry, context, fragment=None):
+        """
+        :param section: the element that contains the lemma (a <seg>, <l> or verse <div>)
+        :param pattern: the regex match pattern for finding the lemma
+        :param occurrence: the number of the lemma instance to replace, starting at 0
+        :param entry: the complete <app> tag, including its comment
+        :param context: anything the encoder needs to report on this row (e.g. citation and lemma)
+        :param fragment: the Fragment returned by ApparatusBatch.check() for the entry
+        """
+        self.section = section
+        self.pattern = pattern
+        self.occurrence = occurrence
+        self.entry = entry
+        self.context = context
+        self.fragment = fragment
+        # filled in by ApparatusBatch.apply()
+        self.start = None
+        self.end = None
+        self.status = None
+        # why the row was quarantined, if it TIMED_OUT, or why its pattern can't be compiled, if it is a BAD_LEMMA
+        self.reason = None
+
+
+class ApparatusBatch():
+    """collects the <app> entries for every section and splices each section once.
+
+    The encoders used to look each lemma up in the section text and replace the section text after every
+    CSV row, so each row rescanned everything earlier rows had inserted, and every insertion moved the
+    matches of the rows after it. The batch finds every lemma against the original section content and then
+    splices the <app> tags of each section into the tree as real nodes.
+
+    A lemma that lies inside the lemma of an earlier row is nested in that row's <lem>, as before.
+    A lemma that only partly overlaps an earlier one is rejected.
+
+    Every entry is parsed once. With ROW validation, check() parses each entry as its row is read, and the
+    nodes are kept for the splice. With SECTION validation, the entries of a section are wrapped together and
+    parsed in one go when the batch is applied; only if that fails is each entry parsed on its own, to find the
+    rows at fault, whose status is set to INVALID.
+
+    Sections never share elements, so with more than one job the lemmas of each section are found (and, with
+    SECTION validation, its entries checked) in a pool of processes, each working on a copy of the section.
+    The tree itself is only changed in this process, section by section in the order the sections were first
+    queued, so the result is the same as with one job.
+    """
+
+    def __init__(self, validation=ROW, jobs=1, watchdog=None):
+        """
+        :param validation: ROW or SECTION
+        :param jobs: the number of processes that find the lemmas
+        :param watchdog: the Watchdog that gives finding each lemma the budget of its row (default: the default
+            budget, with nothing logged)
+        """
+        self.validation = validation
+        self.jobs = jobs
+        self.watchdog = watchdog if watchdog is not None else Watchdog()
+        # section element -> its insertions, in CSV order
+        self.__sections = {}
+        # every insertion, in CSV order
+        self.__insertions = []
+        # section element -> the xml:id attributes of its queued entries, e.g. 'xml:id="lem-7.2-ut-mihi"'
+        self.__ids = {}
+
+    def check(self, entry):
+        """checks that a generated <app> entry is well-formed XML. With SECTION validation, the check is left
+        to apply().
+
+        :param entry: the complete <app> tag, including its comment
+        :return: a Fragment to pass to add(), or None if the entry is not well-formed
+        """
+        if self.validation == SECTION:
+            return Fragment(entry)
+        parsed = parse_entry(entry)
+        if parsed is None:
+            return None
+        return Fragment(entry, parsed)
+
+    def add(self, section, pattern, occurrence, entry, context=None, fragment=None):
+        """queues an <app> entry for its section. Nothing changes in the tree until apply() is called.
+
+        :param section: the element whose text contains the lemma
+        :param pattern: the regex match pattern for finding the lemma
+        :param occurrence: the number of the lemma instance to replace, starting at 0
+        :param entry: the complete <app> tag
+        :param context: anything the encoder needs to report on this row
+        :param fragment: the Fragment returned by check() for the entry
+        :return: the queued Insertion
+        """
+        insertion = Insertion(section, pattern, occurrence, entry, context, fragment)
+        self.__sections.setdefault(section, []).append(insertion)
+        self.__insertions.append(insertion)
+        self.__ids.setdefault(section, set()).update(XML_ID.findall(entry))
+        return insertion
+
+    def queued_id(self, section, xmlid):
+        """
+        :param section: the element whose text contains the lemma
+        :param xmlid: an xml:id attribute, e.g. 'xml:id="lem-7.2-ut-mihi"'
+        :return: True if an <app> entry already queued for the section has that xml:id
+        """
+        return xmlid in self.__ids.get(section, ())
+
+    def apply(self):
+        """finds every queued lemma and splices each section once
+
+        :return: every queued Insertion in CSV order, with its status set to INSERTED, NOT_FOUND, OVERLAP,
+            INVALID, TIMED_OUT or BAD_LEMMA
+        """
+        sections = list(self.__sections.items())
+        if self.jobs > 1 and len(sections) > 1:
+            with span('locate'):
+                plans = self.__plan_in_pool(sections)
+        else:
+            plans = None
+
+        for n, (section, insertions) in enumerate(sections):
+            with span('locate'):
+                flat = FlatText(section)
+                if plans is None:
+                    if self.validation == SECTION:
+                        with span('validate'):
+                            insertions = validate(insertions)
+                    accepted = plan(flat, insertions, self.watchdog)
+                else:
+                    # the plan was made on a copy of the section, whose text is the same
+                    results, order = plans[n]
+                    for insertion, (status, start, end, entry, reason) in zip(insertions, results):
+                        insertion.status = status
+                        insertion.start = start
+                        insertion.end = end
+                        insertion.entry = entry
+                        insertion.reason = reason
+                        if status == TIMED_OUT:
+                            # the worker process only stopped the row; it is reported here
+                            self.watchdog.quarantine('locate', insertion.context, reason)
+                    accepted = [insertions[i] for i in order]
+
+            with span('splice'):
+                # from the last span to the first, so that the offsets of the spans before it stay valid
+                for insertion in reversed(accepted):
+                    fragment = insertion.fragment
+                    if fragment is not None and fragment.parsed is not None and fragment.markup == insertion.entry:
+                        flat.replace(insertion.start, insertion.end, insertion.entry, fragment.parsed)
+                    else:
+                        # the entry changed after it was parsed (e.g. an entry nested in its <lem>),
+                        # or it was checked in another process
+                        flat.replace(insertion.start, insertion.end, insertion.entry)
+
+        done = self.__insertions
+        self.__sections = {}
+        self.__insertions = []
+        return done
+
+    def __plan_in_pool(self, sections):
+        """
+        :param sections: (section, insertions) pairs
+        :return: the plan_markup() result for each section, in the same order
+        """
+        work = [(ET.tostring(section, encoding='unicode', with_tail=False),
+                 [(insertion.pattern, insertion.occurrence, insertion.entry, insertion.context)
+                  for insertion in insertions],
+                 self.validation, self.watchdog.budget) for section, insertions in sections]
+        with ProcessPoolExecutor(self.jobs) as executor:
+            # a few chunks per process, so that one long section doesn't hold up the rest
+            return list(executor.map(plan_markup, work, chunksize=max(1, len(work) // (self.jobs * 4))))
+
+
+def plan(flat, insertions, watchdog=None):
+    """finds the lemma of each insertion of a section and decides which ones can be spliced in.
+    The status, start and end of each insertion are set, and an insertion nested in the <lem> of an earlier
+    one is put into that one's entry. Nothing changes in the tree.
+
+    :param flat: the FlatText of the section
+    :param insertions: the insertions of the section, in CSV order
+    :param watchdog: the Watchdog that stops a lemma that takes longer than the budget of its row
+    :return: the accepted insertions, sorted by start
+    """
+    watchdog = watchdog if watchdog is not None else Watchdog()
+    locator = LemmaLocator.from_flat(flat)
+    # find the instances of every lemma of the section in one pass over its text
+    locator.prepare([insertion.pattern for insertion in insertions])
+
+    # the spans accepted so far, sorted by start
+    starts = []
+    accepted = []
+    for insertion in insertions:
+        reason = pattern_error(insertion.pattern)
+        if reason is not None:
+            insertion.status = BAD_LEMMA
+            insertion.reason = reason
+            continue
+        try:
+            with watchdog.row('locate', insertion.context, insertion.pattern):
+                span = locator.find(insertion.pattern, insertion.occurrence)
+        except RowTimeout as timeout:
+            insertion.status = TIMED_OUT
+            insertion.reason = str(timeout)
+            continue
+        if span is None:
+            insertion.status = NOT_FOUND
+            continue
+
+        start, end = span
+        insertion.start = start
+        insertion.end = end
+        i = bisect.bisect_left(starts, start)
+
+        # a lemma inside the lemma of an earlier row goes inside that row's <lem>
+        outer = None
+        if i < len(accepted) and accepted[i].start == start and accepted[i].end >= end:
+            outer = accepted[i]
+        elif i > 0 and accepted[i - 1].end >= end:
+            outer = accepted[i - 1]
+        if outer is not None:
+            insertion.status = INSERTED if nest(outer, insertion, locator) else OVERLAP
+            continue
+
+        # otherwise the accepted spans on either side must not overlap this one,
+        # and the span must not cut through a tag that is already in the text
+        if (i > 0 and accepted[i - 1].end > start) or (i < len(accepted) and accepted[i].start < end) \
+                or not flat.splittable(start, end):
+            insertion.status = OVERLAP
+            continue
+
+        insertion.status = INSERTED
+        starts.insert(i, start)
+        accepted.insert(i, insertion)
+    return accepted
+
+
+def plan_markup(work):
+    """makes the plan for one section in a worker process
+
+    :param work: the markup of the section, a (pattern, occurrence, entry, context) tuple for each of its
+        insertions, the validation (ROW or SECTION) and the budget of each row
+    :return: a (status, start, end, entry, reason) tuple for each insertion, in CSV order, and the indices of the
+        accepted insertions, sorted by start
+    """
+    markup, queued, validation, budget = work
+    section = ET.fromstring(markup)
+    insertions = [Insertion(section, pattern, occurrence, entry, context)
+                  for pattern, occurrence, entry, context in queued]
+    valid = validate(insertions) if validation == SECTION else insertions
+    # the rows are reported by the process that made the batch
+    accepted = plan(FlatText(section), valid, Watchdog(budget))
+    index = {id(insertion): i for i, insertion in enumerate(insertions)}
+    return [(insertion.status, insertion.start, insertion.end, insertion.entry, insertion.reason)
+            for insertion in insertions], \
+        [index[id(insertion)] for insertion in accepted]
+
+
+def parse_entry(entry):
+    """
+    :param entry: the complete <app> tag, including its comment
+    :return: the (text, nodes) tuple parsed from the entry, or None if the entry is not well-formed
+    """
+    try:
+        parsed = parse_fragment(entry)
+    except ET.XMLSyntaxError:
+        return None
+    return parsed if well_formed(*parsed) else None
+
+
+def well_formed(text, nodes):
+    """
+    :param text: the text before the first node of an entry
+    :param nodes: the nodes of the entry
+    :return: True if the entry would be a document on its own: one element, and nothing around it but comments,
+        processing instructions and whitespace
+    """
+    if text.strip() or any(node.tail and node.tail.strip() for node in nodes):
+        return False
+    return sum(1 for node in nodes if isinstance(node.tag, str)) == 1
+
+
+def validate(insertions):
+    """parses the entries of a section together, separated by processing instructions, and gives each insertion
+    its nodes. If the entries can't be parsed together, each one is parsed on its own.
+
+    :param insertions: the insertions of a section, in CSV order
+    :return: the insertions whose entries are well-formed; the status of the others is set to INVALID
+    """
+    markup = ''.join('<?' + ENTRY_MARK + '?>' + insertion.entry for insertion in insertions)
+    try:
+        text, nodes = parse_fragment(markup)
+    except ET.XMLSyntaxError:
+        nodes = None
+
+    # the nodes of each entry follow its mark, and the mark's tail is the text before them
+    groups = []
+    for node in nodes or []:
+        if node.tag is ET.ProcessingInstruction and node.target == ENTRY_MARK:
+            groups.append((node.tail or '', []))
+        else:
+            groups[-1][1].append(node)
+
+    valid = []
+    for i, insertion in enumerate(insertions):
+        if len(groups) == len(insertions):
+            # every entry closed everything it opened, so its nodes are the ones it parses into on its own
+            parsed = groups[i] if well_formed(*groups[i]) else None
+        else:
+            # an entry that isn't well-formed spoiled the section, so find it
+            parsed = parse_entry(insertion.entry)
+        if parsed is None:
+            insertion.status = INVALID
+            continue
+        insertion.fragment = Fragment(insertion.entry, parsed)
+        valid.append(insertion)
+    return valid
+
+
+def nest(outer, insertion, locator):
+    """splices an insertion into the <lem> of the entry whose lemma contains it
+
+    :param outer: the accepted insertion whose lemma contains the new one
+    :param insertion: the new insertion, with its span in the section text
+    :param locator: the LemmaLocator of the section
+    :return: True if the lemma was found inside the <lem>, False otherwise
+    """
+    entry = outer.entry
+    lemStart = entry.find('<lem')
+    lemStart = entry.find('>', lemStart) + 1
+    lemEnd = entry.rfind('</lem>')
+    if lemStart <= 0 or lemEnd < lemStart:
+        # an empty <lem/> has nowhere to put the new <app>
+        return False
+
+    # the lemma instances between the start of the outer lemma and this one
+    before = locator.count(insertion.pattern, outer.start, insertion.start)
+    span = LemmaLocator.from_markup(entry[lemStart:lemEnd]).find(insertion.pattern, before)
+    if span is None:
+        return False
+
+    start, end = span
+    outer.entry = entry[:lemStart + start] + insertion.entry + entry[lemStart + end:]
+    return True
+
@@ -0,0 +1,648 @@
+import re  # operations for regular expressions, i.e. very powerful text matching
+import functools  # caches the parsed witness and source lists
+import collections  # keeps the cached fragments of <app> tags in the order they were last used
+from app_cleanup import APP_TAG  # the clean up shared by the encoders
+from sigla import parse_sigla, GREEK  # the compiled, memoized siglum grammar
+from profiling import span  # times the clean up of each <app> tag, with --profile
+
+# The encoders used to have their own copies of make_lem_tag(), make_rdg_tag() and xmlid(), which differed in small
+# ways and recompiled every pattern for every row. This module compiles a row of the apparatus CSV into an <app> tag
+# for any genre. Each genre is an EntryCompiler configured with its citation scheme and its conventions.
+
+# placeholders for missing data. The clean up removes them again.
+NO_LEMMA = '<!-- NO LEMMA -->'
+NO_LEMMA_ANNOTATION = '<!-- NO LEMMA ANNOTATION -->'
+
+# a lacuna in the text of an xml:id
+LACUNA = 'gap-reason=”lost”'
+VERSE_LACUNA = re.compile('<gap-reason=[”"]lost[”"].*?/>')
+
+# punctuation that would make an xml:id invalid
+PUNCTUATION = re.compile('[,;\'<>()/?]')
+VERSE_PUNCTUATION = re.compile('[,;\'<>()/]')
+
+# A#B#C needs some space before each #, and a # on the first siglum
+PROSE_SPACING = re.compile(r'(#[a-zA-Z(a-z)?])')
+PROSE_FIRST = re.compile(r'((?<!#)^[a-zA-Z(a-z)?\s])')
+VERSE_SPACING = re.compile('(#[a-zA-Z' + GREEK + '(a-z)?])')
+VERSE_FIRST = re.compile('((?<!#)^[a-zA-Z' + GREEK + r'(a-z)?\s])')
+
+# stands for the citation of the entry in a cached fragment of an <app> tag
+LABEL = '\x00'
+# a citation that none of the clean up of identifiers changes, so it can be put into a cached fragment as it is
+PLAIN_LABEL = re.compile(r'[\w. -]*')
+
+# a speaker, e.g. (Dav.)
+SPEAKER = re.compile(r'\(\w+\.*\)')
+# a reading that is a copy of another one
+COPY = re.compile(r'copy\(')
+# the ad hoc "vulgo" witness in a note
+VULGO = re.compile('vulgo')
+
+
+def pointers(sigla, spacing, first):
+    """turns a list of sigla into the value of a @wit or @source attribute, e.g. "#A #B #C"
+
+    :param sigla: the sigla
+    :param spacing: the pattern that finds each # after the first siglum
+    :param first: the pattern that finds the first siglum
+    :return: the attribute value
+    """
+    return first.sub(r'#\1', spacing.sub(r' \1', '#'.join(sigla)))
+
+
+@functools.lru_cache(maxsize=1024)
+def prose_witnesses(wit, kind):
+    """the witnesses of a lemma or reading, the way the prose encoder encodes them. The sigla keep their
+    annotations in @wit. Annotations are only recognized on uppercase Latin and Greek letters, except in rasura,
+    which is recognized on any letter, and only in a reading.
+
+    :param wit: witnesses as one string, separated by spaces (e.g. "A B C(ac) D")
+    :param kind: lem or rdg
+    :return: a tuple with the @wit attribute at index 0 and the annotated sigla at index 1
+    """
+    sigla = parse_sigla(wit)
+    annotated = tuple(s for s in sigla if s.annotation is not None and
+                      (kind == 'rdg' if s.annotation == 'ir' else not s.latin_lowercase()))
+    return 'wit="' + pointers([s.token for s in sigla], PROSE_SPACING, PROSE_FIRST) + '"', annotated
+
+
+@functools.lru_cache(maxsize=1024)
+def verse_witnesses(wit):
+    """the witnesses of a lemma or reading, the way the verse encoders encode them. The annotations are removed
+    from @wit and from the <witDetail> tags.
+
+    :param wit: witnesses as one string, separated by spaces (e.g. "A B C(ac) D")
+    :return: a tuple with the @wit attribute at index 0 and the annotated sigla at index 1
+    """
+    sigla = parse_sigla(wit)
+    annotated = tuple(s for s in sigla if s.annotation is not None)
+    return 'wit="' + pointers([s.bare for s in sigla], VERSE_SPACING, VERSE_FIRST) + '"', annotated
+
+
+@functools.lru_cache(maxsize=1024)
+def source_pointers(source):
+    """
+    :param source: sources as one string, separated by spaces (e.g. "Name OtherName ThirdName")
+    :return: the @source attribute
+    """
+    return 'source="' + pointers([s.token for s in parse_sigla(source)], PROSE_SPACING, PROSE_FIRST) + '"'
+
+
+def supplied_markup(note):
+    """encodes <> in a note as <supplied>
+
+    :param note: the text of a note
+    :return: the note with <supplied> tags
+    """
+    # these chained replaces are sort of hacky, but it'll do
+    # use &&& as a temp placeholder for > that we DON'T want replaced
+    return note.replace('<', '<supplied&&&').replace('>', '</supplied>').replace('&&&', '>')
+
+
+def readings(row, start, stop):
+    """
+    :param row: a row of the apparatus CSV
+    :param start: the column of the first reading
+    :param stop: the column after which no reading starts
+    :return: the reading, witnesses, sources and notes of each reading, in four consecutive columns
+    """
+    return [row[i:i + 4] for i in range(start, stop, 4)]
+
+
+# Each special form of a lemma is a (test, handler) pair. The handler of the first form whose test succeeds
+# returns the lemma as it appears in the base text, the text for its xml:id and the text of the <lem> tag.
+
+def lemma_addition(lem):
+    """handles lemmas of the form '<word> some other words' or 'some words here <word>' in prose"""
+    newLem = lem.split('<')[0] + '<supplied>' + lem.split('<')[1].split('>')[0] + '</supplied>' + lem.split('>')[1]
+    return newLem, lem.replace('<', '').replace('>', '') + " addition", newLem
+
+
+def leading_addition(lem):
+    """handles lemmas of the form '<word> some other words'"""
+    newLem = '<supplied reason="lost">' + lem.split('>')[0].replace('<', '') + '</supplied>' + lem.split('>')[1]
+    return newLem, lem.replace('<', '').replace('>', '') + " addition", newLem
+
+
+def addition(lem):
+    """handles lemmas of the form '<word>'"""
+    word = lem.replace('<', '').replace('>', '')
+    return '<supplied reason="lost">' + word + '</supplied>', word + " addition", \
+        '<supplied reason="lost">' + word + '</supplied>'
+
+
+def crux(lem):
+    """handles lemmas of the form †word†"""
+    word = lem.replace('†', '')
+    return '<sic>' + word + '</sic>', word + " crux", '<sic>' + word + '</sic>'
+
+
+def speaker(lem):
+    """handles a lemma which is a speaker, e.g. (Dav.)"""
+    name = lem.replace("(", "").replace(")", "")
+    return name, name + " speaker", '<label type="speaker">' + name + '</label>'
+
+
+def inline_speaker(lem):
+    """handles a lemma which contains a speaker"""
+    label = lem.replace("(", '<label type="speaker">').replace(")", "</label>")
+    return label, lem.replace("(", "").replace(")", " speaker"), label
+
+
+PROSE_LEMMA_FORMS = [
+    (re.compile(r'\<\w+\>(\s)*\w+ | \w+(\s)*\<\w+\>').match, lemma_addition),
+    (re.compile(r'<\w+>').match, addition),
+    (re.compile(r'†\w+†').match, crux),
+]
+VERSE_LEMMA_FORMS = [
+    (SPEAKER.match, speaker),
+    (re.compile(r'<\w+>(\s)*\w+').match, leading_addition),
+    (re.compile(r'<\w+>').match, addition),
+]
+DRAMA_LEMMA_FORMS = [(SPEAKER.search, inline_speaker)] + VERSE_LEMMA_FORMS[1:]
+
+
+# The handler of a special form of a reading returns the text of the <rdg> tag and the text for its xml:id.
+
+def addition_id(reading):
+    """
+    :param reading: a reading with <supplied> tags
+    :return: the text for its xml:id
+    """
+    return reading.replace('<', '').replace('>', '').replace('supplied', '').replace('reason="lost"', '') + " addition"
+
+
+def prose_partial_lacuna(reading):
+    """handles a <supplied> tag which only includes part of a word, i.e. a lacuna in the middle of a word, in prose"""
+    reading = '<supplied reason="lost">' + reading.split('>')[0].replace('<', '', 1) + '</supplied>' + \
+        reading.split('>')[1]
+    return reading, addition_id(reading)
+
+
+def prose_reading_addition(reading):
+    """handles readings of the form '<word> some other words' or 'some words <word>' in prose"""
+    reading = reading.split('<')[0] + '<supplied reason="lost">' + reading.split('<')[1].split('>')[0] + \
+        '</supplied>' + reading.split('>')[1]
+    return reading, addition_id(reading)
+
+
+def reading_addition(reading):
+    """handles readings of the form '<word>' (or '<some words>' in prose)"""
+    reading = reading.replace('<', '').replace('>', '')
+    return '<supplied reason="lost">' + reading + '</supplied>', reading + " addition"
+
+
+def inline_addition(reading):
+    """handles readings of the form 'word <some words>'"""
+    return supplied_markup(reading), reading + " addition"
+
+
+def deletion(reading):
+    """handles a deletion in a reading [some words] or {some words}.
+    curly braces {} are preferred but square brackets are used in some older editions
+    """
+    reading = reading.replace('[', '').replace(']', '').replace('{', '').replace('}', '')
+    return '<surplus>' + reading + '</surplus>', reading + " deletion"
+
+
+def partial_lacuna(reading):
+    """handles a <supplied> tag which only includes part of a word, i.e. a lacuna in the middle of a word"""
+    reading = '<supplied reason="lost">' + reading.split('>')[0].replace('<', '', 1) + ">" + reading.split('>')[1] + \
+        '</supplied>' + reading.split('>')[2]
+    return reading, addition_id(reading)
+
+
+def reading_leading_addition(reading):
+    """handles readings of the form '<word> some other words' or 'some words <word>'"""
+    reading = '<supplied reason="lost">' + reading.split('>')[0].replace('<', '') + '</supplied>' + \
+        reading.split('>')[1]
+    return reading, addition_id(reading)
+
+
+def reading_speaker(reading):
+    """handles a reading which is a speaker"""
+    return '<label type="speaker">' + reading.replace("(", "").replace(")", "") + '</label>', reading + " speaker"
+
+
+def inline_reading_speaker(reading):
+    """handles a reading which contains a speaker"""
+    return reading.replace("(", '<label type="speaker">').replace(")", "</label>"), reading + " speaker"
+
+
+# some words <word> or <word> some other words
+ADDITION_PHRASE = re.compile(r'\<\w+\>(\s)*\w+ | \w+(\s)*\<\w+\>')
+# this was written to deal with 13.5 but can be generalized as necessary
+PARTIAL_LACUNA = r'\<\w+\s*\<gap reason=”lost”/>\s*\w+\>\w+'
+
+PROSE_READING_FORMS = [
+    (re.compile(PARTIAL_LACUNA + r'|\<\w+\s*\*\*\*\s*\w+\>\w+').search, prose_partial_lacuna),
+    (ADDITION_PHRASE.search, prose_reading_addition),
+    (re.compile(r'<\w+(\s+\w+)*>').search, reading_addition),
+    (re.compile(r'\w+(\s+\w+)*<\w+(\s+\w+)*>').search, inline_addition),
+    (re.compile(r'\[\w+(\s+\w+)*\]|\{\w+(\s+\w+)*\} ').search, deletion),
+]
+VERSE_READING_FORMS = [
+    (SPEAKER.match, reading_speaker),
+    (re.compile(PARTIAL_LACUNA).search, partial_lacuna),
+    (ADDITION_PHRASE.search, reading_leading_addition),
+    (re.compile(r'<\w+>').search, reading_addition),
+]
+DRAMA_READING_FORMS = [(SPEAKER.search, inline_reading_speaker)] + VERSE_READING_FORMS[1:]
+
+
+class FragmentCache():
+    """a bounded cache of the <lem> and <rdg> tags of an edition, without their citations. The same lemma or
+    reading with the same witnesses, sources and notes comes back many times across an edition, so it is classified
+    and encoded once and only its citation is filled in again. Once the cached text is larger than the limit, the
+    least recently used fragments are evicted.
+    """
+
+    def __init__(self, maxsize=1 << 22):
+        """
+        :param maxsize: the most characters of keys and fragments to keep
+        """
+        self.maxsize = maxsize
+        self.size = 0  # the characters of keys and fragments kept
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__fragments = collections.OrderedDict()
+
+    def get(self, key):
+        """
+        :param key: the fields of the lemma or reading
+        :return: the cached fragment, or None if it is not cached
+        """
+        value = self.__fragments.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__fragments.move_to_end(key)
+        return value[0]
+
+    def put(self, key, fragment, size):
+        """
+        :param key: the fields of the lemma or reading
+        :param fragment: the fragment to cache
+        :param size: the characters of the key and the fragment
+        """
+        if size > self.maxsize:
+            return
+        self.__fragments[key] = (fragment, size)
+        self.size += size
+        while self.size > self.maxsize:
+            self.size -= self.__fragments.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def dump(self):
+        """
+        :return: a (key, fragment, size) tuple for each fragment, the least recently used first
+        """
+        return [(key, fragment, size) for key, (fragment, size) in self.__fragments.items()]
+
+    def load(self, fragments):
+        """adds fragments kept from an earlier run, without counting them as hits or misses
+
+        :param fragments: (key, fragment, size) tuples, as dump() returns them
+        """
+        for key, fragment, size in fragments:
+            if key not in self.__fragments:
+                self.put(key, fragment, size)
+
+    def clear(self):
+        """empties the cache and resets its counters"""
+        self.__fragments.clear()
+        self.size = self.hits = self.misses = self.evictions = 0
+
+    def summary(self):
+        """
+        :return: the hit and miss counters, for the summary of a run
+        """
+        return '%d hits, %d misses, %d evictions (%d fragments, %d characters)' % \
+            (self.hits, self.misses, self.evictions, len(self.__fragments), self.size)
+
+
+class Entry():
+    """the parts of a compiled apparatus entry that the encoders use"""
+
+    def __init__(self, searchLem, idLem, lemTag, rdgIDs, tag):
+        self.searchLem = searchLem  # the lemma as it appears in the base text
+        self.idLem = idLem  # the lemma as it appears in its xml:id
+        self.lemTag = lemTag  # the <lem> tag
+        self.rdgIDs = rdgIDs  # the xml:id attribute of each reading
+        self.tag = tag  # the cleaned up <app> tag, with a comment naming the entry
+
+
+class EntryCompiler():
+    """compiles rows of the apparatus CSV into <app> tags.
+
+    A compiler is configured once per genre with its citation scheme and its conventions for lemmas, readings
+    and identifiers, and every pattern it uses is compiled when the module is loaded. The base class follows
+    the verse encoders (poetry, drama and mixed matter); ProseEntryCompiler follows the prose encoder.
+    """
+
+    # the lemma as it appears in the base text, its xml:id text and the text of the <lem> tag, for an empty lemma
+    EMPTY_LEMMA = ('', '', NO_LEMMA)
+    # the comment naming the entry, followed by the <app> tag
+    ENTRY = '<!-- App entry for %s: %s --><app>%s</app>'
+
+    def __init__(self, citation, lemmaForms, readingForms, punctuation=VERSE_PUNCTUATION,
+                 beforeNotes=('an', 'vel'), idInComment=False, cleanup=APP_TAG, fragments=None):
+        """
+        :param citation: the names of the parts of a citation, from the outermost one, e.g. ('poem', 'line')
+        :param lemmaForms: the special forms of a lemma, in order, as (test, handler) pairs
+        :param readingForms: the special forms of a reading, in order, as (test, handler) pairs
+        :param punctuation: the pattern for the characters that are removed from an xml:id
+        :param beforeNotes: the reading notes that go before the reading (e.g. an or vel)
+        :param idInComment: whether the comment naming the entry uses the xml:id text of the lemma
+        :param cleanup: the Rewriter that cleans up the <app> tag
+        :param fragments: the FragmentCache for the <lem> and <rdg> tags, by default a new one
+        """
+        self.citation = citation
+        self.lemmaForms = lemmaForms
+        self.readingForms = readingForms
+        self.punctuation = punctuation
+        self.beforeNotes = beforeNotes
+        self.idInComment = idInComment
+        self.cleanup = cleanup
+        self.fragments = FragmentCache() if fragments is None else fragments
+
+    def entry(self, citation, lemma, readings, comment):
+        """compiles one row of the apparatus CSV into an <app> tag
+
+        :param citation: the citation of the entry, e.g. ('1', '12')
+        :param lemma: the lemma, its witnesses, its sources and its notes
+        :param readings: the reading, witnesses, sources and notes of each reading
+        :param comment: the general annotation on the entry
+        :return: an Entry
+        """
+        label = '.'.join(str(part) for part in citation)
+        searchLem, idLem, lemTag = self.cached(self.lemma, label, lemma)
+
+        rdgTags = ''
+        rdgIDs = []
+        for reading in readings:
+            rdg = self.cached(self.reading, label, reading)
+            if rdg is not None:
+                rdgTags += rdg[1]
+                if rdg[0] is not None:
+                    rdgIDs.append(rdg[0])
+
+        # combine everything into one <app> tag, then clean it up and its smart quotes
+        entries = self.ENTRY % (label, idLem if self.idInComment else searchLem,
+                                lemTag + rdgTags + self.comment_tag(comment))
+        with span('cleanup'):
+            entries = self.cleanup.rewrite(entries).replace("”", "\"")
+        return Entry(searchLem, idLem, lemTag, rdgIDs, entries)
+
+    def cached(self, make, label, fields):
+        """makes the <lem> or <rdg> tag for a lemma or reading through the fragment cache. The tag is made once
+        for each lemma or reading, with LABEL in place of the citation, which is filled in for every entry.
+
+        :param make: lemma or reading
+        :param label: the citation of the entry, e.g. 1.12
+        :param fields: the lemma or reading, its witnesses, its sources and its notes
+        :return: what make returns
+        """
+        if LABEL in ''.join(fields) or not PLAIN_LABEL.fullmatch(label):
+            return make(label, *fields)
+        key = (make.__name__,) + tuple(fields)
+        parts = self.fragments.get(key)
+        if parts is None:
+            fragment = make(LABEL, *fields)
+            # an empty reading is cached as an empty tuple
+            parts = () if fragment is None else tuple(None if part is None else part.split(LABEL)
+                                                      for part in fragment)
+            self.fragments.put(key, parts, sum(len(field) for field in fields) +
+                               sum(len(piece) for part in parts if part is not None for piece in part))
+        if parts == ():
+            return None
+        return tuple(None if part is None else label.join(part) for part in parts)
+
+    def lemma(self, label, lem, wit, source, note):
+        """makes the <lem> tag for one lemma.
+
+        :param label: the citation of the entry, e.g. 1.12
+        :param lem: the lemma as it appears in the spreadsheet
+        :param wit: lemma witnesses as one string, separated by spaces (e.g. "A B C(ac) D")
+        :param source: lemma source(s), separated by spaces (e.g. "Name OtherName ThirdName")
+        :param note: lemma notes as one string. Multiple notes should be separated with the forward slash /
+        :return: a tuple with the lemma as it appears in the base text at index 0, its xml:id text at index 1
+            and the <lem> tag at index 2
+        """
+        searchLem, idLem, lem = self.lemma_form(lem)
+        xmlid, target = self.ids('lem', idLem, label)
+        witAttribute, details = self.witnesses(wit, target, 'lem')
+        return searchLem, idLem, ('<lem ' + witAttribute + ' ' + self.sources(source) + ' ' + xmlid + '>' + lem +
+                                  '</lem>' + details + self.lemma_notes(note, target)).strip()
+
+    def reading(self, label, reading, wit, source, note):
+        """makes the <rdg> tag for one reading.
+
+        :param label: the citation of the entry, e.g. 1.12
+        :param reading: the reading as it appears in the spreadsheet
+        :param wit: reading witnesses as one string, separated by spaces (e.g. "A B C(ac) D")
+        :param source: reading source(s), separated by spaces (e.g. "Name OtherName ThirdName")
+        :param note: reading notes as one string. Multiple notes should be separated with the forward slash /
+        :return: None for an empty reading, otherwise a tuple with the xml:id attribute at index 0
+            (None for a copy of another reading) and the <rdg> tag and its notes at index 1
+        """
+        # empty readings with notes are kept, unless the note makes them a copy of another reading
+        if reading == '':
+            if note == '':
+                return None
+            elif COPY.match(note):
+                return None, '<rdg copyOf="' + self.copy_of(note) + '"/>'
+
+        reading, idRdg = self.reading_form(reading)
+        xmlid, target = self.ids('rdg', idRdg, label)
+        witAttribute, details = self.witnesses(wit, target, 'rdg')
+        before, after = self.reading_notes(note, target)
+        return xmlid, before + '<rdg ' + witAttribute + ' ' + self.sources(source) + ' ' + xmlid + '>' + reading + \
+            '</rdg>' + details + after
+
+    def lemma_form(self, lem):
+        """
+        :param lem: the lemma as it appears in the spreadsheet
+        :return: the lemma as it appears in the base text, its xml:id text and the text of the <lem> tag
+        """
+        if lem == '':
+            return self.EMPTY_LEMMA
+        for test, handler in self.lemmaForms:
+            if test(lem):
+                return handler(lem)
+        return lem, lem, lem
+
+    def reading_form(self, reading):
+        """
+        :param reading: the reading as it appears in the spreadsheet
+        :return: the text of the <rdg> tag and its xml:id text
+        """
+        for test, handler in self.readingForms:
+            if test(reading):
+                return handler(reading)
+        return reading, reading
+
+    def copy_of(self, note):
+        """
+        :param note: a note of the form copy("rdg" or "lem", the full reading it's a copy of, citation...),
+            which names a reading in this apparatus
+        :return: the xml:id of that reading
+        """
+        split = note.split("(")[1].replace(")", "").split(",")
+        citation = [part.strip() for part in split[2:2 + len(self.citation)]]
+        return self.ids(split[0], split[1].strip(), '.'.join(citation))[1]
+
+    def ids(self, kind, text, label):
+        """
+        :param kind: lem or rdg
+        :param text: the text from which to make an identifier
+        :param label: the citation of the entry, e.g. 1.12
+        :return: a tuple with the xml:id attribute at index 0 and its value, for @target, at index 1
+        """
+        # Handle multiple words so that they are joined with "-", and deal with lacunae
+        joined = VERSE_LACUNA.sub("-lacuna-", text.replace(' ', '-')).replace("\"", '')
+        xmlid = self.punctuation.sub('', 'xml:id="' + kind + '-' + label + '-' + joined + '"')
+        return xmlid, xmlid.replace('xml:id=', '').replace('"', '')
+
+    def witnesses(self, wit, target, kind):
+        """
+        :param wit: witnesses as one string, separated by spaces (e.g. "A B C(ac) D")
+        :param target: the xml:id of the lemma or reading
+        :param kind: lem or rdg
+        :return: a tuple with the @wit attribute at index 0 and the <witDetail> tags at index 1
+        """
+        if wit == '':
+            # if no witnesses, return wit=None (will be cleaned up later) and no <witDetail> tags
+            return 'wit="None"', ''
+        witAttribute, annotated = verse_witnesses(wit)
+        # avoid putting spreadsheet markup in witDetail tags
+        return witAttribute, ''.join(s.detail(s.letter, target) for s in annotated)
+
+    def sources(self, source):
+        """
+        :param source: sources as one string, separated by spaces (e.g. "Name OtherName ThirdName")
+        :return: the @source attribute
+        """
+        if not source:
+            return 'source="None"'
+        return source_pointers(source)
+
+    def lemma_notes(self, note, target):
+        """
+        :param note: lemma notes as one string, separated with the forward slash /
+        :param target: the xml:id of the lemma
+        :return: all note tags in a single string
+        """
+        if not note:
+            return NO_LEMMA_ANNOTATION
+        elif "/" not in note:
+            return '<note target="' + target + '">' + note + '</note>'
+
+        noteTags = ''
+        for s in note.split("/"):
+            if VULGO.match(s):
+                # add the ad hoc <wit> tag for vulgo. as a witness
+                noteTags += '<wit target="' + target + '">' + s + '</wit'
+            else:
+                noteTags += '<note target="' + target + '">' + note + '</note>'
+        return noteTags
+
+    def reading_notes(self, note, target):
+        """
+        :param note: reading notes as one string, separated with the forward slash /
+        :param target: the xml:id of the reading
+        :return: a tuple with the note tags that go before the reading at index 0 and the ones that go after it
+            at index 1
+        """
+        if not note:
+            return '', ''
+        elif "/" not in note:
+            return '', '<note target="' + target + '">' + note + '</note>'
+
+        beforeTags = ''
+        noteTags = ''
+        for s in note.split("/"):
+            if s in self.beforeNotes:
+                beforeTags += '<note target="' + target + '">' + s + '</note>'
+            elif VULGO.match(s):
+                # add the ad hoc <wit> tag for vulgo. as a witness
+                noteTags += '<wit>' + s + '</wit>'
+            else:
+                noteTags += '<note target="' + target + '">' + s + '</note>'
+        return beforeTags, noteTags
+
+    def comment_tag(self, comment):
+        """
+        :param comment: the general annotation on the entry
+        :return: the annotation as a <note>
+        """
+        if comment == '':
+            return ''
+        return "<note>" + comment + "</note>"
+
+
+class ProseEntryCompiler(EntryCompiler):
+    """compiles rows of the apparatus CSV into <app> tags, following the conventions of the prose encoder"""
+
+    EMPTY_LEMMA = (NO_LEMMA, NO_LEMMA, NO_LEMMA)
+
+    def __init__(self, citation, lemmaForms, readingForms, punctuation=PUNCTUATION, idRemoved=('', '"'),
+                 cleanup=APP_TAG, fragments=None):
+        """
+        :param citation: the names of the parts of a citation, from the outermost one, e.g. ('paragraph', 'section')
+        :param lemmaForms: the special forms of a lemma, in order, as (test, handler) pairs
+        :param readingForms: the special forms of a reading, in order, as (test, handler) pairs
+        :param punctuation: the pattern for the characters that are removed from an xml:id
+        :param idRemoved: the other characters that are removed from the xml:id of a lemma and of a reading
+        :param cleanup: the Rewriter that cleans up the <app> tag
+        :param fragments: the FragmentCache for the <lem> and <rdg> tags, by default a new one
+        """
+        EntryCompiler.__init__(self, citation, lemmaForms, readingForms, punctuation, cleanup=cleanup,
+                               fragments=fragments)
+        self.__idRemoved = {'lem': str.maketrans('', '', idRemoved[0]), 'rdg': str.maketrans('', '', idRemoved[1])}
+        # / is removed from the @target of a reading but not from the one of a lemma
+        self.__targetRemoved = {'lem': {}, 'rdg': str.maketrans('', '', '/')}
+
+    def lemma_form(self, lem):
+        searchLem, idLem, lem = EntryCompiler.lemma_form(self, lem)
+        return searchLem.strip(), idLem, lem
+
+    def reading(self, label, reading, wit, source, note):
+        # an empty reading has no tag, whatever its notes
+        if reading == '':
+            return None
+        return EntryCompiler.reading(self, label, reading, wit, source, note)
+
+    def ids(self, kind, text, label):
+        xmlid = 'xml:id="' + kind + '-' + label + '-' + \
+                text.translate(self.__idRemoved[kind]).replace(' ', '-').replace(LACUNA, "lacuna") + '"'
+        target = kind + '-' + label + '-' + text.replace(' ', '-').replace(LACUNA, "lacuna")
+        return self.punctuation.sub('', xmlid), target.translate(self.__targetRemoved[kind])
+
+    def witnesses(self, wit, target, kind):
+        if wit == '':
+            return 'wit="None"', ''
+        witAttribute, annotated = prose_witnesses(wit, kind)
+        return witAttribute, ''.join(s.detail(s.token, target) for s in annotated)
+
+    def lemma_notes(self, note, target):
+        if not note:
+            return NO_LEMMA_ANNOTATION
+        return ''.join('<note target="' + target + '">' + supplied_markup(s) + '</note>' for s in note.split("/"))
+
+    def reading_notes(self, note, target):
+        # a reading keeps all its notes in one <note> after the reading
+        if not note:
+            return '', ''
+        return '', '<note target="' + target + '">' + supplied_markup(note) + '</note>'
+
+
+# the compiler for each genre
+PROSE_ENTRIES = ProseEntryCompiler(('paragraph', 'section'), PROSE_LEMMA_FORMS, PROSE_READING_FORMS)
+POETRY_ENTRIES = EntryCompiler(('poem', 'line'), VERSE_LEMMA_FORMS, VERSE_READING_FORMS)
+DRAMA_ENTRIES = EntryCompiler(('act', 'scene', 'line'), DRAMA_LEMMA_FORMS, DRAMA_READING_FORMS, idInComment=True)
+MIXED_MATTER_ENTRIES = EntryCompiler(('section', 'paragraph or poem', 'sentence or line'), VERSE_LEMMA_FORMS,
+                                     VERSE_READING_FORMS, PUNCTUATION, ('an', 'vel', 'uel'))
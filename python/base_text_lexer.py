@@ -0,0 +1,396 @@
+import re  # operations for regular expressions, i.e. very powerful text matching
+import sys  # command line arguments
+
+# this module encodes the structure and the editorial symbols of a plain base text in a single pass.
+# The encoders used to run one re.sub() over the whole text for every symbol, copying the text each time.
+# Here one combined pattern finds every symbol from left to right, and each match is turned into TEI
+# as soon as it is found. The output is collected in one list and joined once at the end.
+# The old chains of re.sub() passes are kept below as reference implementations; run this module on a
+# base text (python base_text_lexer.py text.txt ...) to check that both give the same result.
+
+# Editorial symbols and the markup that opens and closes them.
+# The markup becomes real elements when the base text is parsed; lemmas are matched against the
+# flattened section content (see tei_tree.FlatText), which writes the markup out again.
+EDITORIAL = {
+    'addition': ('<supplied reason="lost">', '</supplied>'),  # <addition>
+    'crux': ('<sic>', '</sic>'),  # †crux†
+    'lacuna': ('<gap reason="lost"/> ', ''),  # ***
+    'deletion': ('<surplus>', '</surplus>'),  # [deletion]
+}
+
+# what each editorial symbol may contain
+LETTERS = r'[a-zA-Z]'
+LETTERS_AND_SPACE = r'[a-zA-Z\s]'  # may run over a line break
+LETTERS_AND_INLINE_SPACE = r'(?:[a-zA-Z]|[^\S\n])'  # any whitespace except a line break
+
+
+def token_pattern(addition=LETTERS, crux=LETTERS, deletion=LETTERS, prose=False):
+    """compiles one pattern that matches every token of a base text, to be used with finditer()
+
+    The name of the group that matched (match.lastgroup) is the kind of token: 'paragraph', 'segment',
+    'addition', 'crux', 'lacuna' or 'deletion'. Paragraph and segment numbers and the contents of
+    additions, cruces and deletions are in the groups named '<kind>_text'.
+
+    :param addition: what an <addition> may contain, e.g. LETTERS
+    :param crux: what a †crux† may contain
+    :param deletion: what a [deletion] may contain
+    :param prose: whether to match the prose structure too (a line break followed by a paragraph number,
+        and (n) segment markers)
+    :return: the compiled pattern
+    """
+    tokens = []
+    if prose:
+        tokens.append(r'(?P<paragraph>\n(?P<paragraph_text>[0-9]*))')
+        tokens.append(r'(?P<segment>\((?P<segment_text>[0-9]*)\))')
+    tokens.append(r'(?P<addition><(?P<addition_text>' + addition + r'*)>)')
+    tokens.append(r'(?P<crux>†(?P<crux_text>' + crux + r'*)†)')
+    tokens.append(r'(?P<lacuna>\*\*\*)')
+    tokens.append(r'(?P<deletion>\[(?P<deletion_text>' + deletion + r'*)\])')
+    return re.compile('|'.join(tokens))
+
+
+# prose: paragraphs, (n) segments and editorial symbols. Additions may contain spaces.
+PROSE_TOKENS = token_pattern(addition=LETTERS_AND_SPACE, prose=True)
+# poetry and mixed matter: editorial symbols only. The lines are encoded separately.
+SYMBOL_TOKENS = token_pattern()
+# drama: editorial symbols only. Cruces and deletions may contain several words, but not a line break.
+DRAMA_SYMBOL_TOKENS = token_pattern(crux=LETTERS_AND_INLINE_SPACE, deletion=LETTERS_AND_INLINE_SPACE)
+
+# a single (n) segment marker, used to look ahead one token
+SEGMENT = re.compile(r'\(([0-9]*)\)')
+
+
+def encode_symbol(match):
+    """encodes one editorial symbol found by a token pattern
+
+    :param match: the match for an addition, crux, lacuna or deletion
+    :return: the TEI markup for the symbol, as a str
+    """
+    kind = match.lastgroup
+    opening, closing = EDITORIAL[kind]
+    if kind == 'lacuna':
+        return opening
+    return opening + match.group(kind + '_text') + closing
+
+
+def encode_symbols(text, tokens=SYMBOL_TOKENS):
+    """encodes the editorial symbols of a base text in a single pass
+
+    :param text: the plain base text (or a chunk of it), as a str
+    :param tokens: the token pattern to use, e.g. SYMBOL_TOKENS or DRAMA_SYMBOL_TOKENS
+    :return: the text with additions, cruces, lacunae and deletions encoded
+    """
+    out = []
+    # start of the text that has not been copied to out yet
+    pos = 0
+    for match in tokens.finditer(text):
+        out.append(text[pos:match.start()])
+        out.append(encode_symbol(match))
+        pos = match.end()
+    out.append(text[pos:])
+    return ''.join(out)
+
+
+class ProseEncoder():
+    """a single-pass encoder for prose base texts, driven by PROSE_TOKENS
+
+    It gives exactly the same result as encode_prose_reference(), including its quirks:
+
+    * every line after the first becomes <p n="[number]">, and lines without a number that are empty are dropped;
+    * each (n) closes the previous segment and opens a new one. A space on both sides of the marker is
+      swallowed: " (1) " becomes <seg n="1"> (the orphan </seg> at the start of a paragraph is dropped too)
+      and " (n) " becomes "</seg> <seg n="n">";
+    * the first line is only wrapped in <p n="1"> if it starts a first segment and there is a paragraph 2.
+    """
+
+    def __init__(self, text):
+        """
+        :param text: the plain prose base text, as a str
+        """
+        self.__text = text
+        # the output buffer, joined once at the end
+        self.__out = []
+        # start of the raw text that has not been copied to the output yet
+        self.__pos = 0
+        # the number of the current paragraph, or None while we are still on the first line
+        self.__n = None
+        # where the current paragraph starts in the output and in the raw text
+        self.__lineOut = 0
+        self.__lineText = 0
+        # whether the current paragraph contains any markup
+        self.__lineMarkup = False
+        # output positions for the first-paragraph fix (see encode())
+        self.__firstOne = None
+        self.__lastP2 = None
+
+    def encode(self):
+        """
+        :return: the encoded text, as a str
+        """
+        text = self.__text
+        out = self.__out
+        for match in PROSE_TOKENS.finditer(text):
+            kind = match.lastgroup
+            if kind == 'paragraph':
+                self.__copy(match.start())
+                self.__endLine(match.start())
+                self.__startLine(match.group('paragraph_text'), match.end())
+            elif kind == 'segment':
+                self.__segment(match)
+            elif kind == 'addition':
+                self.__addition(match)
+            else:
+                self.__copy(match.start())
+                out.append(encode_symbol(match))
+                self.__pos = match.end()
+                self.__lineMarkup = True
+        self.__copy(len(text))
+        self.__endLine(len(text))
+
+        # Go back and fix the first paragraph: the first line is not wrapped in <p> above, and its last segment
+        # is never closed. If it starts with "1 (1)", wrap it up to the (last) second paragraph.
+        if self.__firstOne is not None and self.__lastP2 is not None and self.__lastP2 > self.__firstOne[1]:
+            one, seg = self.__firstOne
+            out[one] = out[one][:-1]
+            out[seg] = '<p n="1">' + out[seg]
+            out[self.__lastP2] = '</seg></p>\n\n' + out[self.__lastP2]
+
+        return ''.join(out)
+
+    def __copy(self, end):
+        """copies the raw text up to end to the output"""
+        self.__out.append(self.__text[self.__pos:end])
+        self.__pos = end
+
+    def __startLine(self, n, start):
+        """opens a new paragraph
+
+        :param n: the paragraph number (may be empty)
+        :param start: where the text of the paragraph starts in the raw text
+        """
+        self.__lineOut = len(self.__out)
+        if n == '2':
+            self.__lastP2 = len(self.__out)
+        self.__out.append('<p n="' + n + '">')
+        self.__n = n
+        self.__lineText = start
+        self.__lineMarkup = False
+        self.__pos = start
+
+    def __endLine(self, end):
+        """closes the current paragraph, or drops it if it is empty
+
+        :param end: where the paragraph ends in the raw text
+        """
+        if self.__n is None:
+            # the first line isn't wrapped in <p> (see encode())
+            return
+        rest = self.__text[self.__lineText:end]
+        if self.__n == '' and not self.__lineMarkup and (rest == '' or rest.isspace()):
+            # empty paragraph caused by line breaks in the original document
+            del self.__out[self.__lineOut:]
+        else:
+            self.__out.append('</seg></p>')
+
+    def __addition(self, match):
+        """encodes an <addition>, which may run over a line break"""
+        text = self.__text
+        out = self.__out
+        opening, closing = EDITORIAL['addition']
+        self.__copy(match.start())
+        out.append(opening)
+        self.__lineMarkup = True
+        start, end = match.span('addition_text')
+        # a line break inside an addition still starts a new (unnumbered) paragraph
+        newline = text.find('\n', start, end)
+        while newline != -1:
+            out.append(text[start:newline])
+            self.__endLine(newline)
+            self.__startLine('', newline + 1)
+            start = newline + 1
+            newline = text.find('\n', start, end)
+        out.append(text[start:end] + closing)
+        self.__lineMarkup = True
+        self.__pos = match.end()
+
+    def __space(self, i):
+        """checks whether the raw character at i is a space that may be swallowed around a segment marker"""
+        return 0 <= i < len(self.__text) and self.__text[i] != '\n' and self.__text[i].isspace()
+
+    def __segment(self, match):
+        """encodes an (n) segment marker"""
+        text = self.__text
+        out = self.__out
+        start, end = match.span()
+        n = match.group('segment_text')
+        before = start - 1
+        # the space before the marker may already have been swallowed by the previous marker
+        spaceBefore = before >= self.__pos and self.__space(before)
+        spaceAfter = self.__space(end)
+        self.__lineMarkup = True
+
+        if spaceBefore and spaceAfter and n == '1':
+            # " (1) " drops both spaces and the orphan </seg>
+            out.append(text[self.__pos:before])
+            if self.__firstOne is None and before - 1 >= self.__pos and text[before - 1] == '1':
+                # remember the first "1<seg" for the first-paragraph fix
+                self.__firstOne = (len(out) - 1, len(out))
+            out.append('<seg n="1">')
+            self.__pos = end + 1
+        elif spaceBefore and spaceAfter and not self.__swallowsSpace(end + 1):
+            # " (n) " becomes "</seg> <seg n="n">"
+            out.append(text[self.__pos:before])
+            out.append('</seg> <seg n="' + n + '">')
+            self.__pos = end + 1
+        else:
+            out.append(text[self.__pos:start])
+            out.append('</seg><seg n="' + n + '">')
+            self.__pos = end
+
+    def __swallowsSpace(self, i):
+        """checks whether a " (1) " starting right after the space before i claims that space first"""
+        nextSegment = SEGMENT.match(self.__text, i)
+        return nextSegment is not None and nextSegment.group(1) == '1' and self.__space(nextSegment.end())
+
+
+def encode_prose(text):
+    """encodes the paragraphs, segments and editorial symbols of a prose base text in a single pass
+
+    :param text: the plain prose base text, as a str
+    :return: the encoded text, ready to be wrapped in the TEI header and footer
+    """
+    return ProseEncoder(text).encode()
+
+
+def encode_prose_reference(text):
+    """the original chain of re.sub() passes for prose, kept to check encode_prose() against.
+
+    :param text: the plain prose base text, as a str
+    :return: the encoded text
+    """
+    # Handle additive emendation, since it is indicated by < >, which would be swept up by other routines below.
+    search_addition = re.compile(r'<([a-zA-Z\s]*)>')
+    replace0 = search_addition.sub(r'<supplied reason="lost">\1</supplied>', text)
+
+    # Search for numbers at beginning of paragraphs, then wrap paragraph in <p n="[number]"> </p>/
+    search_paragraph = re.compile(r'\n([0-9]*)(.*)')
+    replace1 = search_paragraph.sub(r'<p n="\1">\2</p>', replace0)
+
+    # Remove empty paragraphs.
+    search_empty_paragraph = re.compile(r'<p n="">([\s]*)</p>')
+    replace2 = search_empty_paragraph.sub(r'', replace1)
+
+    # Search for (number) and reformat it as <seg n="number">(number).
+    search_segment = re.compile(r'\(([0-9]*)\)')
+    replace3 = search_segment.sub(r'<seg n="\1">', replace2)
+
+    # Add the closing </seg>.
+    search_add_close_seg = re.compile(r'(<seg|</p>)')
+    replace4 = search_add_close_seg.sub(r'</seg>\1', replace3)
+
+    # Remove the orphan </seg> at the beginning of the paragraph.
+    search_remove_orphan_seg = re.compile(r'\s</seg>(<seg n="1">)\s')
+    replace5 = search_remove_orphan_seg.sub(r'\1', replace4)
+
+    # Remove space before and after <seg> markers.
+    search_remove_seg_space = re.compile(r'\s</seg><seg n="([0-9]*)">\s')
+    replace6 = search_remove_seg_space.sub(r'</seg> <seg n="\1">', replace5)
+
+    # Handle crux.
+    search_crux = re.compile(r'†([a-zA-Z]*)†')
+    replace7 = search_crux.sub(r'<sic>\1</sic>', replace6)
+
+    # Handle lacuna.
+    search_lacuna = re.compile(r'\*\*\*')
+    replace8 = search_lacuna.sub(r'<gap reason="lost"/> ', replace7)
+
+    # Handle editorial deletion.
+    search_deletion = re.compile(r'\[([a-zA-Z]*)\]')
+    replace9 = search_deletion.sub(r'<surplus>\1</surplus>', replace8)
+
+    # Go back and fix the first paragraph, for some reason.
+    search_first_p = re.compile(r'1<seg(.*)<p n="2"')
+    return search_first_p.sub(r'<p n="1"><seg\1</seg></p>\n\n<p n="2"', replace9)
+
+
+def encode_symbols_reference(text, drama=False):
+    """the original re.sub() passes for editorial symbols in poetry, drama and mixed matter,
+    kept to check encode_symbols() against.
+
+    Poetry and drama used to encode cruces and deletions after the lines had been joined, so drama's
+    multi-word cruces and deletions could never run over a line break. Drama's patterns were written
+    (([a-zA-Z]*\s*)*), which matches the same text as [a-zA-Z\s]* but backtracks exponentially on an
+    unclosed † or [ followed by a few dozen words, so the flat form is used here.
+
+    :param text: the plain base text, as a str
+    :param drama: whether to use drama's patterns for cruces and deletions
+    :return: the text with editorial symbols encoded
+    """
+    search_addition = re.compile(r'<([a-zA-Z]*)>')
+    replace0 = search_addition.sub(r'<supplied reason="lost">\1</supplied>', text)
+
+    search_lacuna = re.compile(r'\*\*\*')
+    replace1 = search_lacuna.sub(r'<gap reason="lost"/> ', replace0)
+
+    # drama's patterns, with the line break taken out of \s
+    if drama:
+        search_crux = re.compile(r'†((?:[a-zA-Z]|[^\S\n])*)†')
+        search_deletion = re.compile(r'\[((?:[a-zA-Z]|[^\S\n])*)\]')
+    else:
+        search_crux = re.compile(r'†([a-zA-Z]*)†')
+        search_deletion = re.compile(r'\[([a-zA-Z]*)\]')
+    replace2 = search_crux.sub(r'<sic>\1</sic>', replace1)
+    return search_deletion.sub(r'<surplus>\1</surplus>', replace2)
+
+
+def first_difference(a, b):
+    """
+    :return: the offset of the first character where a and b differ, or None if they are equal
+    """
+    if a == b:
+        return None
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def check(text):
+    """checks the single-pass encoders against the reference implementations for one base text
+
+    :param text: the plain base text, as a str
+    :return: a list of (encoder name, offset of the first difference, new output, reference output)
+        for every encoder that disagrees
+    """
+    failures = []
+    pairs = [
+        ('prose', encode_prose(text), encode_prose_reference(text)),
+        ('symbols', encode_symbols(text), encode_symbols_reference(text)),
+        ('drama symbols', encode_symbols(text, DRAMA_SYMBOL_TOKENS), encode_symbols_reference(text, drama=True)),
+    ]
+    for name, new, reference in pairs:
+        offset = first_difference(new, reference)
+        if offset is not None:
+            failures.append((name, offset, new, reference))
+    return failures
+
+
+def main():
+    """checks the single-pass encoders on the base texts given on the command line"""
+    ok = True
+    for path in sys.argv[1:]:
+        with open(path, encoding='utf-8') as source_file:
+            text = source_file.read()
+        failures = check(text)
+        for name, offset, new, reference in failures:
+            ok = False
+            print(path + ": " + name + " differs from the reference at offset " + str(offset))
+            print("    new:       " + repr(new[max(offset - 40, 0):offset + 40]))
+            print("    reference: " + repr(reference[max(offset - 40, 0):offset + 40]))
+        if not failures:
+            print(path + ": OK")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import os  # 'operating system' - used for file input/output
+import sys  # command line arguments
+import io  # collects the encoders' output so that it doesn't clutter the report
+import csv  # reads the manifest of editions
+import json  # writes the report
+import time  # times each edition
+import argparse  # reads the flags of the batch
+import importlib  # loads the encoder for each edition
+import contextlib  # redirects the encoders' output
+from concurrent.futures import ProcessPoolExecutor, as_completed  # encodes several editions at once
+
+# this script encodes many editions in one go, several at once, and writes a report of how each of them went.
+# Usage: python batch_encoding.py [--jobs N] [--report report.json] [encoder flags, e.g. --validate] manifest.csv
+#
+# The manifest is a CSV file with one edition per row, in the columns
+#   Genre, Base text, Apparatus, Output, Log
+# where the genre is prose, poetry, drama or mixed matter, and the paths are relative to the manifest. The log
+# may be left empty, in which case it is written next to the output, e.g. carmen4.log for carmen4.xml.
+# See sources/sample-editions.csv.
+#
+# Each process keeps the encoders it has loaded, so the patterns compiled when they are imported, the memoized
+# lemma patterns and sigla, the cached <lem> and <rdg> tags of each genre and the compiled schema are shared
+# by every edition that process encodes.
+
+# the encoder of each genre. Servius reads its own hard-coded files, so it can't be run from a manifest.
+ENCODERS = {
+    'prose': 'prose_encoding',
+    'poetry': 'poetry_encoding',
+    'drama': 'drama_encoding',
+    'mixed matter': 'mixed_matter_encoding',
+}
+
+# the quality metrics that every encoder returns, in the order they are reported
+METRICS = ('rows', 'successful', 'invalid', 'not found', 'quarantined')
+
+
+def read_manifest(path):
+    """
+    :param path: the manifest
+    :return: a list with a (genre, base text, apparatus, output, log) tuple for each edition, with absolute paths
+    """
+    root = os.path.dirname(os.path.abspath(path))
+    editions = []
+    with open(path, encoding='utf-8') as manifest:
+        for lineNum, row in enumerate(csv.reader(manifest), 1):
+            if not row or not ''.join(row).strip() or row[0].strip() == 'Genre':
+                # skip blank rows and the first row, which contains column labels
+                continue
+            if len(row) < 4:
+                raise ValueError(path + ', line ' + str(lineNum) + ': expected Genre, Base text, Apparatus, Output '
+                                 'and Log, found ' + ','.join(row))
+            # e.g. "Mixed-Matter" or "mixed_matter" are the same genre as "mixed matter"
+            genre = ' '.join(row[0].strip().lower().replace('-', ' ').replace('_', ' ').split())
+            if genre not in ENCODERS:
+                raise ValueError(path + ', line ' + str(lineNum) + ': unknown genre ' + row[0] + ', expected one of '
+                                 + ', '.join(ENCODERS))
+            baseText, appCrit, output = (os.path.join(root, cell.strip()) for cell in row[1:4])
+            if len(row) > 4 and row[4].strip() != '':
+                log = os.path.join(root, row[4].strip())
+            else:
+                log = os.path.splitext(output)[0] + '.log'
+            editions.append((genre, baseText, appCrit, output, log))
+    return editions
+
+
+def load_encoders():
+    """imports every encoder once per process, so that their compiled patterns are ready for every edition"""
+    for name in ENCODERS.values():
+        importlib.import_module(name)
+
+
+def encode(edition, flags=()):
+    """encodes one edition with the encoder of its genre, in the process that runs this function
+
+    :param edition: a (genre, base text, apparatus, output, log) tuple
+    :param flags: the flags for the encoder, e.g. ['--validate']
+    :return: the report on the edition, as a dict
+    """
+    genre, baseText, appCrit, output, log = edition
+    report = {'genre': genre, 'base text': baseText, 'apparatus': appCrit, 'output': output, 'log': log,
+              'diagnostics': log + '.jsonl', 'process': os.getpid(), 'error': None}
+
+    encoder = importlib.import_module(ENCODERS[genre])
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    argv = sys.argv
+    sys.argv = ([encoder.__file__, baseText, appCrit, output, log] + list(flags)
+                + ['--no-open', '--progress', 'silent'])
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            report.update(encoder.main())
+    except Exception as error:
+        # one broken edition shouldn't stop the rest of the batch
+        report['error'] = type(error).__name__ + ': ' + str(error)
+    finally:
+        sys.argv = argv
+    # wall clock time includes waiting for the disk and for the other processes; CPU time doesn't
+    report['seconds'] = time.perf_counter() - start
+    report['cpu seconds'] = time.process_time() - cpuStart
+    return report
+
+
+def summarize(reports, seconds, jobs):
+    """
+    :param reports: the report on each edition
+    :param seconds: how long the whole batch took
+    :param jobs: the number of processes
+    :return: the aggregate report, as a dict
+    """
+    encoded = [report for report in reports if report['error'] is None]
+    totals = {metric: sum(report[metric] for report in encoded) for metric in METRICS}
+    totals['success rate'] = totals['successful'] / totals['rows'] if totals['rows'] > 0 else None
+    totals['editions'] = len(reports)
+    totals['failed editions'] = len(reports) - len(encoded)
+    totals['cpu seconds'] = sum(report['cpu seconds'] for report in reports)
+    totals['seconds'] = seconds
+    return {'jobs': jobs, 'totals': totals, 'editions': reports}
+
+
+def print_report(summary):
+    """prints the aggregate report as a table, one edition per line
+
+    :param summary: the aggregate report
+    """
+    print("%-40s %-13s %6s %10s %7s %9s %8s %8s" % ('edition', 'genre', 'rows', 'successful', 'invalid',
+                                                    'not found', 'seconds', 'cpu'))
+    for report in summary['editions']:
+        name = os.path.basename(report['output'])
+        if report['error'] is not None:
+            print("%-40s %-13s **** failed: %s" % (name, report['genre'], report['error']))
+            continue
+        print("%-40s %-13s %6d %10d %7d %9d %8.2f %8.2f" % (name, report['genre'], report['rows'],
+                                                            report['successful'], report['invalid'],
+                                                            report['not found'], report['seconds'],
+                                                            report['cpu seconds']))
+    totals = summary['totals']
+    print("%-40s %-13s %6d %10d %7d %9d %8.2f %8.2f" % ('total', '', totals['rows'], totals['successful'],
+                                                        totals['invalid'], totals['not found'], totals['seconds'],
+                                                        totals['cpu seconds']))
+    if totals['success rate'] is not None: print("Success rate:", totals['success rate'])
+    if totals['failed editions'] > 0: print("Editions that could not be encoded:", totals['failed editions'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='encodes the editions listed in a manifest, several at once')
+    parser.add_argument('manifest', help='CSV file with the Genre, Base text, Apparatus, Output and Log of each edition')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='the number of editions encoded at once (default: the number of cores)')
+    parser.add_argument('--report', help='where to write the report as JSON (default: next to the manifest)')
+    # every other flag, e.g. --validate, is passed on to the encoders
+    options, flags = parser.parse_known_args(sys.argv[1:])
+    report = options.report or os.path.splitext(options.manifest)[0] + '-report.json'
+
+    editions = read_manifest(options.manifest)
+    jobs = max(1, min(options.jobs, len(editions)))
+    print("Encoding", len(editions), "editions with", jobs, "processes ...")
+
+    start = time.perf_counter()
+    reports = [None] * len(editions)
+    if jobs == 1:
+        for i, edition in enumerate(editions):
+            reports[i] = encode(edition, flags)
+            print("Finished", os.path.basename(edition[3]))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=load_encoders) as pool:
+            futures = {pool.submit(encode, edition, flags): i for i, edition in enumerate(editions)}
+            for future in as_completed(futures):
+                # the reports are kept in the order of the manifest
+                reports[futures[future]] = future.result()
+                print("Finished", os.path.basename(editions[futures[future]][3]))
+    summary = summarize(reports, time.perf_counter() - start, jobs)
+
+    with open(report, 'w', encoding='utf-8') as out:
+        json.dump(summary, out, indent=2, ensure_ascii=False)
+    print_report(summary)
+    print("The report was written to", report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+import os  # 'operating system' - used for the paths of the corpora and the results
+import sys  # command line arguments
+import io  # collects the progress events of the encoders
+import json  # reads the progress events and writes the results
+import time  # times each run
+import argparse  # reads the flags of the benchmark
+import platform  # records the machine the benchmark ran on
+import resource  # measures the peak memory of each run
+import statistics  # the median of the runs
+import subprocess  # finds the commit the benchmark ran on
+import importlib  # loads the encoder of each corpus
+import tempfile  # where the encoded files are written
+import contextlib  # redirects the encoders' output
+import multiprocessing  # runs every encoding in a fresh process, so that its peak memory is its own
+from concurrent.futures import ProcessPoolExecutor  # the fresh process of each run
+import lxml.etree as ET  # records the version of lxml
+from batch_encoding import ENCODERS, read_manifest  # reads the editions of --manifest
+
+# this script encodes the sample editions in the repository with their encoders and reports how fast that was.
+# Usage: python benchmark.py [--repeat N] [--output results.json] [--compare earlier.json]
+#                            [--corpus NAME ...] [--manifest manifest.csv] [encoder flags, e.g. --jobs 2]
+#
+# Each run encodes one corpus in a new process, so that it pays for importing the encoder and compiling its
+# patterns, as a user would, and so that the peak memory of the process is the memory of that run. The time of
+# each stage of the encoder is read from its --progress json events. The results are written as JSON, by default
+# to results/benchmark-<date>-<time>.json, and --compare prints how much faster or slower each corpus is than in
+# an earlier results file.
+#
+# --manifest adds the editions of a manifest (see batch_encoding.py), e.g. the synthetic editions of several sizes
+# written by synthetic_corpus.py, so that the rows per second of each size show how an encoder scales.
+
+# the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> the encoder, the base text and the apparatus, relative to the root of the repository
+CORPORA = {
+    'prose': ('prose_encoding', 'damon/balex_full.txt', 'damon/BAlex_full_app_crit.csv'),
+    'poetry': ('poetry_encoding', 'sources/calp-sicc-carmen4.txt', 'sources/poetry-test.csv'),
+    'drama': ('drama_encoding', 'sources/drama-base-text.txt', 'sources/drama-test.csv'),
+    'mixed matter': ('mixed_matter_encoding', 'sources/mixed-matter-base-text.txt',
+                     'sources/mixed-matter-app-crit.csv'),
+    # Servius reads these from the hard-coded paths ../kaster/bk9.txt and ../kaster/excel_as_word_gfm.csv, so it
+    # is run in a copy of that layout, where it can't overwrite kaster/test-output.xml
+    'servius': ('servius_encoding', 'kaster/bk9.txt', 'kaster/excel_as_word_gfm.csv'),
+}
+
+
+def peak_memory():
+    """
+    :return: the peak resident memory of this process, in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def stage_times(events):
+    """
+    :param events: the --progress json events of a run, one per line
+    :return: a dict from each stage of the run, in order, to the seconds it took
+    """
+    stages = {}
+    stage = None
+    for line in events.splitlines():
+        if not line.startswith('{'):
+            continue
+        event = json.loads(line)
+        if event['event'] not in ('stage', 'summary'):
+            continue
+        if stage is not None:
+            name, start = stage
+            stages[name] = stages.get(name, 0) + event['seconds'] - start
+        stage = (event['message'], event['seconds']) if event['event'] == 'stage' else None
+    return stages
+
+
+def encode(name, corpus, flags, directory):
+    """encodes one corpus, in the process that runs this function
+
+    :param name: the name of the corpus, e.g. 'prose'
+    :param corpus: the encoder, the base text and the apparatus of the corpus, as in CORPORA
+    :param flags: the flags for the encoder, e.g. ['--jobs', '2']
+    :param directory: where to write the output and the log
+    :return: the measurements of the run, as a dict
+    """
+    module, baseText, appCrit = corpus
+    result = {'error': None}
+    cwd = os.getcwd()
+    if module == 'servius_encoding':
+        # ../kaster/bk9.txt and ../kaster/excel_as_word_gfm.csv, seen from directory/python
+        os.makedirs(os.path.join(directory, 'kaster'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'python'), exist_ok=True)
+        for path in (baseText, appCrit):
+            link = os.path.join(directory, path)
+            if not os.path.exists(link):
+                os.symlink(os.path.join(ROOT, path), link)
+        os.chdir(os.path.join(directory, 'python'))
+
+    start = time.perf_counter()
+    try:
+        encoder = importlib.import_module(module)
+    except Exception as error:
+        # e.g. Servius, which reads the table of sources from a path on its author's machine when it is imported
+        result['error'] = type(error).__name__ + ': ' + str(error)
+        os.chdir(cwd)
+        return result
+    result['import seconds'] = time.perf_counter() - start
+
+    output = os.path.join(directory, name.replace(' ', '-') + '.xml')
+    argv = sys.argv
+    sys.argv = ([encoder.__file__, os.path.join(ROOT, baseText), os.path.join(ROOT, appCrit), output,
+                 os.path.splitext(output)[0] + '.log'] + list(flags) + ['--no-open', '--progress', 'json'])
+    events = io.StringIO()
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    try:
+        with contextlib.redirect_stdout(events):
+            result.update(encoder.main())
+    except Exception as error:
+        result['error'] = type(error).__name__ + ': ' + str(error)
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
+    result['seconds'] = time.perf_counter() - start
+    result['cpu seconds'] = time.process_time() - cpuStart
+    result['peak memory'] = peak_memory()
+    result['stages'] = stage_times(events.getvalue())
+    return result
+
+
+def benchmark(name, corpus, flags, repeat):
+    """encodes a corpus repeat times, each time in a new process
+
+    :param name: the name of the corpus
+    :param corpus: the encoder, the base text and the apparatus of the corpus
+    :param flags: the flags for the encoder
+    :param repeat: the number of runs
+    :return: the results of the corpus, as a dict
+    """
+    module, baseText, appCrit = corpus
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(repeat):
+            # spawn, not fork, so that the new process doesn't start with the memory of this one
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                runs.append(pool.submit(encode, name, corpus, flags, directory).result())
+            if runs[-1]['error'] is not None:
+                break
+
+    result = {'corpus': name, 'encoder': module, 'base text': baseText, 'apparatus': appCrit,
+              'error': runs[-1]['error']}
+    if result['error'] is not None:
+        return result
+    seconds = [run['seconds'] for run in runs]
+    # the stages of the median run
+    median = sorted(runs, key=lambda run: run['seconds'])[len(runs) // 2]
+    result.update({
+        'rows': median['rows'],
+        'seconds': seconds,
+        'median seconds': statistics.median(seconds),
+        'best seconds': min(seconds),
+        'rows per second': median['rows'] / statistics.median(seconds) if statistics.median(seconds) > 0 else None,
+        'import seconds': statistics.median(run['import seconds'] for run in runs),
+        'cpu seconds': median['cpu seconds'],
+        'peak memory': max(run['peak memory'] for run in runs),
+        'stages': median['stages'],
+    })
+    return result
+
+
+def commit():
+    """
+    :return: the commit of the repository, or None if it isn't a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, earlier=None):
+    """prints the results as a table, one corpus per line, with the time of each stage below it
+
+    :param results: the results of the benchmark
+    :param earlier: the results of an earlier benchmark to compare with, or None
+    """
+    before = {corpus['corpus']: corpus for corpus in earlier['corpora']} if earlier else {}
+    print("%-20s %7s %10s %10s %12s %10s %9s" % ('corpus', 'rows', 'median s', 'best s', 'rows/s', 'peak MB',
+                                                        'vs before'))
+    for corpus in results['corpora']:
+        if corpus['error'] is not None:
+            print("%-20s **** not run: %s" % (corpus['corpus'], corpus['error']))
+            continue
+        change = ''
+        previous = before.get(corpus['corpus'])
+        if previous is not None and previous.get('error') is None and corpus['median seconds'] > 0:
+            # e.g. 1.25x means this run is a quarter faster than the earlier one
+            change = '%.2fx' % (previous['median seconds'] / corpus['median seconds'])
+        print("%-20s %7d %10.3f %10.3f %12.1f %10.1f %9s" % (corpus['corpus'], corpus['rows'],
+                                                             corpus['median seconds'], corpus['best seconds'],
+                                                             corpus['rows per second'] or 0,
+                                                             corpus['peak memory'] / (1 << 20), change))
+        print("    %-52s %8.3f" % ('importing the encoder', corpus['import seconds']))
+        for stage, seconds in corpus['stages'].items():
+            print("    %-52s %8.3f" % (stage[:52], seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='times the encoders on the sample editions in the repository')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs of each corpus (default: 3)')
+    parser.add_argument('--corpus', action='append', choices=list(CORPORA),
+                        help='a corpus to run; may be given more than once (default: all of them)')
+    parser.add_argument('--manifest', help='a manifest of more editions to run, e.g. from synthetic_corpus.py')
+    parser.add_argument('--output', help='where to write the results as JSON (default: results/benchmark-<date>.json)')
+    parser.add_argument('--compare', help='the results of an earlier benchmark to compare with')
+    # every other flag, e.g. --jobs 2, is passed on to the encoders
+    options, flags = parser.parse_known_args(sys.argv[1:])
+    output = options.output or os.path.join(ROOT, 'results', time.strftime('benchmark-%Y%m%d-%H%M%S.json'))
+
+    results = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit(),
+        'python': platform.python_version(),
+        'lxml': ET.__version__,
+        'machine': platform.platform(),
+        'cpus': os.cpu_count(),
+        'flags': flags,
+        'repeat': options.repeat,
+        'corpora': [],
+    }
+    # the sample editions, unless only a manifest was given
+    corpora = {name: CORPORA[name] for name in options.corpus or ([] if options.manifest else CORPORA)}
+    if options.manifest:
+        for genre, baseText, appCrit, edition, log in read_manifest(options.manifest):
+            # e.g. prose-10000, after its output
+            corpora[os.path.splitext(os.path.basename(edition))[0]] = (ENCODERS[genre], baseText, appCrit)
+    for name, corpus in corpora.items():
+        print("Encoding", name, options.repeat, "times ...")
+        results['corpora'].append(benchmark(name, corpus, flags, max(1, options.repeat)))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as out:
+        json.dump(results, out, indent=2, ensure_ascii=False)
+    earlier = None
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as previous:
+            earlier = json.load(previous)
+    print_report(results, earlier)
+    print("The results were written to", output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# the TEI namespace, in the {uri} form lxml uses for tag names
+TEI = '{http://www.tei-c.org/ns/1.0}'
+
+# A citation scheme describes how a citation in the apparatus CSV maps onto the structure of the base text.
+# Each level is a (tag, subtype) pair, from the outermost level to the innermost one.
+# The innermost level is the element that receives the <app> tags (a <seg>, an <l> or a verse <div>).
+# A subtype of None means "any element with this tag"; for <div>, only textpart divs are considered.
+# Each level is keyed on its @n attribute.
+PROSE = (('p', None), ('seg', None))  # paragraph, section
+POETRY = (('div', 'poem'), ('l', None))  # poem, line
+# act, scene, line. Acts and scenes are matched by nesting, not by @subtype,
+# because drama_encoding marks every scene after the first with subtype="act".
+DRAMA = (('div', None), ('div', None), ('l', None))
+MIXED_PROSE = (('div', 'section'), ('p', None), ('seg', None))  # section, paragraph, sentence
+MIXED_POETRY = (('div', 'section'), ('div', 'poem'), ('l', None))  # section, poem, line
+SERVIUS = (('div', 'verse'),)  # verse of Vergil (the base text is a single book)
+
+
+class CitationIndex():
+    """A dict from citation tuples to elements of the base text, built once after the base text is parsed.
+
+    The encoders used to build an XPath string for every CSV row and call root.find(), which walks the
+    whole tree again each time. The index walks the tree once and then answers each lookup in O(1).
+
+    The index holds references to the elements themselves, so changing the text of an element does not
+    invalidate it. Call rebuild() after anything that adds, removes or renumbers structural elements.
+    """
+
+    def __init__(self, root, scheme):
+        """
+        :param root: the root element of the encoded base text
+        :param scheme: a citation scheme, e.g. PROSE or DRAMA
+        """
+        self.root = root
+        self.scheme = scheme
+        self.__index = {}
+        self.rebuild()
+
+    def rebuild(self, root=None):
+        """(re)build the index, optionally for a new root element (e.g. after the tree has been reparsed)
+
+        :param root: the new root element. If None, the current root is indexed again.
+        """
+        if root is not None:
+            self.root = root
+
+        self.__index = {}
+        leafTag, leafSubtype = self.scheme[-1]
+        for leaf in self.root.iter(TEI + leafTag):
+            if not self.__matches(leaf, leafTag, leafSubtype):
+                continue
+
+            # walk up the tree, looking for the nearest ancestor that matches each enclosing level
+            key = [leaf.get('n', '').strip()]
+            current = leaf
+            for tag, subtype in reversed(self.scheme[:-1]):
+                current = current.getparent()
+                while current is not None and not self.__matches(current, tag, subtype):
+                    current = current.getparent()
+                if current is None:
+                    break
+                key.insert(0, current.get('n', '').strip())
+
+            if len(key) == len(self.scheme):
+                # the first element for a citation wins, just as root.find() returned the first match
+                self.__index.setdefault(tuple(key), leaf)
+
+    @staticmethod
+    def __matches(element, tag, subtype):
+        """checks whether an element belongs to one level of a citation scheme"""
+        if element.tag != TEI + tag:
+            return False
+        if tag == 'div' and element.get('type') != 'textpart':
+            return False
+        return subtype is None or element.get('subtype') == subtype
+
+    def find(self, *citation):
+        """looks up the element for a citation, e.g. index.find('12', '3')
+
+        :param citation: the citation, one value per level of the scheme (e.g. paragraph and section numbers)
+        :return: the element, or None if the base text has no such element
+        """
+        return self.__index.get(tuple(str(c).strip() for c in citation))
+
+    def items(self):
+        """
+        :return: the (citation, element) pairs of the index, in document order
+        """
+        return self.__index.items()
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, citation):
+        return tuple(str(c).strip() for c in citation) in self.__index
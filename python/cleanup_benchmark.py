@@ -0,0 +1,101 @@
+import os  # 'operating system' - used for file input/output
+import sys  # command line arguments
+import io  # collects the encoders' output so that it doesn't clutter the report
+import re  # operations for regular expressions, i.e. very powerful text matching
+import contextlib  # redirects the encoders' output
+import importlib  # loads the encoder for each sample edition
+import tempfile  # somewhere to put the XML and the logs of the sample runs
+import timeit  # times the clean up
+from app_cleanup import APP_TAG  # the compiled <app> tag clean up
+
+# this script compares the compiled clean up of <app> tags with applying its rules one by one, the way the
+# encoders used to. Usage: python cleanup_benchmark.py [repository root]
+
+# the encoder, base text and CSV of each sample edition, relative to the root of the repository
+SAMPLE_EDITIONS = [
+    ('prose_encoding', 'damon/balex_full.txt', 'damon/BAlex_full_app_crit.csv'),
+    ('poetry_encoding', 'sources/calp-sicc-carmen4.txt', 'sources/poetry-test.csv'),
+    ('drama_encoding', 'sources/drama-base-text.txt', 'sources/drama-test.csv'),
+    ('mixed_matter_encoding', 'sources/mixed-matter-base-text.txt', 'sources/mixed-matter-app-crit.csv'),
+]
+
+
+def collect(root):
+    """runs the encoders on the sample editions and records every <app> tag they clean up
+
+    :param root: the root of the repository
+    :return: the <app> tags, as they were before the clean up
+    """
+    tags = []
+    rewrite = APP_TAG.rewrite
+
+    def record(entries):
+        tags.append(entries)
+        return rewrite(entries)
+
+    # every encoder cleans up its <app> tags with APP_TAG, so recording what it rewrites records all of them
+    APP_TAG.rewrite = record
+    try:
+        with tempfile.TemporaryDirectory() as outDir:
+            for name, baseText, appCrit in SAMPLE_EDITIONS:
+                encoder = importlib.import_module(name)
+                argv = sys.argv
+                sys.argv = [name, os.path.join(root, baseText), os.path.join(root, appCrit),
+                            os.path.join(outDir, name + '.xml'), os.path.join(outDir, name + '.log'),
+                            '--no-open', '--progress', 'silent']
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        encoder.main()
+                finally:
+                    sys.argv = argv
+    finally:
+        del APP_TAG.rewrite
+    return tags
+
+
+def one_by_one(rules, entries):
+    """applies the rules one by one, compiling each of them on every call, like the old clean up functions did
+
+    :param rules: the rules, in order
+    :param entries: an <app> tag
+    :return: the cleaned up tag
+    """
+    for rule in rules:
+        entries = re.compile(rule.pattern).sub(rule.replacement, entries)
+    return entries
+
+
+def main():
+    # the repository root is the parent of the directory this script is in, unless one is given
+    if len(sys.argv) > 1:
+        root = sys.argv[1]
+    else:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    print('Collecting the <app> tags of the sample editions ...')
+    tags = collect(root)
+
+    # the compiled clean up has to give the same result as the rules did one by one
+    mismatches = [entries for entries in tags if APP_TAG.rewrite(entries) != one_by_one(APP_TAG.rules, entries)]
+
+    def best(function):
+        # the best of five runs over all the tags, in microseconds per tag
+        return min(timeit.repeat(lambda: [function(entries) for entries in tags], number=20, repeat=5)) \
+            / (20 * len(tags)) * 1e6
+
+    oneByOne = best(lambda entries: one_by_one(APP_TAG.rules, entries))
+    compiled = best(APP_TAG.rewrite)
+
+    print('<app> tags:', len(tags))
+    print('average length:', sum(len(entries) for entries in tags) // max(len(tags), 1), 'characters')
+    print('rules applied one by one: %.2f us per tag' % oneByOne)
+    print('compiled rules: %.2f us per tag' % compiled)
+    print('speed-up: %.1fx' % (oneByOne / compiled))
+    print('tags cleaned up differently:', len(mismatches))
+    for entries in mismatches:
+        print('   ', entries)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
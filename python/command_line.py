@@ -0,0 +1,48 @@
+import argparse  # reads the optional flags of the encoders
+from schema_validation import SCHEMA, CACHE  # the default schema and where its local copy is kept
+import disk_cache  # where the encoded sections are kept, and how much of them
+import progress  # where the progress of the encoders is reported
+import row_budget  # the time budget of each row
+
+
+def parse_options(argv):
+    """takes the optional flags out of the command line. The positional arguments (base text, CSV, output file
+    and log file) are left in argv, where the encoders expect them.
+
+    :param argv: the command line, i.e. sys.argv. It is changed in place.
+    :return: the options, as an argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--validate', action='store_true',
+                        help='validate the sections that received <app> tags against the schema')
+    parser.add_argument('--schema', default=SCHEMA, help='URL or path of the RelaxNG schema')
+    parser.add_argument('--schema-cache', default=CACHE, help='where the local copy of the schema is kept')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='the number of processes that find the lemmas of the apparatus in the base text')
+    parser.add_argument('--incremental', action='store_true',
+                        help='copy the sections whose text and apparatus rows are unchanged from the previous output')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the encoded sections and <app> fragments on disk and reuse them in later runs')
+    parser.add_argument('--cache-dir', default=disk_cache.CACHE, help='the directory of the disk cache')
+    parser.add_argument('--cache-size', type=int, default=disk_cache.MAXSIZE >> 20,
+                        help='the most megabytes the disk cache keeps')
+    parser.add_argument('--no-open', action='store_true', help="don't open the finished XML file")
+    parser.add_argument('--progress', choices=progress.SINKS, default='auto',
+                        help='report progress as a bar on the terminal, as JSON lines or not at all (default: a bar '
+                             'on a terminal, JSON lines otherwise)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and encode the text again whenever the base text or the CSV is saved')
+    parser.add_argument('--row-budget', type=float, default=row_budget.BUDGET, metavar='SECONDS',
+                        help='quarantine a row whose <app> tag or lemma takes longer than this to build or find; '
+                             '0 for no limit (default: %g)' % row_budget.BUDGET)
+    parser.add_argument('--profile', action='store_true',
+                        help='time each stage of the run and report where the time went')
+    parser.add_argument('--profile-stage', metavar='NAME',
+                        help='with --profile, also run the stage or span NAME (e.g. locate) under cProfile and write '
+                             'its statistics next to the output')
+    options, positional = parser.parse_known_args(argv[1:])
+    argv[1:] = positional
+    # a stage can't be profiled without timing the rest
+    options.profile = options.profile or options.profile_stage is not None
+    return options
+
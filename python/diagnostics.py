@@ -0,0 +1,99 @@
+import json  # writes the diagnostics as JSON lines
+import queue  # hands the records of the encoder over to the thread that writes them
+import atexit  # writes what is left in the queue if an encoder stops half way
+import logging  # the records and the handlers
+import logging.handlers  # QueueHandler and QueueListener
+
+# this module writes the log of an encoder off the encoding thread. The encoders log to a QueueHandler, which
+# only puts each record in a queue; a QueueListener thread takes them out and writes
+#   the log, e.g. balex.log, with one human-readable message per record, as before
+#   the diagnostics, next to the log, e.g. balex.log.jsonl, with one JSON object per record
+# Each row that couldn't be encoded is a diagnostic record (see report()), with a code, the citation of the row,
+# its lemma, the reason and the offending XML, so that other programs don't have to parse the log.
+
+# the code of each kind of diagnostic -> the reason it is given
+CODES = {
+    'invalid-app': 'invalid XML was generated for the <app> tag',
+    'not-in-base-text': 'the section was not found in the base text',
+    'overlap': 'the lemma overlaps an earlier entry or other markup',
+    'lemma-not-found': 'the lemma was not found in the section',
+    'bad-lemma': 'the lemma is not a valid regular expression, e.g. it has an unbalanced parenthesis',
+    'schema': 'the section is not valid against the schema',
+    'timeout': 'the row took longer than its time budget and was quarantined',
+}
+
+# the logger of the encoder whose log is being written, its handler and the listener that writes the log
+_logger = None
+_handler = None
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    """formats a record as one line of JSON, with the fields of its diagnostic, if it has one"""
+
+    def format(self, record):
+        fields = {'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        fields.update(getattr(record, 'diagnostic', {}))
+        return json.dumps(fields, ensure_ascii=False)
+
+
+def open_log(log_file, name):
+    """starts writing the log of an encoder, and of the diagnostics next to it. The log of the previous run in
+    the same process (see batch_encoding.py and watch_mode.py) is finished first.
+
+    Only the records of the encoder's own logger are written, so that the INFO records of other libraries don't
+    end up in the log.
+
+    :param log_file: the log file
+    :param name: the name of the logger, e.g. 'Prose'
+    :return: the logger
+    """
+    global _logger, _handler, _listener
+    close_log()
+    _logger = logging.getLogger(name)
+    _logger.setLevel(logging.INFO)
+    # the log is the only place the records go, as it was when the encoders configured the root logger themselves
+    _logger.propagate = False
+    _handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _logger.addHandler(_handler)
+
+    text = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+    text.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+    diagnostics = logging.FileHandler(log_file + '.jsonl', mode='w', encoding='utf-8')
+    diagnostics.setFormatter(JSONFormatter())
+    _listener = logging.handlers.QueueListener(_handler.queue, text, diagnostics)
+    _listener.start()
+    return _logger
+
+
+def close_log():
+    """waits until every record has been written, closes the log and takes its handler off the logger"""
+    global _logger, _handler, _listener
+    if _listener is None:
+        return
+    _logger.removeHandler(_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _logger = None
+    _handler = None
+    _listener = None
+
+
+# write what is left in the queue if an encoder stops half way
+atexit.register(close_log)
+
+
+def report(logger, code, message, citation=(), lemma=None, xml=None, reason=None):
+    """logs a row that couldn't be encoded
+
+    :param logger: the logger of the encoder
+    :param code: the kind of diagnostic, one of CODES
+    :param message: the message of the human-readable log
+    :param citation: the citation of the row, e.g. ('12', '3')
+    :param lemma: the lemma of the row
+    :param xml: the offending XML, e.g. the invalid <app> tag
+    :param reason: what went wrong (default: the reason of the code)
+    """
+    logger.error(message, extra={'diagnostic': {'code': code, 'citation': [str(c).strip() for c in citation],
+                                                'lemma': lemma, 'reason': reason or CODES[code], 'xml': xml}})
@@ -0,0 +1,185 @@
+import os  # 'operating system' - used for the files of the cache
+import sys  # command line arguments
+import shutil  # clears the cache
+import hashlib  # names each entry after the hash of what it was made from
+import argparse  # reads the command line of "python disk_cache.py stats|clear"
+
+# this module keeps encoded sections and compiled <lem> and <rdg> tags on disk, so that later runs (including
+# CI runs and the editions of a batch) don't encode them again. Usage:
+#   python disk_cache.py stats [--cache-dir DIR]   shows what the cache holds
+#   python disk_cache.py clear [--cache-dir DIR]   empties it
+
+# where the cache is kept, next to the local copy of the schema
+CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'dll-automation', 'encoded')
+# the default limit on the size of the cache: 256 MB
+MAXSIZE = 256 << 20
+
+
+class DiskCache():
+    """a content-addressed cache on disk. Each entry is a file named after the hash of everything it was made
+    from, e.g. the code of the encoder, the text of a section and its apparatus rows, so an entry never has to be
+    invalidated: a change to any of them just makes a different name. Entries are kept in one directory per
+    namespace (e.g. sections and fragments).
+
+    Reading an entry updates its modification time, and once the cache is larger than its limit the entries used
+    least recently are deleted.
+    """
+
+    def __init__(self, directory=CACHE, maxsize=MAXSIZE):
+        """
+        :param directory: the directory of the cache
+        :param maxsize: the most bytes to keep
+        """
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # the bytes in the cache, counted the first time an entry is written
+        self.__size = None
+
+    @staticmethod
+    def key(*parts):
+        """
+        :param parts: what an entry is made from, as str or bytes
+        :return: the name of the entry
+        """
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+            # so that ('ab', 'c') and ('a', 'bc') have different keys
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def __path(self, namespace, key):
+        return os.path.join(self.directory, namespace, key[:2], key[2:])
+
+    def get(self, namespace, key):
+        """
+        :param namespace: e.g. 'sections'
+        :param key: the name of the entry, see key()
+        :return: the entry as bytes, or None if it isn't cached
+        """
+        path = self.__path(namespace, key)
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+            # mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            # not cached, or evicted by another process in the meantime
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def __contains__(self, location):
+        """
+        :param location: a (namespace, key) tuple
+        :return: True if the entry is cached
+        """
+        return os.path.exists(self.__path(*location))
+
+    def put(self, namespace, key, data):
+        """
+        :param namespace: e.g. 'sections'
+        :param key: the name of the entry, see key()
+        :param data: the entry, as bytes
+        """
+        if len(data) > self.maxsize:
+            return
+        path = self.__path(namespace, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write the entry in one go, so that another process never reads half of it
+            with open(path + '.' + str(os.getpid()), 'wb') as entry:
+                entry.write(data)
+            os.replace(path + '.' + str(os.getpid()), path)
+        except OSError:
+            # the entry just isn't kept for the next run
+            return
+        self.writes += 1
+        if self.__size is None:
+            self.__size = sum(size for mtime, size, path in self.__entries())
+        else:
+            self.__size += len(data)
+        if self.__size > self.maxsize:
+            self.__evict()
+
+    def __entries(self):
+        """
+        :return: a (modification time, size, path) tuple for each entry
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def __evict(self):
+        """deletes the entries used least recently until the cache is down to three quarters of its limit, so
+        that it isn't scanned again for every entry written once it is full"""
+        entries = sorted(self.__entries())
+        self.__size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if self.__size <= self.maxsize * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.__size -= size
+            self.evictions += 1
+
+    def stats(self):
+        """
+        :return: a dict from each namespace to the number of entries and the bytes they take
+        """
+        stats = {}
+        for mtime, size, path in self.__entries():
+            namespace = os.path.relpath(path, self.directory).split(os.sep)[0]
+            entries, total = stats.get(namespace, (0, 0))
+            stats[namespace] = (entries + 1, total + size)
+        return stats
+
+    def clear(self):
+        """deletes every entry"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.__size = 0
+
+    def summary(self):
+        """
+        :return: the counters of this process, for the summary of a run
+        """
+        return '%d hits, %d misses, %d writes, %d evictions' % (self.hits, self.misses, self.writes, self.evictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='shows or clears the cache of encoded sections and <app> fragments')
+    parser.add_argument('command', choices=['stats', 'clear'])
+    parser.add_argument('--cache-dir', default=CACHE, help='the directory of the cache')
+    options = parser.parse_args(sys.argv[1:])
+    cache = DiskCache(options.cache_dir)
+
+    if options.command == 'clear':
+        cache.clear()
+        print("Cleared", options.cache_dir)
+        return
+
+    stats = cache.stats()
+    print("Cache directory:", options.cache_dir)
+    for namespace in sorted(stats):
+        entries, size = stats[namespace]
+        print("%-12s %8d entries %12d bytes" % (namespace, entries, size))
+    print("%-12s %8d entries %12d bytes" % ('total', sum(entries for entries, size in stats.values()),
+                                            sum(size for entries, size in stats.values())))
+
+
+if __name__ == '__main__':
+    main()
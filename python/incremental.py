@@ -0,0 +1,243 @@
+import os  # finds the state of the previous run
+import copy  # copies the unchanged sections out of the previous output
+import csv  # reads the rows of the apparatus
+import json  # reads and writes the state of a run
+import hashlib  # hashes the sections, the rows and the code
+import collections  # counts the rows of each section
+import lxml.etree as ET  # parses the previous output and the cached sections
+from citation_index import CitationIndex  # finds the sections of the previous output
+
+# the modules whose code decides what an encoded section looks like. Changing any of them, or the encoder,
+# makes every section of the previous output, and every cached section, stale.
+MODULES = ('apparatus_batch', 'apparatus_entry', 'app_cleanup', 'base_text_lexer', 'citation_index',
+           'lemma_locator', 'sigla', 'tei_tree')
+
+
+class IncrementalRun():
+    """copies the sections that were already encoded, by the previous run or by any run that kept them in the
+    disk cache, so that only the sections whose base text or apparatus rows changed are encoded again.
+
+    A run with --incremental records the hash of the base text of every section (a <seg>, an <l> or a verse
+    <div>) and of the apparatus rows that point at it, next to the output, e.g. balex.xml.incremental.json.
+    The next incremental run copies a section from the output of that run if its text and its rows are the
+    same, and every one of its rows was inserted then, so that the rows that failed are tried, and logged,
+    again. Nothing is copied if the code of the encoder changed or the output was edited since.
+
+    A run with --cache keeps every section whose rows were all inserted in a DiskCache, under the hash of the
+    code, its citation, its text and its rows, and copies the sections it finds there. It also keeps the
+    compiled <lem> and <rdg> tags of the encoder's FragmentCache.
+    """
+
+    # the absolute path of each output written by this process -> (the hash of the file, the root of the tree
+    # written to it), so that a process that encodes the same text again (see watch_mode.py) doesn't parse it
+    __written = {}
+
+    def __init__(self, output, encoder, previous=True, cache=None, fragments=None):
+        """
+        :param output: the output file, which holds the output of the previous run
+        :param encoder: the source file of the encoder, i.e. its __file__
+        :param previous: whether to copy sections from the previous output and record the state of this run
+        :param cache: the DiskCache to copy sections from and keep them in, or None
+        :param fragments: the FragmentCache of the encoder, kept in the disk cache, or None
+        """
+        self.output = output
+        self.path = output + '.incremental.json'
+        self.version = code_version(encoder)
+        self.previous = previous
+        self.cache = cache
+        self.fragments = fragments
+        # (kind, citation) -> the hash of the text of the section, and of its rows
+        self.__texts = {}
+        self.__rows = {}
+        # (kind, citation) -> the number of rows, and the number of rows inserted in this run
+        self.__rowCounts = collections.Counter()
+        self.__inserted = collections.Counter()
+        # each section of this run -> (kind, citation)
+        self.__citations = {}
+        # the (kind, citation) of each section copied from the previous output or the cache
+        self.__reused = set()
+        # (kind, citation) -> the section, for the sections that are kept in the cache at the end of the run
+        self.__sections = {}
+        # the root of the tree of this run, and the hash of the previous output
+        self.__root = None
+        self.__previousHash = None
+
+    def reuse(self, indexes, appCrit, citation_of):
+        """hashes the sections of the base text and the rows of the apparatus, and replaces each section that
+        was already encoded with its encoded copy. Call it before any <app> tag is added.
+
+        :param indexes: a dict from each kind of section (e.g. 'prose' and 'poetry' in mixed matter) to its
+            CitationIndex. The indexes are rebuilt after the sections are replaced.
+        :param appCrit: the apparatus CSV
+        :param citation_of: a function from a row of the CSV to its (kind, citation) tuple, or to None for the
+            row of column labels
+        :return: the number of sections copied from the previous output or the cache
+        """
+        for kind, index in indexes.items():
+            self.__root = index.root
+            for citation, section in index.items():
+                self.__texts[kind, citation] = digest(ET.tostring(section))
+                self.__citations[section] = (kind, citation)
+
+        rows = collections.defaultdict(list)
+        with open(appCrit, encoding='utf-8') as appFile:
+            for row in csv.reader(appFile, delimiter=','):
+                key = citation_of(row)
+                if key is not None:
+                    kind, citation = key
+                    rows[kind, tuple(str(c).strip() for c in citation)].append(row)
+        for key, sectionRows in rows.items():
+            self.__rows[key] = digest(json.dumps(sectionRows, ensure_ascii=False).encode('utf-8'))
+            self.__rowCounts[key] = len(sectionRows)
+
+        if self.cache is not None and self.fragments is not None:
+            self.__load_fragments()
+
+        previous = self.__previous() if self.previous else None
+        previousRoot = None
+        if previous:
+            written = self.__written.get(os.path.abspath(self.output))
+            if written is not None and written[0] == self.__previousHash:
+                previousRoot = written[1]
+            else:
+                try:
+                    previousRoot = ET.parse(self.output, ET.XMLParser(remove_comments=False)).getroot()
+                except ET.XMLSyntaxError:
+                    previousRoot = None
+        for kind, index in indexes.items():
+            previousIndex = CitationIndex(previousRoot, index.scheme) if previousRoot is not None else None
+            for citation, section in list(index.items()):
+                key = (kind, citation)
+                encoded = None
+                if previousIndex is not None and previous.get(key) == (self.__texts[key], self.__rows.get(key)):
+                    encoded = previousIndex.find(*citation)
+                    if encoded is not None:
+                        encoded = copy.deepcopy(encoded)
+                if encoded is None and self.cache is not None:
+                    data = self.cache.get('sections', self.__cache_key(key))
+                    if data is not None:
+                        encoded = ET.fromstring(data, ET.XMLParser(remove_comments=False))
+                if encoded is None:
+                    continue
+                encoded.tail = section.tail
+                section.getparent().replace(section, encoded)
+                self.__reused.add(key)
+            index.rebuild()
+            if self.cache is not None:
+                for citation, section in index.items():
+                    self.__sections[kind, citation] = section
+        return len(self.__reused)
+
+    def __previous(self):
+        """
+        :return: a dict from the (kind, citation) of each section of the previous output whose rows were all
+            inserted to the hashes of its text and its rows, or None if the previous output can't be used
+        """
+        try:
+            with open(self.path, encoding='utf-8') as stateFile:
+                state = json.load(stateFile)
+            with open(self.output, 'rb') as output:
+                outputHash = digest(output.read())
+        except (OSError, ValueError):
+            return None
+        if state.get('version') != self.version or state.get('output') != outputHash:
+            return None
+        self.__previousHash = outputHash
+        return {(kind, tuple(citation)): (text, rows)
+                for kind, citation, text, rows, complete in state['sections'] if complete}
+
+    def __cache_key(self, key):
+        """
+        :param key: the (kind, citation) of a section
+        :return: the name of the section in the cache
+        """
+        kind, citation = key
+        return self.cache.key(self.version, kind, *citation, self.__texts[key], self.__rows.get(key) or '')
+
+    def __load_fragments(self):
+        """adds the <lem> and <rdg> tags kept by earlier runs of the encoder to its FragmentCache"""
+        data = self.cache.get('fragments', self.cache.key(self.version))
+        if data is None:
+            return
+        try:
+            fragments = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return
+        # JSON turns the tuples into lists
+        self.fragments.load((tuple(key), tuple(None if part is None else tuple(part) for part in fragment), size)
+                            for key, fragment, size in fragments)
+
+    def reused(self, kind, *citation):
+        """
+        :param kind: the kind of section, e.g. 'prose'
+        :param citation: the citation of the section, e.g. ('12', '3')
+        :return: True if the section was copied from the previous output or the cache, so its rows must be skipped
+        """
+        return (kind, tuple(str(c).strip() for c in citation)) in self.__reused
+
+    def inserted(self, section):
+        """counts a row whose <app> tag was inserted into a section
+
+        :param section: the section
+        """
+        key = self.__citations.get(section)
+        if key is not None:
+            self.__inserted[key] += 1
+
+    def __complete(self, key):
+        """
+        :param key: the (kind, citation) of a section
+        :return: True if every row of the section was inserted, in this run or in the one it was copied from
+        """
+        return key in self.__reused or self.__inserted[key] == self.__rowCounts[key]
+
+    def save(self):
+        """records the hashes of this run next to the output and keeps the sections that were encoded in this
+        run in the cache. Call it after the output is written."""
+        if not self.__texts:
+            # neither an incremental nor a cached run
+            return
+
+        if self.cache is not None:
+            for key, section in self.__sections.items():
+                if key in self.__reused or not self.__complete(key):
+                    continue
+                name = self.__cache_key(key)
+                if ('sections', name) not in self.cache:
+                    self.cache.put('sections', name, ET.tostring(section, encoding='utf-8', with_tail=False))
+            if self.fragments is not None:
+                self.cache.put('fragments', self.cache.key(self.version),
+                               json.dumps(self.fragments.dump(), ensure_ascii=False).encode('utf-8'))
+
+        if not self.previous:
+            return
+        with open(self.output, 'rb') as output:
+            outputHash = digest(output.read())
+        sections = [[kind, list(citation), text, self.__rows.get((kind, citation)), self.__complete((kind, citation))]
+                    for (kind, citation), text in self.__texts.items()]
+        # write the state in one go, so that an interrupted run doesn't leave half of it behind
+        with open(self.path + '.part', 'w', encoding='utf-8') as stateFile:
+            json.dump({'version': self.version, 'output': outputHash, 'sections': sections}, stateFile)
+        os.replace(self.path + '.part', self.path)
+        self.__written[os.path.abspath(self.output)] = (outputHash, self.__root)
+
+
+def digest(data):
+    """
+    :param data: bytes
+    :return: the SHA-1 hash of the bytes, as a hex string
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+def code_version(encoder):
+    """
+    :param encoder: the source file of the encoder
+    :return: a hash of the code of the encoder and of the modules it encodes sections with
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    version = hashlib.sha1()
+    for path in [encoder] + [os.path.join(here, name + '.py') for name in MODULES]:
+        with open(path, 'rb') as source:
+            version.update(source.read())
+    return version.hexdigest()
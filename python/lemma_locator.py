@@ -0,0 +1,358 @@
+import re  # operations for regular expressions, i.e. very powerful text matching
+import bisect  # binary search in the word index and the protected spans
+import functools  # caches compiled lemma patterns across CSV rows
+import lxml.etree as ET  # used to recognise <app> elements in a flattened section
+
+# a run of letters. Every lemma pattern the encoders build starts with a lookbehind that keeps it from starting
+# after a letter, so a lemma can only start where a run of letters starts.
+WORD = re.compile(r'[a-zA-Z]+')
+# the characters that may not come right before or after a lemma: letters in verse, and letters, # and - in prose
+VERSE_BOUNDARY = 'a-zA-Z'
+PROSE_BOUNDARY = 'a-zA-Z\\#-'
+# the lookbehind and the lookahead the encoders put around a lemma
+WORD_START = '(?<![' + VERSE_BOUNDARY + '])'
+WORD_END = '(?![' + VERSE_BOUNDARY + '])'
+PROSE_WORD_START = '(?<![' + PROSE_BOUNDARY + '])'
+PROSE_WORD_END = '(?![' + PROSE_BOUNDARY + '])'
+# the lookbehind a lemma pattern starts with -> the lookahead it ends with, and the characters they keep out
+BOUNDARIES = {
+    WORD_START: (WORD_END, re.compile('[' + VERSE_BOUNDARY + ']')),
+    PROSE_WORD_START: (PROSE_WORD_END, re.compile('[' + PROSE_BOUNDARY + ']')),
+}
+# characters that have a special meaning in a lemma pattern. A lemma without any of them is matched literally.
+REGEX_SYNTAX = set('\\.^$*+?{}[]|()')
+# characters that re.IGNORECASE matches with an ASCII letter, but str.lower() doesn't turn into one
+UNFOLDED = set('\u0130\u0131\u017f\u212a')
+# the leading letters of a lemma pattern, up to the first regex syntax
+LEADING_LETTERS = re.compile(r'[a-zA-Z]+(?![?*+{])')
+# a tag or a comment in a piece of markup. A tag can't contain a <, so a stray one in the text doesn't make every
+# < after it scan to the end of the text for a >
+MARKUP = re.compile(r'<!--.*?-->|<[^<>]*>', re.S)
+
+
+@functools.lru_cache(maxsize=4096)
+def lemma_pattern(pattern):
+    """compiles a lemma pattern once for all the rows that use it
+
+    :param pattern: the regex match pattern for finding the lemma
+    :return: the compiled pattern (case-insensitive), or None if the lemma isn't a valid regex
+        (e.g. it has an unbalanced parenthesis)
+    """
+    try:
+        return re.compile(pattern, flags=re.IGNORECASE)
+    except re.error:
+        return None
+
+
+def pattern_error(pattern):
+    """
+    :param pattern: the regex match pattern for finding the lemma
+    :return: why the pattern isn't a valid regex, e.g. 'missing ), unterminated subpattern at position 12', or None
+        if it is one
+    """
+    if lemma_pattern(pattern) is not None:
+        return None
+    try:
+        re.compile(pattern, flags=re.IGNORECASE)
+    except re.error as error:
+        return str(error)
+    return None
+
+
+def word_start(pattern):
+    """
+    :param pattern: the regex match pattern for finding the lemma
+    :return: the lookbehind of BOUNDARIES the pattern starts with, or None
+    """
+    for start in BOUNDARIES:
+        if pattern.startswith(start):
+            return start
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def literal(pattern):
+    """
+    :param pattern: the regex match pattern for finding the lemma
+    :return: the lowercased lemma, if the pattern is just a plain ASCII lemma between a word-start lookbehind
+        and the word-end lookahead that goes with it (which is what the encoders build for most lemmas);
+        None otherwise
+    """
+    start = word_start(pattern)
+    if start is None or not pattern.endswith(BOUNDARIES[start][0]):
+        return None
+    lemma = pattern[len(start):len(pattern) - len(BOUNDARIES[start][0])]
+    if lemma == '' or not lemma.isascii() or not REGEX_SYNTAX.isdisjoint(lemma):
+        return None
+    return lemma.lower()
+
+
+class LemmaMatcher():
+    """finds every instance of several lemmas in one pass over a text (Aho-Corasick).
+
+    All the lemmas of a section go into one automaton, so the section text is read once instead of once
+    per CSV row. Instances are reported for every lemma, even where lemmas overlap (e.g. 'ut' and 'ut mihi').
+    """
+
+    def __init__(self, lemmas):
+        """
+        :param lemmas: the lowercased lemmas to look for
+        """
+        # the trie: one dict of transitions per state, the lemmas that end in each state, and the failure links
+        self.__goto = [{}]
+        self.__output = [[]]
+        for lemma in set(lemmas):
+            state = 0
+            for char in lemma:
+                nextState = self.__goto[state].get(char)
+                if nextState is None:
+                    nextState = len(self.__goto)
+                    self.__goto[state][char] = nextState
+                    self.__goto.append({})
+                    self.__output.append([])
+                state = nextState
+            self.__output[state].append(lemma)
+
+        # breadth-first, so that the failure link of a state is known before its children need it
+        self.__fail = [0] * len(self.__goto)
+        queue = list(self.__goto[0].values())
+        for state in queue:
+            for char, nextState in self.__goto[state].items():
+                queue.append(nextState)
+                fallback = self.__fail[state]
+                while fallback and char not in self.__goto[fallback]:
+                    fallback = self.__fail[fallback]
+                target = self.__goto[fallback].get(char, 0)
+                self.__fail[nextState] = target if target != nextState else 0
+                self.__output[nextState] = self.__output[nextState] + self.__output[self.__fail[nextState]]
+
+    def find_all(self, text):
+        """
+        :param text: the lowercased text
+        :return: a dict of lemma -> the (start, end) spans of all its instances, in order
+        """
+        found = {}
+        goto = self.__goto
+        fail = self.__fail
+        output = self.__output
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for lemma in output[state]:
+                found.setdefault(lemma, []).append((end - len(lemma), end))
+        return found
+
+
+@functools.lru_cache(maxsize=4096)
+def leading_word(pattern):
+    """
+    :param pattern: the regex match pattern for finding the lemma
+    :return: the lowercased letters every match must start with, or None if the pattern doesn't start with
+        one of the word-start lookbehinds of BOUNDARIES and a plain letter
+    """
+    start = word_start(pattern)
+    if start is None:
+        return None
+    match = LEADING_LETTERS.match(pattern, len(start))
+    if match is None:
+        return None
+    return match.group().lower()
+
+
+class LemmaLocator():
+    """finds lemma instances in one section, skipping everything a lemma must not be matched in.
+
+    The protected spans are worked out once per section: a lemma may not start or end inside a tag or a comment
+    (e.g. in an xml:id attribute), and may not overlap an <app> that is already in the text (e.g. one that
+    replaced a speaker label). prepare() finds the plain lemmas of all the rows of a section in one pass
+    (see LemmaMatcher). Any other lemma is only tried where a word that starts with its first letters starts,
+    using an index of the letter runs of the text. The matches of each pattern are kept, so the rows that
+    ask for the 2nd or 3rd instance of the same lemma (lemma(2), lemma2) are answered from the same list.
+
+    The number of passes of the automaton, the number of patterns that were tried at the words of the index,
+    and the number that had to be searched for in the whole text, are kept in passes, indexed and scanned.
+    """
+
+    def __init__(self, text, markup, apps):
+        """
+        :param text: the section text, with its markup written out
+        :param markup: (start, end) of every tag and comment in text, in order
+        :param apps: (start, end) of every <app> in text
+        """
+        self.text = text
+        # a match may not start or end strictly inside one of these
+        self.__markupStarts = [start for start, end in markup]
+        self.__markupEnds = [end for start, end in markup]
+        # a match may not overlap any of these. Nested <app>s are covered by the outermost one.
+        self.__appStarts = []
+        self.__appEnds = []
+        for start, end in sorted(apps):
+            if self.__appEnds and start < self.__appEnds[-1]:
+                continue
+            self.__appStarts.append(start)
+            self.__appEnds.append(end)
+        # lowercased word -> where it starts in the text, kept sorted so that a prefix finds its words
+        words = {}
+        for match in WORD.finditer(text):
+            words.setdefault(match.group().lower(), []).append(match.start())
+        self.__words = words
+        self.__vocabulary = sorted(words)
+        # pattern -> the allowed (start, end) spans of its matches
+        self.__matches = {}
+        self.passes = 0
+        self.indexed = 0
+        self.scanned = 0
+
+    @classmethod
+    def from_flat(cls, flat):
+        """
+        :param flat: a tei_tree.FlatText of the section
+        :return: a locator for the flattened section
+        """
+        apps = [(start, end) for element, start, end in flat.elements if ET.QName(element).localname == 'app']
+        return cls(flat.text, flat.markup, apps)
+
+    @classmethod
+    def from_markup(cls, text):
+        """
+        :param text: a piece of markup as a str, e.g. the content of a <lem> that nested <app>s may go into
+        :return: a locator for it
+        """
+        markup = [match.span() for match in MARKUP.finditer(text)]
+        apps = []
+        # pair up <app> start and end tags
+        depth = 0
+        for match in MARKUP.finditer(text):
+            tag = match.group()
+            if tag.startswith('<app>') or tag.startswith('<app '):
+                if depth == 0:
+                    start = match.start()
+                depth += 1
+            elif tag == '</app>' and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    apps.append((start, match.end()))
+        return cls(text, markup, apps)
+
+    def __inside_markup(self, offset):
+        """
+        :return: True if offset is strictly inside a tag or a comment
+        """
+        i = bisect.bisect_left(self.__markupStarts, offset) - 1
+        return i >= 0 and offset < self.__markupEnds[i]
+
+    def __overlaps_app(self, start, end):
+        """
+        :return: True if the span overlaps an <app> that is already in the text
+        """
+        i = bisect.bisect_left(self.__appStarts, end) - 1
+        return i >= 0 and self.__appEnds[i] > start
+
+    def __candidates(self, pattern):
+        """
+        :return: the offsets a match may start at, in order, or None if every offset has to be tried
+        """
+        prefix = leading_word(pattern)
+        if prefix is None:
+            return None
+        starts = []
+        i = bisect.bisect_left(self.__vocabulary, prefix)
+        while i < len(self.__vocabulary) and self.__vocabulary[i].startswith(prefix):
+            starts.extend(self.__words[self.__vocabulary[i]])
+            i += 1
+        return sorted(starts)
+
+    def prepare(self, patterns):
+        """finds the instances of all the plain lemmas among patterns in one pass over the text, so that
+        matches() and find() don't have to search for them one by one. Other patterns are left to matches().
+
+        :param patterns: the regex match patterns of every lemma queued for the section
+        """
+        lemmas = {}
+        for pattern in patterns:
+            if pattern in self.__matches:
+                continue
+            lemma = literal(pattern)
+            if lemma is not None:
+                lemmas.setdefault(lemma, []).append(pattern)
+        if not lemmas or not UNFOLDED.isdisjoint(self.text):
+            return
+
+        text = self.text
+        self.passes += 1
+        found = LemmaMatcher(lemmas).find_all(text.lower())
+        for lemma, patterns in lemmas.items():
+            for pattern in patterns:
+                # the characters that may not come right before or after the lemma, e.g. # and - in prose
+                boundary = BOUNDARIES[word_start(pattern)][1]
+                spans = []
+                # like finditer(): an instance only counts if it isn't part of a longer word,
+                # and can't start inside the instance before it
+                last = 0
+                for start, end in found.get(lemma, []):
+                    if start < last:
+                        continue
+                    if (start > 0 and boundary.match(text, start - 1, start)) or boundary.match(text, end, end + 1):
+                        continue
+                    last = end
+                    if self.__inside_markup(start) or self.__inside_markup(end) or self.__overlaps_app(start, end):
+                        continue
+                    spans.append((start, end))
+                self.__matches[pattern] = spans
+
+    def matches(self, pattern):
+        """
+        :param pattern: the regex match pattern for finding the lemma
+        :return: the (start, end) spans of the lemma instances outside the protected spans, in order
+        """
+        spans = self.__matches.get(pattern)
+        if spans is not None:
+            return spans
+
+        spans = []
+        compiled = lemma_pattern(pattern)
+        if compiled is not None:
+            candidates = self.__candidates(pattern)
+            if candidates is None:
+                self.scanned += 1
+                found = (match.span() for match in compiled.finditer(self.text))
+            else:
+                self.indexed += 1
+                found = self.__match_at(compiled, candidates)
+            for start, end in found:
+                if self.__inside_markup(start) or self.__inside_markup(end) or self.__overlaps_app(start, end):
+                    continue
+                spans.append((start, end))
+        self.__matches[pattern] = spans
+        return spans
+
+    def __match_at(self, compiled, candidates):
+        """tries the pattern at each candidate offset. Like finditer(), a match can't start inside the one before it."""
+        end = 0
+        for start in candidates:
+            if start < end:
+                continue
+            match = compiled.match(self.text, start)
+            if match is not None:
+                end = match.end()
+                yield match.span()
+
+    def find(self, pattern, occurrence):
+        """
+        :param pattern: the regex match pattern for finding the lemma
+        :param occurrence: the number of the lemma instance we are looking for, starting at 0
+        :return: a (start, end) tuple, or None if the lemma wasn't found
+        """
+        spans = self.matches(pattern)
+        if occurrence < 0 or occurrence >= len(spans):
+            return None
+        return spans[occurrence]
+
+    def count(self, pattern, start, end):
+        """
+        :return: how many lemma instances start between start (included) and end (excluded)
+        """
+        starts = [span[0] for span in self.matches(pattern)]
+        return bisect.bisect_left(starts, end) - bisect.bisect_left(starts, start)
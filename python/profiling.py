@@ -0,0 +1,198 @@
+import os  # 'operating system' - used for the path of the cProfile dump
+import time  # times the spans
+import cProfile  # profiles a single stage, with --profile-stage
+
+# this module times the stages of an encoder, with --profile, so that it shows where the time of a run goes
+# without editing the scripts. The time is kept in named spans, which nest:
+#   stages  each progress.stage() of an encoder is a span, named after what it does, e.g. 'parse'
+#   spans   parts of a stage, e.g. with span('locate'): ... in apparatus_batch.py
+#   laps    the steps of each row of the apparatus loop: lap('build') adds the time since the previous lap, or since
+#           the start of the stage, to the span 'build' of the current stage. The time of the spans that ran in
+#           between, e.g. span('cleanup') inside the step 'build', is kept in those spans and left out of the lap,
+#           so a lap must not share its name with a span of the same stage
+# The time of every span, summed over its calls, is reported at the end of the run as a 'profile' event (see
+# progress.py), drawn as a flame-style tree on the terminal. With --profile-stage NAME, the spans called NAME are
+# also run under cProfile, and its statistics are written next to the output, e.g. balex.locate.pstats, for pstats
+# or snakeviz to read.
+#
+# Without --profile, span() returns one shared span that does nothing, and lap() and stage() return at once.
+
+# the profiler of the running encoder, or None without --profile
+_profiler = None
+
+
+class Profiler():
+    """the spans of one run of an encoder"""
+
+    def __init__(self, stage=None, dump=None):
+        """
+        :param stage: the name of the spans to run under cProfile, e.g. 'locate', or None
+        :param dump: where to write the cProfile statistics
+        """
+        self.target = stage
+        self.dump = dump
+        # the path of each span, e.g. ('read rows', 'build'), in the order they started -> [seconds, calls]
+        self.times = {}
+        # [path, start, seconds of the spans run inside it] of each open span, innermost last
+        self.__open = []
+        # when the last lap ended, and the seconds of the spans run inside the innermost open span by then
+        self.__mark = time.perf_counter()
+        self.__markInner = 0
+        self.__start = self.__mark
+        self.__cProfile = cProfile.Profile() if stage is not None else None
+        # the path of the span that cProfile is running for, and whether it ran for any
+        self.__profiled = None
+        self.__ran = False
+
+    def enter(self, name):
+        """:param name: the name of a span that starts now, inside the innermost open one"""
+        path = (self.__open[-1][0] if self.__open else ()) + (name,)
+        self.times.setdefault(path, [0, 0])
+        if self.__cProfile is not None and self.__profiled is None and name == self.target:
+            self.__profiled = path
+            self.__ran = True
+            self.__cProfile.enable()
+        self.__open.append([path, time.perf_counter(), 0])
+
+    def exit(self):
+        """ends the innermost open span"""
+        now = time.perf_counter()
+        path, start, inner = self.__open.pop()
+        if path == self.__profiled:
+            self.__cProfile.disable()
+            self.__profiled = None
+        self.times[path][0] += now - start
+        self.times[path][1] += 1
+        if self.__open:
+            self.__open[-1][2] += now - start
+
+    def stage(self, name):
+        """:param name: the name of a stage that starts now; every open span ends"""
+        while self.__open:
+            self.exit()
+        self.enter(name)
+        self.__mark = time.perf_counter()
+        self.__markInner = 0
+
+    def lap(self, name):
+        """:param name: the name of the step that ended now, e.g. 'build'"""
+        now = time.perf_counter()
+        path = (self.__open[-1][0] if self.__open else ()) + (name,)
+        inner = self.__open[-1][2] if self.__open else 0
+        times = self.times.setdefault(path, [0, 0])
+        times[0] += now - self.__mark - (inner - self.__markInner)
+        times[1] += 1
+        self.__mark = now
+        self.__markInner = inner
+
+    def finish(self):
+        """ends every open span, and writes the cProfile statistics
+
+        :return: the profile of the run, as a dict with the total seconds of the run, the spans in the order of a tree
+            (see spans()), the name of the spans run under cProfile and the path of its statistics, or None if no
+            such span ran (e.g. a step of the apparatus rows, which is a lap)
+        """
+        while self.__open:
+            self.exit()
+        pstats = None
+        if self.__ran and self.dump is not None:
+            self.__cProfile.dump_stats(self.dump)
+            pstats = self.dump
+        return {'total': round(time.perf_counter() - self.__start, 3), 'spans': self.spans(), 'profiled': self.target,
+                'pstats': pstats}
+
+    def spans(self):
+        """
+        :return: a list with a dict for each span, with its name, its depth, its seconds and the number of times
+            it ran; each span comes right after the span it is in, as in a tree
+        """
+        ordered = []
+
+        def children(parent):
+            for path, (seconds, calls) in self.times.items():
+                if path[:-1] == parent:
+                    ordered.append({'span': path[-1], 'depth': len(path) - 1, 'seconds': round(seconds, 4),
+                                    'calls': calls})
+                    children(path)
+
+        children(())
+        return ordered
+
+
+class Span():
+    """times the code in a with statement as a span"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.enter(self.name)
+        return self
+
+    def __exit__(self, *exception):
+        self.profiler.exit()
+        return False
+
+
+class NoSpan():
+    """the span of a run without --profile, which does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+_NO_SPAN = NoSpan()
+
+
+def start_profile(stage=None, output=None):
+    """starts timing the spans of a run (--profile)
+
+    :param stage: the name of the spans to run under cProfile (--profile-stage), or None
+    :param output: the output file of the encoder; the cProfile statistics are written next to it
+    """
+    global _profiler
+    dump = None
+    if stage is not None and output is not None:
+        dump = os.path.splitext(output)[0] + '.' + stage.replace(' ', '-') + '.pstats'
+    _profiler = Profiler(stage, dump)
+
+
+def finish_profile():
+    """
+    :return: the profile of the run (see Profiler.finish()), or None without --profile
+    """
+    global _profiler
+    if _profiler is None:
+        return None
+    profile = _profiler.finish()
+    _profiler = None
+    return profile
+
+
+def span(name):
+    """
+    :param name: the name of the span, e.g. 'locate'
+    :return: a context manager that times the code in its with statement
+    """
+    if _profiler is None:
+        return _NO_SPAN
+    return Span(_profiler, name)
+
+
+def lap(name):
+    """:param name: the name of the step of the current stage that ended now, e.g. 'build'"""
+    if _profiler is not None:
+        _profiler.lap(name)
+
+
+def stage(name):
+    """ends the span of the previous stage and starts the next one
+
+    :param name: the name of the stage, e.g. 'parse'
+    """
+    if _profiler is not None:
+        _profiler.stage(name)
@@ -0,0 +1,293 @@
+import sys  # the default stream of the progress bar and of the events
+import csv  # counts the rows of the apparatus
+import json  # writes the events as JSON lines
+import time  # stamps the events and limits how often the progress bar is drawn
+import shutil  # finds the width of the terminal
+import profiling  # times each stage, with --profile
+
+# this module reports what an encoder is doing as a stream of events, instead of the messages and pauses the
+# encoders used to print between stages. Each event goes to a sink, chosen with --progress:
+#   tty     a progress bar on one line of the terminal, with the problems and the summary printed below it
+#   json    one JSON object per line, for other programs to read; the rows at most ten times a second
+#   silent  nothing; the log still records everything
+# The default, auto, is tty when the output is a terminal and json otherwise.
+# Each stage is also a span of the profile of the run, with --profile (see profiling.py).
+
+SINKS = ('auto', 'tty', 'json', 'silent')
+
+# how the summary of a run is labelled on the terminal
+LABELS = {
+    'rows': 'total CSV rows processed',
+    'successful': 'Rows processed successfully',
+    'invalid': 'Syntactically invalid app tags generated',
+    'not found': 'lemmas not found',
+    'quarantined': 'Rows quarantined for running over their time budget',
+    'success rate': 'Success rate',
+    'fragment cache': 'Cached <lem> and <rdg> tags',
+    'disk cache': 'Disk cache',
+}
+
+# the progress of the encoder that is running, for the code that isn't handed it, see current()
+_current = None
+
+
+class Progress():
+    """the events of one run of an encoder. Each event is a dict with its name, the encoder, the seconds since
+    the run started and what the event is about:
+        stage    a step of the run, e.g. reading the base text
+        note     something worth knowing about the current step
+        rows     the number of CSV rows to encode
+        row      a CSV row was encoded; with the number of rows done so far and its citation
+        problem  a row that couldn't be encoded, e.g. a lemma that wasn't found; with what was expected
+        profile  with --profile, the seconds of each span of the run, just before the summary
+        summary  the quality metrics of the run
+    """
+
+    def __init__(self, encoder, sink):
+        """
+        :param encoder: the name of the encoder, e.g. 'prose'
+        :param sink: where the events go, see sink()
+        """
+        global _current
+        self.encoder = encoder
+        self.sink = sink
+        self.total = None
+        self.done = 0
+        self.__start = time.perf_counter()
+        _current = self
+
+    def __emit(self, event, **fields):
+        fields['event'] = event
+        fields['encoder'] = self.encoder
+        fields['seconds'] = round(time.perf_counter() - self.__start, 3)
+        self.sink.emit(fields)
+
+    def stage(self, message, span=None):
+        """
+        :param message: what the encoder is doing now
+        :param span: the name of the stage in the profile, e.g. 'parse' (default: the message)
+        """
+        profiling.stage(span or message)
+        self.__emit('stage', message=message)
+
+    def note(self, message):
+        """:param message: something worth knowing about the current step"""
+        self.__emit('note', message=message)
+
+    def rows(self, total):
+        """:param total: the number of CSV rows to encode"""
+        self.total = total
+        self.__emit('rows', total=total)
+
+    def row(self, *citation):
+        """counts a CSV row
+
+        :param citation: the citation of the row, e.g. ('12', '3')
+        """
+        self.done += 1
+        self.__emit('row', done=self.done, total=self.total, citation=[str(c).strip() for c in citation])
+
+    def problem(self, message, detail=None):
+        """
+        :param message: what went wrong
+        :param detail: e.g. the lemma that wasn't found, or the <app> tag that is invalid
+        """
+        self.__emit('problem', message=message, detail=None if detail is None else str(detail))
+
+    def summary(self, metrics):
+        """
+        :param metrics: a dict from the name of each quality metric (e.g. 'rows') to its value
+        """
+        profile = profiling.finish_profile()
+        if profile is not None:
+            self.__emit('profile', **profile)
+        self.__emit('summary', metrics=metrics)
+        self.sink.close()
+
+
+def current():
+    """
+    :return: the progress of the encoder that is running, or a silent one if there is none
+    """
+    if _current is None:
+        return Progress(None, SilentSink())
+    return _current
+
+
+def sink(name='auto', stream=None):
+    """
+    :param name: one of SINKS
+    :param stream: where to write the events (default: stdout)
+    :return: the sink
+    """
+    stream = stream or sys.stdout
+    if name == 'auto':
+        isatty = getattr(stream, 'isatty', None)
+        name = 'tty' if isatty is not None and isatty() else 'json'
+    if name == 'tty':
+        return TTYSink(stream)
+    if name == 'json':
+        return JSONSink(stream)
+    return SilentSink()
+
+
+class SilentSink():
+    """drops every event"""
+
+    def emit(self, event):
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONSink():
+    """writes the events as lines of JSON. A row event is only written if the last one was written long enough
+    ago, so that a run of thousands of rows doesn't write thousands of lines; the last row before any other
+    event, and the last row of all, are always written."""
+
+    # the most row events written a second
+    RATE = 10
+
+    def __init__(self, stream):
+        self.stream = stream
+        # the last row event, if it wasn't written
+        self.__row = None
+        self.__written = 0
+
+    def emit(self, event):
+        if event['event'] == 'row':
+            now = time.perf_counter()
+            if now - self.__written < 1 / self.RATE and event['done'] != event['total']:
+                self.__row = event
+                return
+            self.__written = now
+            self.__row = None
+        elif self.__row is not None:
+            self.__write(self.__row)
+            self.__row = None
+        self.__write(event)
+
+    def __write(self, event):
+        self.stream.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def close(self):
+        if self.__row is not None:
+            self.__write(self.__row)
+            self.__row = None
+        self.stream.flush()
+
+
+class TTYSink():
+    """draws a progress bar on the last line of the terminal, and prints the problems and the summary above it"""
+
+    # the most times a second the bar is drawn
+    RATE = 10
+    # the width of the bar itself
+    WIDTH = 30
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.__status = ''
+        self.__done = 0
+        self.__total = None
+        self.__drawn = 0
+        # whether the bar is on the current line of the terminal
+        self.__shown = False
+
+    def emit(self, event):
+        kind = event['event']
+        if kind == 'stage':
+            self.__status = event['message']
+            self.__draw(force=True)
+        elif kind == 'note':
+            self.__status = event['message']
+            self.__draw()
+        elif kind == 'rows':
+            self.__total = event['total']
+            self.__done = 0
+            self.__draw(force=True)
+        elif kind == 'row':
+            self.__done = event['done']
+            self.__status = ' '.join(event['citation'])
+            self.__draw(force=event['done'] == self.__total)
+        elif kind == 'problem':
+            lines = ['**** ' + event['message']]
+            if event['detail'] is not None:
+                lines.append('     ' + event['detail'])
+            self.__print(lines)
+        elif kind == 'profile':
+            self.__print(flame(event), redraw=False)
+        elif kind == 'summary':
+            self.__print(["Here are some quality metrics for overall execution:"] +
+                         [LABELS.get(name, name) + ": " + str(value) for name, value in event['metrics'].items()],
+                         redraw=False)
+
+    def __draw(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.__drawn < 1 / self.RATE:
+            return
+        self.__drawn = now
+        if self.__total:
+            filled = self.WIDTH * self.__done // self.__total
+            line = '[%s%s] %d/%d %s' % ('#' * filled, '.' * (self.WIDTH - filled), self.__done, self.__total,
+                                        self.__status)
+        else:
+            line = self.__status
+        width = shutil.get_terminal_size().columns - 1
+        line = line.replace('\n', ' ')[:width]
+        self.stream.write('\r' + line.ljust(width))
+        self.stream.flush()
+        self.__shown = True
+
+    def __print(self, lines, redraw=True):
+        """prints lines that stay on the terminal, and draws the bar again below them
+
+        :param lines: the lines
+        :param redraw: whether to draw the bar again
+        """
+        if self.__shown:
+            self.stream.write('\r' + ' ' * (shutil.get_terminal_size().columns - 1) + '\r')
+        self.stream.write('\n'.join(lines) + '\n')
+        self.__shown = False
+        if redraw:
+            self.__draw(force=True)
+
+    def close(self):
+        if self.__shown:
+            self.stream.write('\n')
+            self.__shown = False
+        self.stream.flush()
+
+
+def flame(profile, width=30):
+    """draws the spans of a profile as a tree, with a bar for the share of the run each of them took, e.g.
+        apparatus                  2.031s  61.2%  ##################
+          build                    0.734s  22.1%  ######
+
+    :param profile: the 'profile' event
+    :param width: the width of a bar for the whole run
+    :return: the lines
+    """
+    total = profile['total'] or 1
+    lines = ["Where the %.3f seconds of the run went:" % profile['total']]
+    for span in profile['spans']:
+        share = span['seconds'] / total
+        name = '  ' * span['depth'] + span['span']
+        calls = '' if span['calls'] == 1 else ' (%d times)' % span['calls']
+        lines.append("  %-34s %8.3fs %5.1f%%  %s%s" % (name[:34], span['seconds'], 100 * share,
+                                                      '#' * round(width * share), calls))
+    if profile['pstats'] is not None:
+        lines.append("The cProfile statistics were written to " + profile['pstats'])
+    elif profile['profiled'] is not None:
+        lines.append("No stage or span called " + profile['profiled'] + " ran, so nothing was profiled with cProfile")
+    return lines
+
+
+def count_rows(appCrit):
+    """
+    :param appCrit: the apparatus CSV
+    :return: the number of rows to encode, i.e. every row but the one of column labels
+    """
+    with open(appCrit, encoding='utf-8') as appFile:
+        return max(0, sum(1 for row in csv.reader(appFile, delimiter=',') if row) - 1)
@@ -0,0 +1,527 @@
+import os  # 'operating system' - used for the paths of the modules and the table
+import re  # operations for regular expressions, i.e. very powerful text matching
+import sys  # command line arguments, and the exit status of --check
+import ast  # finds the patterns written inline in the code
+import csv  # writes and reads the table
+import math  # fits the growth of the match time
+import time  # times each match
+import argparse  # reads the flags of the benchmark
+import warnings  # quiets the warnings of the re module about patterns that it will read differently one day
+import importlib  # loads the modules, to find the patterns they compile when they are imported
+from batch_encoding import ENCODERS  # the encoders of the manifest genres
+from row_budget import Watchdog, RowTimeout  # stops a match that takes longer than --limit
+
+# this script lists every regex the encoders use and times each of them on adversarial strings of growing length,
+# to find the patterns that backtrack catastrophically before a CSV row does (see row_budget.py).
+# Usage: python regex_fuzz.py [--output table.csv] [--check table.csv] [--max-length N] [--limit SECONDS]
+#
+# The patterns are found in the encoders and in every module of this directory that they import, in two ways:
+#   inline    each call of re.compile(), re.search(), re.sub() etc. and each clean up Rule() whose pattern is
+#             written in the code, including patterns put together from constants, e.g. '[a-zA-Z' + GREEK + ']'.
+#             A part that is only known at run time, usually the lemma of a row, is replaced with the word
+#             'lemma', and the pattern is marked as a lemma pattern.
+#   compiled  each compiled pattern the modules keep, e.g. in a list of lemma forms or in a Rewriter, once they
+#             are imported; this finds the patterns that are joined together at run time.
+# Each pattern is run over the whole of each string, as re.sub() and re.findall() do, for the strings of FAMILIES,
+# e.g. a long run of letters ending in a character that no pattern expects. The time of a match is fitted against
+# the length of the string: a pattern whose time grows faster than the length is super-linear, and one that takes
+# longer than --limit seconds on a string of --max-length characters or less is catastrophic.
+#
+# The table is written as CSV, by default to results/regex-fuzz.csv. With --check, a table that is kept in the
+# repository is read as the known state of the patterns, and the script exits with status 1 if a pattern is now
+# worse than it says, e.g. a new pattern that is super-linear, so that a check can stop new patterns from adding
+# catastrophic backtracking. The time of a match depends on the machine, so only the verdicts are compared.
+
+# the directory of the encoders
+HERE = os.path.dirname(os.path.abspath(__file__))
+# the root of the repository
+ROOT = os.path.dirname(HERE)
+
+# the modules the search starts from. Servius reads the table of sources from a path on its author's machine
+# when it is imported, so usually only its inline patterns are found.
+MODULES = list(ENCODERS.values()) + ['servius_encoding']
+
+# the functions of the re module that take a pattern as their first argument
+RE_FUNCTIONS = {'compile', 'search', 'match', 'fullmatch', 'findall', 'finditer', 'sub', 'subn', 'split'}
+# the classes whose first argument is a pattern, e.g. Rule(r'\s+', ' ') in app_cleanup.py
+PATTERN_CLASSES = {'Rule'}
+# what a part of a pattern that is only known at run time is replaced with
+LEMMA = 'lemma'
+
+# the adversarial strings: each one repeats its unit up to the length and ends in a character that no pattern
+# expects, so that a pattern that can match the run in many ways tries all of them before it fails
+FAMILIES = [
+    ('letters', 'a'),
+    ('words', 'ab '),
+    ('spaces', ' '),
+    ('parentheses', '('),
+    ('numbered words', '(ab) '),
+    ('daggers', '†'),
+    ('cruces', '†ab† '),
+    ('angle brackets', '<ab '),
+]
+END = '!'
+
+# the verdicts, from best to worst
+LINEAR = 'linear'
+SUPER_LINEAR = 'super-linear'
+CATASTROPHIC = 'catastrophic'
+VERDICTS = [LINEAR, SUPER_LINEAR, CATASTROPHIC]
+# a fitted exponent above this is super-linear. Quadratic patterns fit about 2, and the constant cost of a call
+# keeps linear ones below 1.
+EXPONENT = 1.5
+# the shortest string whose time is fitted; shorter ones mostly time the call itself
+FIT_FROM = 128
+# how long each timing runs a pattern again and again, in seconds
+TIMING = 0.002
+
+# the columns of the table
+COLUMNS = ['Pattern', 'Flags', 'Lemma', 'Verdict', 'Exponent', 'Worst input', 'Length', 'Seconds', 'Where']
+
+
+class Found():
+    """a pattern, with the places it was found"""
+
+    def __init__(self, pattern, flags):
+        """
+        :param pattern: the pattern, as written
+        :param flags: the re flags it is compiled with, as an int
+        """
+        self.pattern = pattern
+        self.flags = flags
+        # whether a part of the pattern was only known at run time
+        self.lemma = False
+        # e.g. 'apparatus_entry.py:24' or 'apparatus_entry.PROSE_LEMMA_FORMS'
+        self.where = []
+
+
+class Evaluator():
+    """works out the text of a pattern written in the code, from the constants of its module"""
+
+    def __init__(self, modules):
+        """
+        :param modules: module name -> (its syntax tree, the module if it could be imported, or None)
+        """
+        self.modules = modules
+        # whether the last text evaluated had a part that is only known at run time
+        self.lemma = False
+
+    def text(self, node, module, function=None, depth=0):
+        """
+        :param node: an expression of the code
+        :param module: the name of the module it is in
+        :param function: the function it is in, if any, for its local variables
+        :param depth: how many names have been looked up to get here
+        :return: the text of the expression, with LEMMA for any part that is only known at run time, or None if
+            it isn't text
+        """
+        if depth > 10:
+            self.lemma = True
+            return LEMMA
+        if isinstance(node, ast.Constant):
+            return node.value if isinstance(node.value, str) else None
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            left = self.text(node.left, module, function, depth)
+            right = self.text(node.right, module, function, depth)
+            return None if left is None or right is None else left + right
+        if isinstance(node, ast.JoinedStr):
+            parts = []
+            for value in node.values:
+                parts.append(self.text(value.value if isinstance(value, ast.FormattedValue) else value,
+                                       module, function, depth))
+            return None if None in parts else ''.join(parts)
+        if isinstance(node, ast.Name):
+            return self.name(node.id, node.lineno, module, function, depth + 1)
+        # e.g. a call, or an attribute of an object
+        self.lemma = True
+        return LEMMA
+
+    def name(self, name, line, module, function, depth):
+        """
+        :return: the text of a variable, see text()
+        """
+        if function is not None:
+            # the last assignment to the variable before the line, in the function
+            value = None
+            for node in ast.walk(function):
+                if isinstance(node, ast.Assign) and node.lineno < line and any(
+                        isinstance(target, ast.Name) and target.id == name for target in node.targets):
+                    if value is None or node.lineno > value.lineno:
+                        value = node
+            if value is not None:
+                return self.text(value.value, module, function, depth)
+            if name in [argument.arg for argument in function.args.args]:
+                # e.g. the pattern argument of a function
+                self.lemma = True
+                return LEMMA
+        tree, imported = self.modules.get(module, (None, None))
+        if imported is not None and name in vars(imported):
+            value = vars(imported)[name]
+            return value if isinstance(value, str) else None
+        if tree is not None:
+            for node in tree.body:
+                if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == name
+                                                        for target in node.targets):
+                    return self.text(node.value, module, None, depth)
+                if isinstance(node, ast.ImportFrom) and node.module in self.modules and any(
+                        alias.name == name and alias.asname is None for alias in node.names):
+                    return self.name(name, 0, node.module, None, depth)
+        self.lemma = True
+        return LEMMA
+
+    def flags(self, node):
+        """
+        :param node: the flags argument, e.g. re.IGNORECASE | re.S
+        :return: the flags, as an int
+        """
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 're':
+            return int(getattr(re, node.attr, 0))
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+            return self.flags(node.left) | self.flags(node.right)
+        return 0
+
+
+def find_modules(names):
+    """
+    :param names: the modules to start from, e.g. ['prose_encoding']
+    :return: module name -> its syntax tree, for those modules and every module of this directory they import
+    """
+    trees = {}
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        path = os.path.join(HERE, name + '.py')
+        if name in trees or not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as source:
+            trees[name] = ast.parse(source.read(), path)
+        for node in ast.walk(trees[name]):
+            if isinstance(node, ast.ImportFrom) and node.module:
+                pending.append(node.module)
+            elif isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+    return trees
+
+
+def import_modules(trees):
+    """
+    :param trees: module name -> its syntax tree
+    :return: module name -> (its syntax tree, the module, or None if it can't be imported), and the modules that
+        couldn't be imported -> why
+    """
+    modules = {}
+    failed = {}
+    for name, tree in trees.items():
+        try:
+            modules[name] = (tree, importlib.import_module(name))
+        except Exception as error:
+            # e.g. Servius, which reads the table of sources from a path on its author's machine
+            modules[name] = (tree, None)
+            failed[name] = type(error).__name__ + ': ' + str(error)
+    return modules, failed
+
+
+def inline_patterns(modules, found):
+    """adds the patterns written in the code of the modules
+
+    :param modules: module name -> (its syntax tree, the module or None)
+    :param found: (pattern, flags) -> Found
+    """
+    evaluator = Evaluator(modules)
+    for module, (tree, imported) in modules.items():
+        # the innermost function around each call
+        functions = {}
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                for inner in ast.walk(node):
+                    if id(inner) not in functions or functions[id(inner)].lineno < node.lineno:
+                        functions[id(inner)] = node
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or not node.args:
+                continue
+            call = node.func
+            if isinstance(call, ast.Attribute) and isinstance(call.value, ast.Name) and call.value.id == 're' \
+                    and call.attr in RE_FUNCTIONS:
+                flags = 0
+                if call.attr == 'compile' and len(node.args) > 1:
+                    flags = evaluator.flags(node.args[1])
+            elif isinstance(call, ast.Name) and call.id in PATTERN_CLASSES:
+                flags = 0
+            else:
+                continue
+            for keyword in node.keywords:
+                if keyword.arg == 'flags':
+                    flags = evaluator.flags(keyword.value)
+            evaluator.lemma = False
+            pattern = evaluator.text(node.args[0], module, functions.get(id(node)))
+            if pattern is None or pattern == LEMMA and evaluator.lemma:
+                # e.g. a compiled pattern, which is found once it is imported, or a pattern made entirely at run time
+                continue
+            add(found, pattern, flags, module + '.py:' + str(node.lineno), evaluator.lemma)
+
+
+def compiled_patterns(modules, found):
+    """adds the compiled patterns that the modules keep, e.g. in lists of forms, or in a Rewriter
+
+    :param modules: module name -> (its syntax tree, the module or None)
+    :param found: (pattern, flags) -> Found
+    """
+    seen = set()
+
+    def visit(value, where, depth):
+        if id(value) in seen or depth > 4:
+            return
+        seen.add(id(value))
+        if isinstance(value, re.Pattern):
+            # compiled patterns are str patterns, or bytes ones, which the encoders don't use
+            if isinstance(value.pattern, str):
+                add(found, value.pattern, value.flags & ~re.UNICODE, where, False)
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            for item in value:
+                visit(item, where, depth + 1)
+        elif isinstance(value, dict):
+            for item in value.values():
+                visit(item, where, depth + 1)
+        elif hasattr(value, '__self__') and isinstance(value.__self__, re.Pattern):
+            # e.g. the bound pattern.match of a lemma form
+            visit(value.__self__, where, depth + 1)
+        elif type(value).__module__ in modules and hasattr(value, '__dict__'):
+            # e.g. a Rewriter and the passes it compiled
+            for item in vars(value).values():
+                visit(item, where, depth + 1)
+
+    for module, (tree, imported) in modules.items():
+        if imported is None:
+            continue
+        for name, value in vars(imported).items():
+            if not name.startswith('__'):
+                visit(value, module + '.' + name, 0)
+
+
+def add(found, pattern, flags, where, lemma):
+    """records a pattern found at where"""
+    # the re module sets UNICODE on every str pattern, so it isn't worth telling apart
+    key = (pattern, flags & ~re.UNICODE)
+    if key not in found:
+        found[key] = Found(pattern, key[1])
+    found[key].lemma = found[key].lemma or lemma
+    if where not in found[key].where:
+        found[key].where.append(where)
+
+
+def find_patterns(names=MODULES):
+    """
+    :param names: the modules to start from
+    :return: every pattern found, in the order they were found, and the modules that couldn't be imported
+    """
+    modules, failed = import_modules(find_modules(names))
+    found = {}
+    inline_patterns(modules, found)
+    compiled_patterns(modules, found)
+    return list(found.values()), failed
+
+
+def time_match(compiled, text, watchdog):
+    """
+    :param compiled: the compiled pattern
+    :param text: the string
+    :param watchdog: the Watchdog that stops a match that takes too long
+    :return: the seconds it takes to run the pattern over the whole string, as re.sub() does
+    :raises RowTimeout: if it took longer than the budget of the watchdog
+    """
+    calls = 0
+    start = time.perf_counter()
+    with watchdog.row('match', (len(text), compiled.pattern)):
+        while True:
+            for match in compiled.finditer(text):
+                pass
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= TIMING:
+                return elapsed / calls
+
+
+def exponent(times):
+    """
+    :param times: (length, seconds) for each string of a family, shortest first
+    :return: the exponent of the length that the time grows with, fitted on a log-log scale, or None if there
+        are too few long strings
+    """
+    points = [(math.log(length), math.log(seconds)) for length, seconds in times if length >= FIT_FROM and seconds > 0]
+    if len(points) < 2:
+        return None
+    x = sum(p[0] for p in points) / len(points)
+    y = sum(p[1] for p in points) / len(points)
+    return sum((p[0] - x) * (p[1] - y) for p in points) / sum((p[0] - x) ** 2 for p in points)
+
+
+def fuzz(found, lengths, limit):
+    """times a pattern on each family of strings, and decides its verdict
+
+    :param found: the Found pattern
+    :param lengths: the lengths of the strings, shortest first
+    :param limit: the most seconds a match may take before the pattern is catastrophic
+    :return: the row of the table for the pattern, as a dict
+    """
+    row = {'Pattern': found.pattern, 'Flags': flag_names(found.flags), 'Lemma': 'yes' if found.lemma else '',
+           'Verdict': LINEAR, 'Exponent': '', 'Worst input': '', 'Length': '', 'Seconds': '',
+           'Where': ' '.join(found.where)}
+    try:
+        with warnings.catch_warnings():
+            # e.g. 'Possible nested set' for [[, which the encoder that uses the pattern warns about already
+            warnings.simplefilter('ignore', FutureWarning)
+            compiled = re.compile(found.pattern, found.flags)
+    except re.error as error:
+        # e.g. a lemma pattern whose lemma closes a parenthesis the rest of it opens
+        row['Verdict'] = 'not compiled: ' + str(error)
+        return row
+
+    watchdog = Watchdog(limit)
+    worst = None
+    for family, unit in FAMILIES:
+        times = []
+        verdict = LINEAR
+        for length in lengths:
+            text = unit * (length // len(unit)) + END
+            try:
+                times.append((len(text), time_match(compiled, text, watchdog)))
+            except RowTimeout:
+                verdict = CATASTROPHIC
+                break
+        fitted = exponent(times)
+        if verdict != CATASTROPHIC and fitted is not None and fitted > EXPONENT:
+            # time the family again, in case the machine was busy, and keep the better fit
+            again = [(length, time_match(compiled, unit * (length // len(unit)) + END, watchdog))
+                     for length, seconds in times]
+            fitted = min(fitted, exponent(again))
+            if fitted > EXPONENT:
+                verdict = SUPER_LINEAR
+        # the worst family is the one with the worst verdict, then the largest exponent
+        rank = (VERDICTS.index(verdict), fitted if fitted is not None else 0)
+        if worst is None or rank > worst[0]:
+            length, seconds = (len(unit * (lengths[len(times)] // len(unit)) + END), limit) \
+                if verdict == CATASTROPHIC else times[-1]
+            worst = (rank, verdict, fitted, family, length, seconds)
+
+    rank, row['Verdict'], fitted, row['Worst input'], row['Length'], seconds = worst
+    row['Exponent'] = '%.2f' % fitted if fitted is not None else ''
+    row['Seconds'] = '%.6f' % seconds
+    return row
+
+
+def flag_names(flags):
+    """
+    :param flags: the re flags, as an int
+    :return: their names, e.g. 'IGNORECASE|DOTALL'
+    """
+    return '|'.join(flag.name for flag in re.RegexFlag if flags & flag and flag.name != 'UNICODE' and
+                    flag.value & (flag.value - 1) == 0)
+
+
+def place(row):
+    """
+    :param row: a row of the table
+    :return: where the pattern of the row was found first, as a sort key, e.g. ('apparatus_entry', 24) for
+        apparatus_entry.py:24, or ('apparatus_entry', 0, 'APP_TAG') for a pattern it keeps compiled
+    """
+    where = row['Where'].split(' ')[0]
+    if '.py:' in where:
+        module, line = where.split('.py:')
+        return module, int(line), ''
+    module, name = where.split('.', 1)
+    return module, 0, name
+
+
+def read_table(path):
+    """
+    :param path: a table written by this script
+    :return: (pattern, flags) -> the verdict of each pattern in it
+    """
+    with open(path, encoding='utf-8', newline='') as table:
+        return {(row['Pattern'], row['Flags']): row['Verdict'] for row in csv.DictReader(table)}
+
+
+def check(rows, known):
+    """
+    :param rows: the rows of this run
+    :param known: the verdicts of the table kept in the repository, see read_table()
+    :return: the rows whose verdict is worse than the known one, and the rows whose verdict is better
+    """
+    worse = []
+    better = []
+    for row in rows:
+        verdict = known.get((row['Pattern'], row['Flags']), LINEAR)
+        if row['Verdict'] not in VERDICTS or verdict not in VERDICTS:
+            continue
+        if VERDICTS.index(row['Verdict']) > VERDICTS.index(verdict):
+            worse.append(row)
+        elif VERDICTS.index(row['Verdict']) < VERDICTS.index(verdict):
+            better.append(row)
+    return worse, better
+
+
+def print_report(rows, failed):
+    """prints the patterns that aren't linear, worst first
+
+    :param rows: the rows of the table
+    :param failed: the modules that couldn't be imported -> why
+    """
+    flagged = sorted((row for row in rows if row['Verdict'] != LINEAR),
+                     key=lambda row: (-VERDICTS.index(row['Verdict']) if row['Verdict'] in VERDICTS else 1,
+                                      -float(row['Exponent'] or 0)))
+    print("%d patterns, %d of them not linear" % (len(rows), len(flagged)))
+    print("%-13s %8s  %-15s %7s  %s" % ('verdict', 'exponent', 'worst input', 'length', 'pattern (where)'))
+    for row in flagged:
+        print("%-13s %8s  %-15s %7s  %s (%s)" % (row['Verdict'][:13], row['Exponent'], row['Worst input'],
+                                                 row['Length'], row['Pattern'], row['Where'].split(' ')[0]))
+    for module, error in failed.items():
+        print("Only the inline patterns of", module, "were found, since it couldn't be imported:", error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='times every regex of the encoders on adversarial strings')
+    parser.add_argument('--output', help='where to write the table as CSV (default: results/regex-fuzz.csv)')
+    parser.add_argument('--check', metavar='TABLE',
+                        help='exit with status 1 if a pattern is worse than this table says, e.g. results/regex-fuzz.csv')
+    parser.add_argument('--max-length', type=int, default=2048,
+                        help='the length of the longest adversarial string (default: 2048)')
+    parser.add_argument('--limit', type=float, default=0.5,
+                        help='the seconds a match may take before its pattern is catastrophic (default: 0.5)')
+    options = parser.parse_args(sys.argv[1:])
+    output = options.output or os.path.join(ROOT, 'results', 'regex-fuzz.csv')
+
+    # 16, 32, 64, ... characters
+    lengths = []
+    length = 16
+    while length <= options.max_length:
+        lengths.append(length)
+        length *= 2
+
+    patterns, failed = find_patterns()
+    print("Fuzzing", len(patterns), "patterns ...")
+    rows = [fuzz(found, lengths, options.limit) for found in patterns]
+    # in the order of the code, so that the table only changes where a pattern does
+    rows.sort(key=place)
+
+    # read the table to check against before it may be overwritten
+    known = read_table(options.check) if options.check else None
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8', newline='') as table:
+        writer = csv.DictWriter(table, COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print_report(rows, failed)
+    print("The table was written to", output)
+
+    if known is not None:
+        worse, better = check(rows, known)
+        for row in better:
+            print("Better than", options.check, "says:", row['Verdict'], row['Pattern'], "(" + row['Where'] + ")")
+        for row in worse:
+            print("**** Worse than", options.check, "says:", row['Verdict'], row['Pattern'], "(" + row['Where'] + ")")
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import re  # recognises the pattern that was running when a row ran out of time
+import time  # times each step of a row
+import heapq  # keeps the slowest rows
+import signal  # interrupts a step that runs over its budget
+import threading  # the budget can only be enforced on the main thread
+import contextlib  # the guard of each step is a with statement
+from diagnostics import report  # logs the quarantined rows
+from progress import current  # reports the quarantined rows
+
+# this module gives each row of the apparatus a time budget, so that one bad row can't hang a run. Some patterns
+# backtrack exponentially on unusual input, e.g. the pattern that splits 'lemma2' in prose_encoding.py, and lemmas
+# go into their patterns unescaped, so a lemma with a stray parenthesis or a long run of letters and spaces can
+# take minutes or more.
+#
+# The risky steps of a row, e.g. compiling it into an <app> tag or finding its lemma, run in a with statement:
+#     with watchdog.row('build', (pNum, sNum, lemma)):
+#         entry = PROSE_ENTRIES.entry(...)
+# A step that takes longer than the budget (--row-budget, in seconds) is interrupted with RowTimeout. The row is
+# quarantined: it is logged with the 'timeout' code and the pattern that was running, and left unencoded, and
+# the run goes on with the next row. The budget is enforced with SIGALRM, which the regex engine checks while it
+# backtracks; where there is none (e.g. on Windows, or off the main thread), the steps are only timed.
+#
+# At the end of the run, the slowest rows and the slowest lemma patterns are written to the log.
+
+# the default budget of each step of a row, in seconds
+BUDGET = 10.0
+# how many of the slowest rows and patterns are reported
+KEEP = 10
+
+
+class RowTimeout(Exception):
+    """a step of a row took longer than its budget"""
+
+    def __init__(self, step, budget, pattern=None, where=None):
+        """
+        :param step: the step of the row, e.g. 'build'
+        :param budget: the budget, in seconds
+        :param pattern: the regex that was running when the step was stopped, if any
+        :param where: the line of code that was running, e.g. 'app_cleanup.py:75 in rewrite'
+        """
+        message = "the row took more than %g seconds to %s" % (budget, step)
+        if pattern is not None:
+            message += ", in the pattern " + pattern
+        if where is not None:
+            message += " (" + where + ")"
+        super().__init__(message)
+        self.step = step
+        self.pattern = pattern
+
+
+class Watchdog():
+    """the time budget of the rows of one run, and the time they took"""
+
+    def __init__(self, budget=BUDGET, logger=None):
+        """
+        :param budget: the most seconds a step of a row may take, or 0 or None to only time the steps
+        :param logger: the logger of the encoder, or None in a worker process, which doesn't report the rows
+            itself (see ApparatusBatch.apply())
+        """
+        self.budget = budget if budget else None
+        self.logger = logger
+        # (step, context, reason) for each row that ran out of time
+        self.quarantined = []
+        # the slowest steps, as a heap of (seconds, step, context)
+        self.__slowest = []
+        # the pattern of each timed step that has one -> [seconds, calls]
+        self.__patterns = {}
+        # the step that is running, for the signal handler
+        self.__step = None
+
+    @contextlib.contextmanager
+    def row(self, step, context, pattern=None):
+        """times a step of a row, and stops it if it takes longer than the budget
+
+        :param step: the step, e.g. 'build', 'cleanup' or 'locate'
+        :param context: the citation of the row, with its lemma last, e.g. ('12', '3', 'ut mihi')
+        :param pattern: the pattern the step runs, e.g. the lemma pattern, to time it among the patterns
+        :raises RowTimeout: if the step took longer than the budget; the row has been quarantined
+        """
+        alarm = (self.budget is not None and hasattr(signal, 'setitimer')
+                 and threading.current_thread() is threading.main_thread())
+        if alarm:
+            previous = signal.signal(signal.SIGALRM, self.__expire)
+            signal.setitimer(signal.ITIMER_REAL, self.budget)
+        self.__step = step
+        start = time.perf_counter()
+        try:
+            yield
+        except RowTimeout as timeout:
+            self.quarantine(step, context, str(timeout))
+            raise
+        finally:
+            # the alarm may go off between the end of the step and here, when the step is already done
+            self.__step = None
+            if alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous)
+            seconds = time.perf_counter() - start
+            if len(self.__slowest) < KEEP:
+                heapq.heappush(self.__slowest, (seconds, step, tuple(context)))
+            elif seconds > self.__slowest[0][0]:
+                heapq.heapreplace(self.__slowest, (seconds, step, tuple(context)))
+            if pattern is not None:
+                times = self.__patterns.setdefault(pattern, [0, 0])
+                times[0] += seconds
+                times[1] += 1
+
+    def __expire(self, signum, frame):
+        """the SIGALRM handler: stops the step that is running"""
+        if self.__step is None:
+            return
+        raise RowTimeout(self.__step, self.budget, *running(frame))
+
+    def quarantine(self, step, context, reason):
+        """records a row that ran out of time, and reports it
+
+        :param step: the step that ran out of time
+        :param context: the citation of the row, with its lemma last
+        :param reason: what the row was doing, see RowTimeout
+        """
+        self.quarantined.append((step, tuple(context), reason))
+        if self.logger is None:
+            return
+        citation = [str(c) for c in context[:-1]]
+        lemma = context[-1]
+        current().problem("row " + " ".join(citation) + " took too long and was quarantined; it was left unencoded "
+                          "for now.", lemma)
+        logmsg = " row quarantined: " + " ".join(citation) + ", lemma: " + str(lemma) + ": " + reason + "\n"
+        report(self.logger, "timeout", logmsg, citation, lemma, reason=reason)
+
+    def slowest(self):
+        """
+        :return: the slowest steps of the run, slowest first, as (seconds, step, context) tuples
+        """
+        return sorted(self.__slowest, reverse=True)
+
+    def slowest_patterns(self):
+        """
+        :return: the patterns that took the most time over the run, slowest first, as (seconds, calls, pattern)
+            tuples
+        """
+        return sorted(((seconds, calls, pattern) for pattern, (seconds, calls) in self.__patterns.items()),
+                      reverse=True)[:KEEP]
+
+    def log_report(self):
+        """writes the slowest rows and patterns of the run to the log"""
+        if self.logger is None:
+            return
+        lines = [" The slowest rows:"]
+        for seconds, step, context in self.slowest():
+            lines.append("  %9.6fs  %-8s %s" % (seconds, step, " ".join(str(c) for c in context)))
+        lines.append(" The slowest lemma patterns:")
+        for seconds, calls, pattern in self.slowest_patterns():
+            lines.append("  %9.6fs  %5d times  %s" % (seconds, calls, pattern))
+        if self.quarantined:
+            lines.append(" Rows quarantined for taking more than %g seconds: %d" % (self.budget, len(self.quarantined)))
+        self.logger.info("\n".join(lines))
+
+
+def running(frame):
+    """
+    :param frame: the frame that was running when the step was stopped
+    :return: the pattern that was running, if a compiled pattern or the pattern of a re function is in reach,
+        and the innermost line of code outside the re module, e.g. 'app_cleanup.py:75 in rewrite'
+    """
+    pattern = None
+    where = None
+    while frame is not None:
+        if frame.f_code.co_filename == re.__file__:
+            if pattern is None and isinstance(frame.f_locals.get('pattern'), str):
+                # e.g. re.search(pattern, string)
+                pattern = frame.f_locals['pattern']
+        else:
+            if where is None:
+                where = "%s:%d in %s" % (frame.f_code.co_filename.replace('\\', '/').split('/')[-1],
+                                         frame.f_lineno, frame.f_code.co_name)
+            if pattern is None:
+                # e.g. a Rewriter pass, or a lemma pattern, running in this frame
+                for value in frame.f_locals.values():
+                    if isinstance(value, re.Pattern):
+                        pattern = value.pattern
+                        break
+        if pattern is not None and where is not None:
+            break
+        frame = frame.f_back
+    return pattern, where
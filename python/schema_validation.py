@@ -0,0 +1,288 @@
+import os  # finds and keeps the local copy of the schema
+import copy  # copies the changed sections into the document that is validated
+import hashlib  # names the compiled Schematron after the schema it was compiled from
+import urllib.parse  # resolves the grammars a schema includes against its URL
+import urllib.request  # downloads the schema the first time it is used
+import lxml.etree as ET  # compiles the RelaxNG schema and runs the Schematron stylesheet
+from lxml import isoschematron  # compiles the Schematron rules embedded in the RelaxNG schema
+
+# the schema every encoded text points at in its <?xml-model?> instructions
+SCHEMA = 'https://digitallatin.github.io/guidelines/critical-editions.rng'
+# where the local copy of the schema and its compiled Schematron are kept between runs
+CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'dll-automation', 'schema')
+
+# the namespace of RelaxNG, and the elements that pull in another grammar
+RNG = '{http://relaxng.org/ns/structure/1.0}'
+RNG_REFERENCES = (RNG + 'include', RNG + 'externalRef')
+# the namespace of the Schematron validation report
+SVRL = '{http://purl.oclc.org/dsdl/svrl}'
+# the failures in a Schematron validation report
+SVRL_FAILURES = (SVRL + 'failed-assert', SVRL + 'successful-report')
+
+
+class SchemaUnavailable(Exception):
+    """raised when the schema can neither be found in the cache nor downloaded, or isn't a schema lxml can compile"""
+
+
+class SchemaValidator():
+    """the RelaxNG schema of the guidelines and the Schematron rules embedded in it, each compiled once.
+
+    Compiling the schema takes much longer than validating a text, so the compiled validators are kept for
+    every file encoded in the same process, and the Schematron stylesheet, the slowest part to compile, is
+    written to the cache directory and reused by later runs.
+    """
+
+    # (local path of the schema, its modification time) -> SchemaValidator
+    __loaded = {}
+
+    def __init__(self, path, cacheDir=CACHE):
+        """
+        :param path: the local copy of the RelaxNG schema
+        :param cacheDir: where the compiled Schematron is kept
+        :raises SchemaUnavailable: if the schema, or a grammar it includes, can't be read, parsed or compiled
+        """
+        try:
+            schema = ET.parse(path)
+            self.relaxng = ET.RelaxNG(schema)
+        except (OSError, ET.XMLSyntaxError, ET.RelaxNGParseError) as error:
+            raise SchemaUnavailable(path + ' is not a RelaxNG schema that can be compiled: ' + str(error))
+        self.schematron = compiled_schematron(schema, path, cacheDir)
+
+    @classmethod
+    def load(cls, schema=SCHEMA, cacheDir=CACHE):
+        """
+        :param schema: the URL or path of the RelaxNG schema
+        :param cacheDir: the directory for the local copy of a schema given by its URL
+        :return: the SchemaValidator for the schema, compiled once per process
+        :raises SchemaUnavailable: if the schema doesn't exist, or can't be downloaded, parsed or compiled
+        """
+        path = local_copy(schema, cacheDir)
+        if not os.path.isfile(path):
+            raise SchemaUnavailable(path + ' does not exist')
+        key = (os.path.abspath(path), os.path.getmtime(path))
+        if key not in cls.__loaded:
+            try:
+                cls.__loaded[key] = cls(path, cacheDir)
+            except SchemaUnavailable:
+                if path != schema:
+                    # a broken download, which is downloaded again on the next run
+                    for grammar in grammar_files(path):
+                        os.remove(grammar)
+                raise
+        return cls.__loaded[key]
+
+    def validate(self, tree, sections):
+        """validates the sections that changed in this run, with the header of the text, and nothing else
+
+        :param tree: the encoded text
+        :param sections: a dict from each changed section (a <seg>, <l> or verse <div>) to its citation
+        :return: a list of (citation, message) tuples, the RelaxNG errors first and then the Schematron ones.
+            The citation is None for an error outside the changed sections (e.g. in the header).
+        """
+        document, copies = prune(tree, sections)
+        errors = []
+        if not self.relaxng.validate(document):
+            errors = [(citation_of(document, error.path, copies), error.message) for error in self.relaxng.error_log]
+            if len(sections) > 1 and any(citation is None for citation, message in errors):
+                # libxml2 reports some errors at an ancestor of the section they are in, so each section is
+                # validated on its own to find out which ones they belong to
+                errors = [error for error in errors if error[0] is not None]
+                for section, citation in sections.items():
+                    single, copy = prune(tree, {section: citation})
+                    if not self.relaxng.validate(single):
+                        errors.extend((citation, error.message) for error in self.relaxng.error_log
+                                      if citation_of(single, error.path, copy) is None)
+        if self.schematron is not None:
+            report = self.schematron(document)
+            for failure in report.getroot().iter(*SVRL_FAILURES):
+                message = ' '.join(''.join(failure.itertext()).split())
+                errors.append((citation_of(document, failure.get('location'), copies), message))
+        return errors
+
+
+def local_copy(schema, cacheDir):
+    """
+    :param schema: the URL or path of the RelaxNG schema
+    :param cacheDir: the directory for the local copy of a schema given by its URL
+    :return: the path of the local copy, which is downloaded the first time it is needed, with the grammars it
+        includes by a relative href (<include> and <externalRef>), which are put where lxml looks for them
+    :raises SchemaUnavailable: if the schema or a grammar it includes can't be downloaded or parsed
+    """
+    if '://' not in schema:
+        return schema
+    path = download(schema, os.path.join(cacheDir, schema.rstrip('/').split('/')[-1]), cacheDir)
+    pending = [(schema, path)]
+    try:
+        while pending:
+            url, local = pending.pop()
+            for href in references(local):
+                pending.append((urllib.parse.urljoin(url, href),
+                                download(urllib.parse.urljoin(url, href), os.path.join(os.path.dirname(local), href),
+                                         cacheDir)))
+    except SchemaUnavailable:
+        # e.g. a truncated download, which is downloaded again on the next run
+        for grammar in grammar_files(path):
+            os.remove(grammar)
+        raise
+    return path
+
+
+def download(url, path, cacheDir):
+    """
+    :param url: the URL of a grammar
+    :param path: where to keep it
+    :param cacheDir: the directory of the local copies, which path has to be in
+    :return: path, once the grammar is there
+    :raises SchemaUnavailable: if it can't be downloaded, or would be kept outside the cache directory
+    """
+    path = os.path.normpath(path)
+    if os.path.commonpath([os.path.abspath(path), os.path.abspath(cacheDir)]) != os.path.abspath(cacheDir):
+        raise SchemaUnavailable(url + ' would be kept outside ' + cacheDir)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            data = response.read()
+    except OSError as error:
+        raise SchemaUnavailable(url + ' could not be downloaded: ' + str(error))
+    # write the copy in one go, so that an interrupted download doesn't leave half a schema in the cache
+    with open(path + '.part', 'wb') as out:
+        out.write(data)
+    os.replace(path + '.part', path)
+    return path
+
+
+def references(path):
+    """
+    :param path: the local copy of a grammar
+    :return: the relative hrefs of the grammars it includes. Absolute ones are left to lxml.
+    :raises SchemaUnavailable: if it isn't well-formed XML, e.g. a truncated download
+    """
+    try:
+        grammar = ET.parse(path)
+    except ET.XMLSyntaxError as error:
+        raise SchemaUnavailable(path + ' is not a RelaxNG schema that can be compiled: ' + str(error))
+    return [reference.get('href') for reference in grammar.iter(*RNG_REFERENCES)
+            if reference.get('href') and '://' not in reference.get('href')]
+
+
+def grammar_files(path):
+    """
+    :param path: the local copy of the schema
+    :return: the paths of the schema and of the grammars it includes that are there, in the order they are found
+    """
+    files = []
+    pending = [os.path.normpath(path)]
+    while pending:
+        grammar = pending.pop()
+        if grammar in files or not os.path.exists(grammar):
+            continue
+        files.append(grammar)
+        try:
+            pending.extend(os.path.normpath(os.path.join(os.path.dirname(grammar), href))
+                           for href in references(grammar))
+        except SchemaUnavailable:
+            pass
+    return files
+
+
+def compiled_schematron(schema, path, cacheDir=CACHE):
+    """
+    :param schema: the parsed RelaxNG schema
+    :param path: the local copy of the schema
+    :param cacheDir: where the compiled Schematron is kept
+    :return: the XSLT that runs the Schematron rules embedded in the schema, or None if it has none
+    """
+    # named after everything it was compiled from, so that a change to any included grammar compiles it again
+    digest = hashlib.sha1()
+    for grammar in grammar_files(path):
+        with open(grammar, 'rb') as source:
+            digest.update(source.read())
+    compiled = os.path.join(cacheDir, os.path.basename(path) + '.' + digest.hexdigest() + '.xsl')
+    if os.path.exists(compiled):
+        try:
+            return ET.XSLT(ET.parse(compiled))
+        except (ET.XMLSyntaxError, ET.XSLTParseError):
+            # a broken copy, which is compiled again
+            pass
+
+    try:
+        schematron = isoschematron.Schematron(schema, store_xslt=True)
+    except (ET.SchematronParseError, ET.XSLTError):
+        # no rules, or rules this XSLT 1.0 processor can't compile
+        return None
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        schematron.validator_xslt.write(compiled)
+    except OSError:
+        # the compiled rules just aren't kept for the next run
+        pass
+    return ET.XSLT(schematron.validator_xslt)
+
+
+def prune(tree, sections):
+    """copies the parts of the text that need to be validated: the root and everything in it, except that
+    <text> only keeps the changed sections and the elements around them
+
+    :param tree: the encoded text
+    :param sections: a dict from each changed section to its citation
+    :return: the copy as an ElementTree, and a dict from each copied section to its citation
+    """
+    # the elements that lead to a changed section
+    path = set()
+    for section in sections:
+        for ancestor in section.iterancestors():
+            if ancestor in path:
+                break
+            path.add(ancestor)
+
+    copies = {}
+
+    def shallow(element):
+        """copies an element without the children that don't lead to a changed section"""
+        new = ET.Element(element.tag, element.attrib, nsmap=element.nsmap)
+        new.text = element.text
+        for child in element:
+            if child in sections:
+                new.append(copy.deepcopy(child))
+                copies[new[-1]] = sections[child]
+            elif child in path:
+                new.append(shallow(child))
+                new[-1].tail = child.tail
+        return new
+
+    root = tree.getroot()
+    document = ET.Element(root.tag, root.attrib, nsmap=root.nsmap)
+    document.text = root.text
+    for child in root:
+        if child in path:
+            document.append(shallow(child))
+        elif not (isinstance(child.tag, str) and ET.QName(child).localname == 'text'):
+            # the header, with the witnesses and sources that the <app> tags point at
+            document.append(copy.deepcopy(child))
+        else:
+            continue
+        document[-1].tail = child.tail
+    return document.getroottree(), copies
+
+
+def citation_of(document, location, copies):
+    """
+    :param document: the document that was validated
+    :param location: the XPath of the node an error was found at
+    :param copies: a dict from each copied section to its citation
+    :return: the citation of the section that contains the node, or None
+    """
+    try:
+        nodes = document.xpath(location) if location else []
+    except ET.XPathError:
+        return None
+    if not nodes or not isinstance(nodes[0], ET._Element):
+        return None
+    node = nodes[0]
+    while node is not None:
+        if node in copies:
+            return copies[node]
+        node = node.getparent()
+    return None
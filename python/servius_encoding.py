@@ -2,12 +2,23 @@ import re # operations for regular expressions, i.e. very powerful text matching
 from enum import Enum # make an enumerated list of possible types for a text thing
 import os # 'operating system' - used for file input/output and automatically opening the finished file
 import codecs # This is important for reading files with Unicode characters.
-import time # used to add time between output statements
 import csv  # used for processing CSV (comma separated values) input files containing app. crit. entries.
 import lxml.etree as ET # used to parse XML to insert <app> tags
-import logging # support error logging to an external file
-import logging.config # support for our logger configuration
 import sys # command line arguments
+from citation_index import CitationIndex, SERVIUS # prebuilt lookup of verse divs by citation
+from tei_tree import build_tree, write_tree # builds the base-text tree in memory and writes the finished file once
+from apparatus_batch import ApparatusBatch, INVALID, INSERTED, OVERLAP, TIMED_OUT, BAD_LEMMA # splices all of a <seg>'s <app> tags at once
+from schema_validation import SchemaValidator, SchemaUnavailable # optional validation of the changed sections
+from command_line import parse_options # the optional flags, e.g. --validate
+from diagnostics import open_log, close_log, report # writes the log and the diagnostics off the encoding thread
+from progress import Progress, sink, count_rows, current # reports the progress of the encoding (--progress)
+from profiling import start_profile, lap # times each stage and each step of the apparatus rows (--profile)
+from row_budget import Watchdog, RowTimeout # gives each row of the apparatus a time budget (--row-budget)
+from app_cleanup import Rewriter, Rule, PLACEHOLDERS, NONE_READING, WHITESPACE, editorial_passes # the shared <app> tag clean up rules
+from apparatus_entry import EntryCompiler, ProseEntryCompiler, VERSE_LEMMA_FORMS, VERSE_READING_FORMS, \
+    VERSE_PUNCTUATION, NO_LEMMA_ANNOTATION, source_pointers, readings # the shared apparatus entry compiler, which the Servius one extends
+from sigla import parse_sigla, GREEK # the compiled, memoized siglum grammar
+from watch_mode import run_encoder # runs the encoder once, or on every save of its input with --watch
 
 # these are some counters for testing purposes
 count_refs = 0
@@ -139,8 +150,7 @@ class ServThing():
         text = search_addition.sub(r'&lt;supplied reason="lost"&gt;', text)
         search_addition = re.compile(r'>')
         text = search_addition.sub(r'&lt;/supplied&gt;', text)
-        # this will make allow us to retrieve section text without duplicating it.
-        # the XML entities are replaced with <> at the very end.
+        # the XML entities are replaced with <> just before the base text is parsed.
 
         # clean up stray single newlines
         text = text.replace("\n", " ")
@@ -172,7 +182,6 @@ class ServThing():
                     ref = '&lt;ref target="urn:cts:latinLit:phi0690.phi003:9.' + refstripped + '"&gt;' + refstripped + '&lt;/ref&gt;'
                     # do this to get a sensible identifier
                     refstripped = "aeneid-9." + refstripped
-                    print("%%% refstripped:", refstripped)
                 elif re.match('\([0-9]+\.[0-9]+\)', r[0]) or re.match('\([0-9]+\.[0-9]+\)', r[6]):
                     if r[0] == '': refstripped = r[6].replace("(", "").replace(")", "")
                     else: refstripped = r[0].replace("(", "").replace(")", "")
@@ -181,7 +190,6 @@ class ServThing():
                     ref = '&lt;ref target="urn:cts:latinLit:phi0690.phi003:' + refstripped + '"&gt;' + refstripped + '&lt;/ref&gt;'
                     # do this to get a sensible identifier
                     refstripped = "aeneid-" + refstripped
-                    print("%%% refstripped:", refstripped)
                 elif r[5] == '':
                     # ref without an italicized quote
                     refstripped = r[6].replace("(", "").replace(")", "")
@@ -214,15 +222,11 @@ class ServThing():
 
                 # wrap the quote in <quote>
                 text = text.replace("_" + r[5] + "_", "&lt;quote&gt;" + r[5] + "&lt;/quote&gt;")
-                print("text before replacement:", text)
-                print("about to replace")
                 if r[0] == '':
                     text = text.replace(r[6], quote_ref_re)
                 else:
                     text = text.replace(r[0], quote_ref_re)
 
-                print("text after replacement:", text)
-
         # get italic text that doesnt have a reference
         search_ital = re.compile(r'_([a-zA-Z,\'.][a-zA-Z()0-9:;.,\'\s.\-?]*)_')
         text = search_ital.sub(r'&lt;hi rend="italic"&gt;\1&lt;/hi&gt;', text)
@@ -270,7 +274,7 @@ class ServThing():
             global count_no_match
             count_no_match +=1
             # oof we didnt find anything
-            print("NO TABLE MATCH FOUND FOR REF:", ref_string)
+            current().problem("no table match found for reference", ref_string)
             if self.__logger is not None:
                 # user specified a logger for this ServThing to use
                 self.__logger.error("no matching table reference found for: " + ref_string)
@@ -279,8 +283,8 @@ class ServThing():
         if len(matches) == 1:
             global count_match
             count_match += 1
-            print("ONE MATCH FOUND FOR REF:", ref_string)
-            print("\t" + matches[0].items()[0][1]) # half-assed workaround because I don't know how namespaces work
+            # half-assed workaround because I don't know how namespaces work
+            current().note("one table match found for " + ref_string + ": " + matches[0].items()[0][1])
             if self.__logger is not None:
                 # user specified a logger for this ServThing to use
                 self.__logger.info("matching table reference found for: " + ref_string + ", " + row.items()[0][1])
@@ -291,11 +295,11 @@ class ServThing():
             count_2_match += 1
             # found more than one candidate match.
             # For now, just print this out and write to log file.
-            print("MULTIPLE TABLE MATCHES FOUND FOR REF:", ref_string)
+            current().problem("multiple table matches found for reference " + ref_string,
+                              ", ".join(m.items()[0][1] for m in matches))
             if self.__logger is not None:
                 self.__logger.error("multiple possible matches found for: " + ref_string)
             for m in matches:
-                print("\t" + m.items()[0][1])
                 if self.__logger is not None:
                     self.__logger.error("\t" + m.items()[0][1])
             # TODO: find a way to use an author name to help on this
@@ -319,19 +323,6 @@ class ServThing():
 
         #print("MY XML IS: " + self.xml)
 
-def checkXML(tag):
-    """checks a generated XML tag for correct syntax
-
-    :param tag: the tag to be checked
-    :return: True if syntactically valid, False otherwise
-    """
-
-    try:
-        ET.fromstring(tag)
-        return True
-    except:
-        return False
-
 # maybe should be moved into the class for neater encapsulation
 # no, it shouldn't, because we check type in order to decide whether to instantiate a ServThing
 def thing_type(thing):
@@ -356,597 +347,136 @@ def thing_type(thing):
     else:
         return Type.SAME
 
-def replace_with_xml(text, pattern, new_entries, index):
-    """replaces a lemma instance within the text with its associated <app> tag.
+# APP CRIT ENCODING HERE
 
-    :param text: the section text before replacement
-    :param pattern: the regex match pattern for finding the lemma (consists of the searchLem (lemma with markup to match the text) and negative lookbehind/lookahead statements to make sure the lemma is not appearing in another word)
-    :param new_entries: the <app> tag with which to replace the lemma
-    :param index: the number of the lemma instance we are trying to replace (defaults to 0 (first instance) unless otherwise specified)
+# a tradition, e.g. [Σ], in the witnesses of a lemma and of a reading
+LEMMA_TRADITION = re.compile('\\[[A-Z' + GREEK + '_]+\\s*\\]')
+READING_TRADITION = re.compile('\\[[*A-Z' + GREEK + '_]+?\\s*\\]')
+# single asterisks (i.e. italics), which have no meaning for wits - just a typographical convention
+ITALICS = re.compile(r'(?<!\*)\*(?!\*)')
+# bold witnesses and bracketed traditions
+BOLD = re.compile(r'(\*\*.*\*\*)')
+BRACKETS = re.compile(r'(\[.*\])')
+# part of a word in <>
+PARTIAL_WORD = re.compile(r'((\w*)<(\w+)>)')
 
-    :return: a string containing the text with <app> inserted
-    """
 
-    # counter for how many non-replacable lemma instances we have
-    # i.e. we don't want to replace instances appearing within attributes or comments
-    inc = 0
+def partial_addition(lem):
+    """handles lemmas of the form 'w<ord>'"""
+    newLem = lem.split('<')[0] + '<supplied reason="lost">' + lem.split('<')[1].split('>')[0] + '</supplied>' + \
+        lem.split('<')[1].split('>')[1]
+    return newLem, lem.replace('<', '').replace('>', '') + " addition", newLem
 
-    # find indices of lemma match
-   # print("index for lem matches: " + str(index))
-    beg, end = [(x.start(), x.end()) for x in re.finditer(pattern, text, flags=re.IGNORECASE)][index]
 
-    # avoid replacing lemma instances that are in comments
-    if re.search("\<\!--(.)*" + pattern + "[\s\w]*--\>", text):
-        inc += 1
-        # avoid replacing lemma instances in xml:id attributes
-        if re.search("xml\:id\=\"(.)*-" + pattern + "-", text):
-            inc += 1
+def partial_additions(lem):
+    """handles lemmas of the form words w<ord> w<ord> words"""
+    # TODO: this is a temporary stopgap. The following regex can probably be generalized to handle most if not all cases
+    newLem = lem
+    for m in PARTIAL_WORD.findall(lem):
+        newLem = newLem.replace(m[0], m[1] + '<supplied reason="lost">' + m[2] + '</supplied>')
+    return newLem, lem.replace('<', '').replace('>', '') + " addition", newLem
 
-        # find updated indices if necessary
-        #print("updated index for lem matches: " + index)
-        beg, end = [(x.start(), x.end()) for x in re.finditer(pattern, text, flags=re.IGNORECASE)][index + inc]
 
-     # return the text with the <app> tag inserted in the proper place
-    return "{0}{1}{2}".format(text[:beg], new_entries, text[end:])
+# Servius has no speakers, but has additions to part of a word
+LEMMA_FORMS = VERSE_LEMMA_FORMS[1:] + [
+    (re.compile(r'\w*<\w+>').match, partial_addition),
+    (re.compile(r'(\w+(\s)*)*(\w*<\w+>(\s))+(\w+(\s)*)*').match, partial_additions),
+]
+READING_FORMS = VERSE_READING_FORMS[1:]
 
-# APP CRIT ENCODING FUNCTIONS HERE
-# TODO: MODIFY THESE TO WORK FOR THE SERVIUS CSV
+# the Servius apparatus italicizes omissions as _om._, so it has its own omission rule
+CLEANUP = Rewriter(PLACEHOLDERS, NONE_READING, WHITESPACE, *editorial_passes(Rule(r'>\*?om\.\*?</rdg>', '/>')))
 
-# TODO: MODIFY TO WORK FOR THE SERVIUS CSV
-def make_lem_tag(p, s, lem, wit, source, note):
-    """makes a <lem> tag for one lemma.
 
-    :param p: paragraph number
-    :param s: section number
-    :param lem: the lemma as it appears in the spreadsheet
-    :param wit: lemma witnesses as one string, separated by spaces (e.g. "A B Cac D")
-    :param source: lemma source(s), separated by spaces (e.g. "Name OtherName ThirdName")
-    :param note: lemma notes as one string. Multiple notes should be separated with the forward slash /, e.g. "This is a note / (this is another note)"
+class ServiusEntryCompiler(ProseEntryCompiler):
+    """compiles rows of the Servius apparatus into <app> tags.
 
-    :return: a list containing the searchLem at index 0 and the complete lemma tag at index 1
+    The apparatus comes out of pandoc with a lot of stray whitespace and typographical markup: italics (_ and *),
+    bold witnesses and traditions in [].
     """
 
-    # strip everything - it comes out of pandoc with a lot of stray whitespace
-    lem = lem.strip()
-    wit = wit.strip()
-    source = source.strip()
-    note = note.strip()
-
-    # deal with an empty lemma
-    if lem == '':
-           lem = '<!-- NO LEMMA -->'
-
-
-    # this block deals with editorial additions, which have <> in the lemma
-
-    # TODO: use regexes to come up with a better, more generalized way of doing this
-    # deal with lemmas of the form '<word> some other words'
-    if (re.match('<\w+>(\s)*\w+', lem)):
-        newLem = '<supplied reason="lost">' + lem.split('>')[0].replace('<', '') + '</supplied>' + \
-                 lem.split('>')[1]
-
-        # a copy of the lemma with <> removed to use in xml:id attributes
-        idLem = lem.replace('<', '').replace('>', '') + " addition"
-
-        # in this case, the searchLem (used to match the base text) is the same as the marked up lemma
-        searchLem = newLem
-        lem = newLem
-
-    # now deal with lemmas of the form '<word>'
-    elif (re.match('<\w+>', lem)):
-        searchLem = lem.replace('<', '').replace('>', '')
-
-        # a copy of the lemma with <> removed to use in xml:id attributes
-        idLem = searchLem + " addition"
-
-        # add <supplied> tags and set searchLem
-        searchLem = '<supplied reason="lost">' + searchLem + '</supplied>'
-        lem = searchLem
-
-    # now deal with lemmas of the form 'w<ord>'
-    elif (re.match('\w*<\w+>', lem)):
-        newLem = lem.split('<')[0] + '<supplied reason="lost">' + lem.split('<')[1].split('>')[0] + '</supplied>' + \
-                    lem.split('<')[1].split('>')[1]
-
-        # a copy of the lemma with <> removed to use in xml:id attributes
-        idLem = lem.replace('<', '').replace('>', '') + " addition"
-
-        # in this case, the searchLem (used to match the base text) is the same as the marked up lemma
-        searchLem = newLem
-        lem = newLem
-
-    # now deal with lemmas of the form words w<ord> w<ord> words
-    elif (re.match('(\w+(\s)*)*(\w*<\w+>(\s))+(\w+(\s)*)*', lem)):
-        # TODO: this is a temporary stopgap. The following regex can probably be generalized to handle most if not all cases
-        newLem = lem
-        for m in re.findall('((\w*)<(\w+)>)', lem):
-            replaceStr = m[1] + '<supplied reason="lost">' + m[2] + '</supplied>'
-            newLem = newLem.replace(m[0], replaceStr)
-
-        # a copy of the lemma with <> removed to use in xml:id attributes
-        idLem = lem.replace('<', '').replace('>', '') + " addition"
-
-        # in this case, the searchLem (used to match the base text) is the same as the marked up lemma
-        searchLem = newLem
-        lem = newLem
-
-    # initialize variables for all other lemmas (i.e. those that don't contain editorial additions)
-    else:
-        searchLem = lem
-        idLem = lem
-
-
-    def lem_xmlid():
-        """A function for creating the xml:id value like lem-1.1-vicit."""
+    ENTRY = '\n<!-- App entry for %s: %s --><app>%s</app>\n'
 
-        # Handle lemmas with multiple words so that they are joined with "-"
-        split = idLem.replace('_', '').split(' ')
-        joined = '-'.join(split)
+    def lemma(self, label, lem, wit, source, note):
+        # strip everything - it comes out of pandoc with a lot of stray whitespace
+        return ProseEntryCompiler.lemma(self, label, lem.strip(), wit.strip(), source.strip(), note.strip())
 
-        # clean out remaining markup to create a valid XML attribute
-        joined = joined.replace("gap-reason=”lost”", "lacuna")
-        return 'xml:id="lem-' + str(p) + '.' + str(s) + '-' + joined + '"'
+    def reading(self, label, reading, wit, source, note):
+        return ProseEntryCompiler.reading(self, label, reading.strip(), wit.strip(), source.strip(), note.strip())
 
-    # clean punctuation out of xml:id so that it is valid
-    lem_xmlid = str(lem_xmlid())
-    puncRE = re.compile('[,;\'<>()/]')
-    lem_xmlid = puncRE.sub('', lem_xmlid)
-
-    def lem_target():
-        """ A function for creating the xml:id as the value for @target."""
-        split = idLem.split(' ')
-        joined = '-'.join(split)
-        joined = joined.replace("gap-reason=”lost”", "lacuna")
-        return "lem-" + str(p) + '.' + str(s) + '-' + joined
-
-    lem_target = str(lem_target())
-
-    def lem_wit(wit):
-        """A function for wrapping the witness(es) for a lemma in the correct XML.
-
-            this function returns a tuple containing:
-            at index 0 - the @wit attribute of the <lem> tag
-            at index 1 - a string containing relevant <witDetail> tags
-        """
+    def lemma_form(self, lem):
+        # the lemma is already stripped, so its search text is left as it is
+        return EntryCompiler.lemma_form(self, lem)
 
+    def witnesses(self, wit, target, kind):
         if wit == '':
-            # if no witnesses, return wit=None (will be cleaned up later) and no <witDetail> tags
-            return ['wit="None"', '']
-        else:
-            detailTags = ''
-            # remove single asterisks (i.e. italics) which has no meaning for wits - just a typographical convention
-            wit = re.sub("(?<!\*)\*(?!\*)", "", wit).strip()
-            # fix the string so that every bold witness is surrounded by **A**, to solve the wacky trailing space issue
-            s = re.search("(\*\*.*\*\*)", wit)
-            new_bold = ""
-            if s:
-                bold_split = s[0].replace("*", "").split(' ')
-                for b in bold_split:
-                    if b != "" and b != " ":
-                        basterisks = "**" + b + "**"
-                        new_bold += basterisks + " "
-                wit = wit.replace(s[0], new_bold.strip())
-            # Maybe overkill because there is probably only one so trailing space is the only issue, but better safe than sorry.
-            s = re.search("(\[.*\])", wit)
-            new_bracket = ""
-            if s:
-                bracket_split = s[0].replace("[", "").replace("]", "").split(' ')
-                for b in bracket_split:
-                    if b != "" and b != " ":
-                        bbrackets = "[" + b + "]"
-                        new_bracket += bbrackets + " "
-                wit = wit.replace(s[0], new_bracket.strip())
-            print("after bold and bracket processing:", wit)
-            split = wit.split(' ')
-
-            # iterate through witnesses and check if each has ac, c, spl, sbl
-            # could add other markup here as needed
-            # the regex used to match sigla will match uppercase Latin letters A-Z and upper and lowercase Greek letters
-            for s in split:
-                # handle original corrections
-                if re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(ac\)', s):
-                    # witDetail for correction-original
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + lem_target + "\" type=\"correction-original\"/>"
-                # matches both c and pc to maintain backwards compatibility as much as possible
-                # only pc is correct. our guidelines and specs reflect this.
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(c\)', s) or re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(pc\)', s):
-                    # witDetail for correction-altered
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + lem_target + "\" type=\"correction-altered\"/>"
-                # supra lineam
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(spl\)', s):
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + lem_target + "\">supra lineam</witDetail>"
-                # sub lineam
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(sbl\)', s):
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + lem_target + "\">sub lineam</witDetail>"
-                # in margin
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(inmg\)', s):
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + lem_target + "\">in margin</witDetail>"
-
-
-                # now start checking for bold or []
-                if re.match(u'\[[A-Z\u0391-\u03A9\u03B1-\u03C9_]+\s*\]', s):
-                    # tradition specified
-                    s = s.replace('[','').replace(']','').strip()
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + lem_target + "\" type=\"tradition\"/>"
-
-                # if the siglum doesn't have an annotation, it doesn't need a <witDetail>
-                else:
-                    pass
-
-            # new way of doing this b/c the regexes would be convoluted for the Servius wits
-            # probably a little slower but n is small enough that it doesnt really matter that much
-            wit_str = ""
-            for sp in split:
-                wit_str = wit_str + "#" + sp.replace('[','').replace(']','') + " "
-
-            # return a tuple containing: [the @wit of the <lem> tag as a str, str containing relevant <witDetail> tags]
-            return ['wit="' + wit_str.strip() + '"', detailTags]
-
-    # n.b. lemwit is a tuple not a string
-    lemwit = lem_wit(wit)
-
-
-    def lemsrc(source):
-        """A function for wrapping the source(s) for a lemma in the correct XML.
-
-        returns a str containing the @source attribute of the <lem> tag
-        """
+            return 'wit="None"', ''
+
+        detailTags = ''
+        wit = ITALICS.sub('', wit).strip()
+        # fix the string so that every bold witness is surrounded by **A**, to solve the wacky trailing space issue
+        s = BOLD.search(wit)
+        if s:
+            wit = wit.replace(s[0], ' '.join('**' + b + '**' for b in s[0].replace('*', '').split(' ') if b != ''))
+        # Maybe overkill because there is probably only one so trailing space is the only issue, but better safe than sorry.
+        s = BRACKETS.search(wit)
+        if s:
+            wit = wit.replace(s[0], ' '.join('[' + b + ']' for b in s[0].replace('[', '').replace(']', '').split(' ')
+                                             if b != ''))
+        sigla = parse_sigla(wit)
+
+        tradition = LEMMA_TRADITION if kind == 'lem' else READING_TRADITION
+        for s in sigla:
+            # annotations (ac, c, pc, spl, sbl, inmg) on uppercase Latin and Greek letters
+            if s.annotation is not None and s.annotation != 'ir' and not s.latin_lowercase():
+                detailTags += s.detail(s.token, target)
+            # tradition specified
+            if tradition.match(s.token):
+                detailTags += '<witDetail wit="#' + s.token.replace('[', '').replace(']', '').strip() + \
+                              '" target="#' + target + '" type="tradition"/>'
+
+        # the regexes for @wit would be convoluted for the Servius wits, so the # are added one by one
+        return 'wit="' + ' '.join('#' + s.token.replace('[', '').replace(']', '') for s in sigla) + '"', detailTags
+
+    def sources(self, source):
         if not source:
             return 'source="None"'
-        else:
-            # List the sigla, putting # before each one. Space will be added below.
-            source = source.replace('_', '').strip()
-            split = source.split(' ')
-            joined = '#'.join(split)
-            # This produces A#B#C. We need some space:
-            search_src = re.compile(r'(#[a-zA-Z(a-z)?])')
-            spaced_src = search_src.sub(r' \1', joined)
-            # Now we have A #B #C. Let's put # on that first one.
-            search_joined = re.compile(r'((?<!#)^[a-zA-Z(a-z)?\s])')
-            first_src = search_joined.sub(r'#\1', spaced_src)
-            return 'source="' + str(first_src) + '"'
-
-    lemsrc = str(lemsrc(source))
-
-    def lemnote():
-        """A function for encoding any annotation on the lemma as a <note>.
-
-        returns all note tags in a single string, e.g. "<note></note><note>this is another note</note>"
-
-        forward slash / is used as a delimiter for multiple notes, because Unicode snowman ☃ was rejected
-        """
-
-        noteTags = ''
-        if not note or note == "" or note.isspace():
-            return '<!-- NO LEMMA ANNOTATION -->'
-        else:
-            try:
-                # throws an exception if no / in the string
-                # this is caught below
-                split = note.split("/")
-
-                for s in split:
-                    # wrap each note in a tag
-                    if s != "" and not s.isspace():
-                        noteTags += ('<note target="' + lem_target + '">' + s.strip() + '</note>')
-
-                return noteTags
-            except:
-                # if only one note, wrap it in a <note> tag and return
-                return '<note target="' + lem_target + '">' + note.strip() + '</note>'
-
-    lemnote = str(lemnote())
-
-    # return a tuple with the cleaned up lemma for searching and the full <lem> tag as a string
-    return [searchLem, '<lem ' + lemwit[0] + ' ' + lemsrc + ' ' + lem_xmlid + '>' \
-            + lem + '</lem>' + lemwit[1] + lemnote]
-
-# TODO: MODIFY TO WORK FOR THE SERVIUS CSV
-def make_rdg_tag(p, s, reading, wit, source, note):
-    """makes a <rdg> tag for one reading.
-
-    :param p: paragraph number
-    :param s: section number
-    :param reading: the reading as it appears in the spreadsheet
-    :param wit: reading witnesses as one string, separated by spaces (e.g. "A B Cac D")
-    :param source: reading source(s), separated by spaces (e.g. "Name OtherName ThirdName")
-    :param note: reading notes as one string. Multiple notes should be separated with the forward slash /,  e.g. "This is a note / (this is another note)"
-
-    :return: the entire reading tag as a str
-    """
-
-    # strip everything - it comes out of pandoc with a lot of stray whitespace
-    reading = reading.strip()
-    wit = wit.strip()
-    source = source.strip()
-    note = note.strip()
-
-    # deal with an empty reading
-    if reading == '':
-        return ''
-
-    # this block deals with editorial additions, which have <> in the reading
-
-    # deal with a <supplied> tag which only includes part of a word
-    if (re.search('\<\w+\s*\<gap reason=”lost”/>\s*\w+\>\w+', reading)):
-        # deal with a lacuna in the middle of a word
-        # this was written to deal with 13.5 but can be generalized as necessary
-        reading = '<supplied reason="lost">' + reading.split('>')[0].replace('<', '', 1) + ">" +reading.split('>')[1] + '</supplied>' + reading.split('>')[2]
-        # we use a separate variable to contain the reading to use in xml:id
-        idRdg = reading.replace('<', '').replace('>', '').replace('supplied', '').replace('reason="lost"', '') + " addition"
-
-    # deal with readings of the form <word> some other words or some words <word>
-    elif (re.search('\<\w+\>(\s)*\w+ | \w+(\s)*\<\w+\>', reading)):
-        reading = '<supplied reason="lost">' + reading.split('>')[0].replace('<', '') + '</supplied>' + \
-                        reading.split('>')[1]
-        # we use a separate variable to contain the reading to use in xml:id
-        idRdg = reading.replace('<', '').replace('>', '').replace('supplied', '').replace('reason="lost"', '') + " addition"
-
-    # now deal with readings of the form '<word>'
-    elif (re.search('<\w+>', reading)):
-        reading = reading.replace('<', '').replace('>', '')
-        idRdg = reading + " addition"
-        reading = '<supplied reason="lost">' + reading + '</supplied>'
-
-    # if there are no editorial addtions, initialize idRdg
-    else:
-        idRdg = reading
-
-    # Handling the source(s) for the first reading
-    def rdgsrc(source):
-        """A function for wrapping the source(s) for a reading in the correct XML.
-
-        returns a str containing the @source attribute of the <rdg> tag
-        """
-        if not source:
-            return 'source="None"'
-        else:
-            # List the sigla, putting # before each one. Space will be added below.
-            source = source.replace('_', '').strip()
-            split = source.split(' ')
-            joined = '#'.join(split)
-            # This produces A#B#C. We need some space:
-            search_wit = re.compile(r'(#[a-zA-Z(a-z)?])')
-            spaced_wit = search_wit.sub(r' \1', joined)
-            # Now we have A #B #C. Let's put # on that first one.
-            search_joined = re.compile(r'((?<!#)^[a-zA-Z(a-z)?\s])')
-            first_wit = search_joined.sub(r'#\1', spaced_wit)
-            return 'source="' + str(first_wit) + '"'
-
-    source = str(rdgsrc(source))
-
-    # Handling the xml:id for the reading
-    def rdg_xmlid():
-        """A function for creating the xml:id value like rdg-1.1-vicit."""
-
-        # Handle readings with multiple words so that they are joined with "-"
-        # also remove * * for italics
-        split = idRdg.replace('_', '').split(' ')
-        joined = '-'.join(split).replace("\"", '').replace("*", "")
-        joined = joined.replace("gap-reason=”lost”", "lacuna")
-        return 'xml:id="rdg-' + str(p) + '.' + str(s) + '-' + joined + '"'
-
-    # remove punctuation that would make @xml:id invalid
-    rdg_xmlid = str(rdg_xmlid())
-    puncRE = re.compile('[,;\'<>()/]')
-    rdg_xmlid = puncRE.sub('', rdg_xmlid)
-
-    def rdg_target():
-        """ A function for creating the xml:id as the value for @target."""
-        split = idRdg.split(' ')
-        joined = '-'.join(split)
-        joined = joined.replace("gap-reason=”lost”", "lacuna").replace("/", '')
-        return 'rdg-' + str(p) + '.' + str(s) + '-' + joined
-
-    rdg_target = str(rdg_target())
-
-    def rdg_wit(wit):
-        """A function for wrapping the witness(es) for a reading in the correct XML.
-
-        this function returns a tuple containing:
-        at index 0 - the @wit attribute of the <rdg> tag
-        at index 1 - a string containing relevant <witDetail> tags
-        """
-
-        if wit == '':
-            return ['wit="None"', '']
-        else:
-            # List the sigla, putting # before each one. Space will be added below.
-            detailTags = ''
-            # remove single asterisks (i.e. italics) which has no meaning for wits - just a typographical convention
-            wit = re.sub("(?<!\*)\*(?!\*)", "", wit).strip()
-            # fix the string so that every bold witness is surrounded by **A**, to solve the wacky trailing space issue
-            s = re.search("(\*\*.*\*\*)", wit)
-            new_bold = ""
-            if s:
-                bold_split = s[0].replace("*", "").split(' ')
-                for b in bold_split:
-                    if b != "" and b != " ":
-                        basterisks = "**" + b + "**"
-                        new_bold += basterisks + " "
-                wit = wit.replace(s[0], new_bold.strip())
-            # Maybe overkill because there is probably only one so trailing space is the only issue, but better safe than sorry.
-            s = re.search("(\[.*\])", wit)
-            new_bracket = ""
-            if s:
-                bracket_split = s[0].replace("[", "").replace("]", "").split(' ')
-                for b in bracket_split:
-                    if b != "" and b != " ":
-                        bbrackets = "[" + b + "]"
-                        new_bracket += bbrackets + " "
-                wit = wit.replace(s[0], new_bracket.strip())
-            print("after bold and bracket processing:", wit)
-            split = wit.split(' ')
-
-            # iterate through witnesses and check if each has ac, c, spl, sbl
-            # could add other markup here as needed
-            # the regex used to match sigla will match uppercase Latin letters A-Z and upper and lowercase Greek letters
-            for s in split:
-                # handle original corrections
-                if re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(ac\)', s):
-                    # witDetail for correction-original
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + rdg_target + "\" type=\"correction-original\"/>"
-                # matches both c and pc to maintain backwards compatibility as much as possible
-                # only pc is correct. our guidelines and specs reflect this.
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(c\)', s) or re.match(
-                        u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(pc\)', s):
-                    # witDetail for correction-altered
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + rdg_target + "\" type=\"correction-altered\"/>"
-                # supra lineam
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(spl\)', s):
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + rdg_target + "\">supra lineam</witDetail>"
-                # sub lineam
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(sbl\)', s):
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + rdg_target + "\">sub lineam</witDetail>"
-                # in margin
-                elif re.match(u'[A-Z\u0391-\u03A9\u03B1-\u03C9]\(inmg\)', s):
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + rdg_target + "\">in margin</witDetail>"
-
-                # now start checking for bold or []
-                if re.match(u'\[[*A-Z\u0391-\u03A9\u03B1-\u03C9_]+?\s*\]', s):
-                    # tradition specified
-                    s = s.replace('[', '').replace(']', '').strip()
-                    detailTags += "<witDetail wit=\"#" + s + "\" target=\"#" + rdg_target + "\" type=\"tradition\"/>"
-
-                # if the siglum doesn't have an annotation, it doesn't need a <witDetail>
-                else:
-                    pass
-
-            # new way of doing this b/c the regexes would be convoluted for the Servius wits
-            #  probably a little slower but n is small enough that it doesnt really matter that much
-            wit_str = ""
-            for sp in split:
-                wit_str = wit_str + "#" + sp.replace('[', '').replace(']', '') + " "
-            # return a tuple containing: [the @wit of the <lem> tag as a str, str containing relevant <witDetail> tags]
-            return ['wit="' + wit_str.strip() + '"', detailTags]
-
-    # n.b. wit is a tuple not a string
-    wit = rdg_wit(wit)
-
-    # Notes for rdg
-    def rdg_notes():
-        """A function for encoding any annotation on the reading as a <note>.
-
-        returns a tuple containing:
-        at index 0 - a string containing all <note> tags that should go before the reading
-        at index 1 - a string containing all <note> tags that should go after the reading
-
-        forward slash / is used as a delimiter for multiple notes, because Unicode snowman ☃ was rejected
-        """
-        noteTags = ''
-        # notes that should go before the reading
-        beforeTags = ''
-        if not note or note == "" or note.isspace():
-            return ['', '']
-        else:
-            try:
-                # throws an exception if no / in the string
-                # this is caught below
-                split = re.split("(?<!\(\w)/(?!\w+\))")
-
-                for s in split:
-                    if (s == "an" or s == "vel"):
-                        # this note goes before the reading (e.g. an or vel)
-                        # easily generalized to catch other "before reading" notes
-                        if s != "" and not s.isspace():
-                            beforeTags += ('<note target="' + rdg_target + '">' + s.strip() + '</note>')
-
-                    else:
-                        # this is a normal note (i.e. after the reading)
-                        if s != "" and not s.isspace():
-                            noteTags += ('<note target="' + rdg_target + '">' + s.strip() + '</note>')
-
-                return [beforeTags, noteTags]
-            except:
-                # if there is only one note, wrap it in tags and return it
-                return ['', '<note target="' + rdg_target + '">' + note.strip() + '</note>']
-
-    # n.b. this is a tuple not a string
-    notes = rdg_notes()
-
-    # combine parts of the tag and return the finished <rdg> tag
-    return notes[0] + '<rdg ' + wit[0] + ' ' + source + ' ' \
-           + rdg_xmlid + '>' + reading + '</rdg>' + wit[1] + notes[1]
-
-# TODO: MODIFY TO WORK FOR SERVIUS CSV
-# this one maybe doesn't need to modified? don't know yet
-def cleanup_tag(entries):
-    """a function for cleaning up an <app> tag
-
-    :param entries: a tag generated by either make_lem_tag() or make_rdg_tag()
-
-    :return: the same tag, but with extraneous tags and markup removed
-    """
-
-    # Remove empty readings.
-    search_no_ann = re.compile(r'<!-- NO ([A-Z]*) ANNOTATION -->')
-    no_ann_replace = search_no_ann.sub('', entries)
-
-    search_empty_readings = re.compile(
-        r'<rdg wit="None" source="None" xml:id="rdg-([0-9]*).([0-9]*)-([.]*)"><!-- ([A-Z(\s)?]*([\d])?) --></rdg>')
-    empty_readings_replace = search_empty_readings.sub('', no_ann_replace)
-
-    search_empty_readings2 = re.compile(
-        r'<rdg xml:id="rdg-([0-9]*).([0-9]*)-"></rdg>')
-    empty_readings_replace2 = search_empty_readings2.sub('', empty_readings_replace)
-
-    # Remove empty witnesses
-    search_wit = re.compile(r'wit="None"')
-    wit_replace = search_wit.sub(r'', empty_readings_replace2)
-
-    # Remove empty sources
-    search_src = re.compile(r'source="None"')
-    src_replace = search_src.sub(r'', wit_replace)
-
-    # Turn empty readings into self-closing tags.
-    search_none_rdg = re.compile(r'>None</rdg>')
-    none_rdg_replace = search_none_rdg.sub('/>', src_replace)
-
-    # Remove extra white space between attributes.
-    search_ws = re.compile(r'\s\s')
-    ws_replace = search_ws.sub(r' ', none_rdg_replace)
-
-    # Dealing with conventional symbols in critical editions.
-    # Brackets for an addtion, first as a value of <lem> or <rdg>
-    search_addition = re.compile(r'<([a-zA-Z]*)>([\sa-zA-Z]*)?(</rdg>|</lem>)')
-    replace_addition1 = search_addition.sub(r'"><supplied reason="lost">\1</supplied>\2\3', ws_replace)
-
-    # Now as part of an xml:id, where <> are not allowed.
-    search_addition1 = re.compile(r'(?<=-)<([a-zA-Z]*(-[a-zA-Z])?)>')
-    replace_addition2 = search_addition1.sub(r'\1-addition', replace_addition1)
-
-    # †Crux†, first as a value of an element.
-    search_crux1 = re.compile(r'†([a-zA-Z(\s)?]*)†([\sa-zA-Z]*)?(</rdg>|</lem>)')
-    replace_crux1 = search_crux1.sub(r'"><sic>\1</sic>\2\3', replace_addition2)
-
-    # Now a crux as a value of an attribute, which is not allowed.
-    search_crux2 = re.compile(r'(?<=-)†([a-zA-Z(\-)?]*)†')
-    replace_crux2 = search_crux2.sub(r'\1-crux', replace_crux1)
+        return source_pointers(source.replace('_', ''))
 
-    # Lacuna *** as a value of an element.
-    search_lacuna1 = re.compile(r'\*\*\*([\sa-zA-Z]*)?(</rdg>|</lem>)')
-    replace_lacuna1 = search_lacuna1.sub(r'<gap reason="lost"/>\1\2', replace_crux2)
+    def lemma_notes(self, note, target):
+        if not note:
+            return NO_LEMMA_ANNOTATION
+        return ''.join('<note target="' + target + '">' + s.strip() + '</note>' for s in note.split("/")
+                       if s != "" and not s.isspace())
 
-    # Lacuna *** as a value of an attribute.
-    search_lacuna2 = re.compile(r'(?<=-)\*\*\*([\sa-zA-Z]*)?')
-    replace_lacuna2 = search_lacuna2.sub(r'lacuna\1', replace_lacuna1)
+    def reading_notes(self, note, target):
+        # a reading keeps all its notes in one <note> after the reading
+        if not note:
+            return '', ''
+        return '', '<note target="' + target + '">' + note + '</note>'
 
-    # Editorial deletion with brackets [] as a value of an element
-    search_deletion1 = re.compile(r'\[([a-zA-Z]*)\]?(</rdg>|</lem>)')
-    replace_deletion1 = search_deletion1.sub(r'<surplus>\1</surplus>\2', replace_lacuna2)
+    def comment_tag(self, comment):
+        if comment == '' or comment.isspace():
+            return ''
+        return "<note>" + comment + "</note>"
 
-    # Editorial deletion with brackets [] as a value of an attribute
-    search_deletion2 = re.compile(r'(?<=-)\[([a-zA-Z]*)\]')
-    replace_deletion2 = search_deletion2.sub(r'\1-surplus', replace_deletion1)
 
-    # turn omissions in to self-closing reading tags
-    search_omission = re.compile(r'>\*?om\.\*?</rdg>') # allow optional italicized _om._
-    replace_omission = search_omission.sub(r'/>', replace_deletion2)
+# book and verse of Vergil; italics (_) and the * of asterisked sigla are removed from the xml:id of a reading
+ENTRIES = ServiusEntryCompiler(('book', 'verse'), LEMMA_FORMS, READING_FORMS, VERSE_PUNCTUATION, ('_', '_"*'), CLEANUP)
 
-    return replace_omission
+# the base text, the apparatus and the output of Servius don't come from the command line; these paths are local
+# and may not be portable either
+BASE_TEXT = "../kaster/bk9.txt"
+APPARATUS = "../kaster/excel_as_word_gfm.csv"
+OUTPUT = "../kaster/test-output.xml"
 
 # this is the main function
 def main():
+    # take the optional flags (e.g. --validate) out of the command line
+    options = parse_options(sys.argv)
+    progress = Progress('servius', sink(options.progress))
+    if options.profile: start_profile(options.profile_stage, OUTPUT)
+
     # TODO: write function-level doc for this
     # ######### file inputs and logger config #########
     # we are now using LXML because it allows us to use a custom XML parser
@@ -954,7 +484,7 @@ def main():
     parser = ET.XMLParser(remove_comments=False)
 
     # Create a variable for the path to the base text.
-    path = "../kaster/bk9.txt"
+    path = BASE_TEXT
 
     # Open the file with utf-8 encoding.
     source_file = codecs.open(path, 'r', 'utf-8')
@@ -969,38 +499,9 @@ def main():
     else:
         log_file = "servius-log.txt" #sys.argv[3].replace(sys.argv[3].split("/")[-1], "") + "servius-log-file.txt"
 
-    # this dict contains configuration info for logging errors.
-    # I chose to use a dict in order to avoid having a separate config file.
-    # This was done to keep this script as portable as possible.
-    dictLogConfig = {
-        "version": 1,
-        "handlers": {
-            "fileHandler": {
-                "class": "logging.FileHandler",
-                "formatter": "myFormatter",
-                "filename": log_file,
-                "encoding": 'utf-8'
-                # this is done to keep output sensible to the user
-                # to disable this and keep all the output, comment this line:
-                , "mode": "w"
-            }
-        },
-        "loggers": {
-            "exampleApp": {
-                "handlers": ["fileHandler"],
-                "level": "INFO",
-            }
-        },
-
-        "formatters": {
-            "myFormatter": {
-                "format": "%(message)s"
-            }
-        }
-    }
-    logging.basicConfig(filename=log_file, level=logging.INFO)
-    logging.config.dictConfig(dictLogConfig)
-    logger = logging.getLogger("Servius")
+    # the log is written, with the diagnostics next to it (e.g. balex.log.jsonl), by another thread, so
+    # that the rows aren't kept waiting for the disk (see diagnostics.py)
+    logger = open_log(log_file, "Servius")
     logger.info(" Now encoding a some Servius!")
 
     # counters for checking CSV processing quality measures
@@ -1008,7 +509,7 @@ def main():
     successful_rows = 0
     invalid_tags = 0
     not_found = 0
-    print("Let's encode some Servius!")
+    progress.stage('Encoding the verses', 'markup and structure')
     # decided to deal with _italics_ in the ServThing.__XMheLp() function
     # chunking: <div> elements
 
@@ -1098,16 +599,15 @@ def main():
             finished_blocks.append(a)
 
         text = '<div type="textpart" subtype= "verse" n="' + str(n) + '" xml:id="l' + str(n) + '">' + "\n".join(finished_blocks) + "</div>"
-        print("finished <div> number", n)
+        progress.note("finished <div> number " + str(n))
 
 
         divs.append(text)
         i = i + 3
 
     # Write the TEI header.
-    print('Now we\'ll add the TEI header and footer.')
+    progress.stage('Adding the TEI header and footer', 'header and footer')
     logger.info(' Adding the TEI header and footer.')
-    time.sleep(2)
 
     header = '''<?xml-model
             href="https://digitallatin.github.io/guidelines/critical-editions.rng" type="application/xml" 
@@ -1152,32 +652,42 @@ def main():
     # Combine the header, text, and footer
     TEI = header + "\n".join(divs) + footer
 
-    # this line makes find_iter() insufficient for finding and replacing text
-    # if we want to produce valid XML at the intermediate step, we need to figure something else out.
-    #TEI = TEI.replace("&gt;", ">").replace("&lt;", "<").replace("”","\"")
+    # the markup made by ServThing.XMLify() is escaped, so turn it into real markup before the text is parsed.
+    # lemmas are matched against the flattened <seg> content (see tei_tree.FlatText), which writes the markup out again.
+    TEI = TEI.replace("&gt;", ">").replace("&lt;", "<")
 
-    # let's output some stuff to an xml file
-    new_path = "../kaster/test-output.xml"
-    out_file = codecs.open(new_path, 'w', 'utf-8')
-    out_file.write(TEI)
-    out_file.close()
-    print('Writing the XML base text to the new file ...')
-    logger.info(" The encoded base text has been written to: " + new_path)
+    # file path for final XML file. Nothing is written to it until the app. crit. is encoded.
+    new_path = OUTPUT
 
     logger.info(" Now encoding the critical apparatus. \nEncoding errors will be shown below. \n\n")
-    print('Now that the base text is encoded, we\'ll start on the app. crit.')
-    time.sleep(2)
 
     # set up XML parsing/lxml tree
     # tree is an instance of ElementTree
     # root is an instance of Element
-    tree = ET.parse(new_path, parser=parser)
+    # build the tree straight from the encoded string, instead of writing it to new_path and parsing it back
+    progress.stage('Building the XML tree for the base text', 'parse')
+    logger.info(" The encoded base text has been parsed in memory.")
+    # smart quotes are cleaned up before the text is parsed, instead of in the finished XML
+    tree = build_tree(TEI.replace("”", "\""), parser)
     root = tree.getroot()
     # the following statement is necessary to avoid having 'ns0' as a prefix for every tag in the doc.
     # the TEI namespace (default ns for this doc) is found at: http://www.tei-c.org/ns/1.0
     ET.register_namespace('tei', 'http://www.tei-c.org/ns/1.0')
 
-    with open("../kaster/excel_as_word_gfm.csv", encoding='utf-8') as appFile:
+    # index every verse <div> once, instead of running an XPath query for every CSV row
+    # the base text is a single book, so the verse number is the whole citation
+    # (not called 'index', which the <seg> search below uses)
+    verse_index = CitationIndex(root, SERVIUS)
+
+    # <app> tags are queued per <seg> and spliced in once every row has been read,
+    # with the lemmas found by --jobs processes
+    # a row that takes longer than --row-budget to build or to find is quarantined, so that it can't hang the run
+    watchdog = Watchdog(options.row_budget, logger)
+    batch = ApparatusBatch(jobs=options.jobs, watchdog=watchdog)
+
+    progress.stage('Reading the critical apparatus', 'read rows')
+    progress.rows(count_rows(APPARATUS))
+    with open(APPARATUS, encoding='utf-8') as appFile:
         readApp = csv.reader(appFile, delimiter=',')
         for row in readApp:
             if row[0] == "Book":
@@ -1187,6 +697,9 @@ def main():
                 # get paragraph and section number and row length
             bNum = row[0]  # book number
             vNum = row[1]  # verse (in Vergil) number
+            progress.row(bNum, vNum)
+            # with --profile, the time of each step of the row is added to the profile of this stage
+            lap('read')
             l = len(row)
 
             # TODO: need a feature for dealing with ellipses ... in lemma
@@ -1198,64 +711,49 @@ def main():
             # use a non-greedy regex to match the smallest possible (hopefully correct) section of text
             # make the <app> tag w the full lemma in it.
 
-            # make the lemma tag
-            lemReturn = make_lem_tag(bNum, vNum, row[2], row[3], row[4], row[5])
-            searchLem = lemReturn[0]
-            lemtag = lemReturn[1].strip()
+            # compile the row into an <app> tag: the lemma is in columns 2-5, the general annotation on the entry
+            # in column 6 and the readings, four columns each, from column 7 on
+            try:
+                with watchdog.row('build', (bNum, vNum, row[2])):
+                    entry = ENTRIES.entry((bNum, vNum), row[2:6], readings(row, 7, l - 1), row[6])
+            except RowTimeout:
+                # the row was quarantined
+                continue
+            searchLem = entry.searchLem
+            new_entries = entry.tag
+            lap('build')
 
            # print("\n\nLEMMA: " + searchLem)
 
-            # encode general annotations on this entry
-            if row[6] == '' or row[6].isspace():
-                commenttag = ''
-            else:
-                commenttag = "<note>" + row[6] + "</note>"
-
-            # counter for loop that makes <rdg> tags. Starts at 7 because readings start in column 7 of the CSV.
-            i = 7
-            rdgTags = ''
-
-            # this loop can handle any number of readings
-            while (i < (l - 1)):
-                rdgTags += make_rdg_tag(bNum, vNum, row[i], row[i + 1], row[i + 2], row[i + 3])
-                # each reading has four columns of data
-                i += 4
-
-            # combine everything into one <app> tag
-            # remove angle brackets from inside the comment because they are not allowed
-            entries = '\n<!-- App entry for ' + str(row[0]) + '.' + str(row[1]) + ': ' + searchLem + ' -->' + \
-                      '<app>' + lemtag + rdgTags + commenttag + '</app>\n'
-
-            # clean up the <app> tag
-            new_entries = cleanup_tag(entries)
-
             # we're going to check that the newly created tag is valid XML
             # if it is valid, we will insert it into the text
             # if not, we will not insert it and will print an error message
             # the goal of this measure is to prevent XMLParseErrors and XMLSyntaxErrors
             # we want to guarantee that the output of this script is always a valid XML file.
             # this will minimize runtime exceptions and errors.
-            if not checkXML(new_entries):
+            fragment = batch.check(new_entries)
+            lap('check')
+            if fragment is None:
                 #  i.e. if invalid XML was generated
-                print("**** invalid XML was generated for section " + bNum + "." + vNum + ", lemma: " + searchLem)
-                print(new_entries)
-                print("it was left unencoded for now.")
+                progress.problem("invalid XML was generated for section " + bNum + "." + vNum + ", lemma: " + searchLem
+                                 + "; it was left unencoded for now.", new_entries)
                 invalid_tags += 1
 
                 logmsg = " invalid XML was generated for section " + bNum + "." + vNum + ", lemma: " + searchLem + "\n"
-                logger.error(logmsg.encode(encoding='utf-8'))
+                report(logger, "invalid-app", logmsg, (bNum, vNum), searchLem, new_entries)
                 continue
 
-            print("Now encoding note for section " + bNum + "." + vNum)
-
-            print("Using XPath to find the section!....")
-            # use Xpath to find the appropriate paragraph and section
-            xpathstr = ".//tei:div[@n='" + str(vNum) + "'][@subtype=\"verse\"]"
-            section = root.find(xpathstr,
-                                namespaces={'tei': 'http://www.tei-c.org/ns/1.0'})  # check this
-
+            # find the appropriate verse
+            section = verse_index.find(vNum)
+            lap('cite')
+            if section is None:
+                # the base text has no such verse, so there is nowhere to put the <app> tag
+                progress.problem("verse " + bNum + "." + vNum + " was not found in the base text", searchLem)
+                logmsg = " verse not found in the base text: " + bNum + "." + vNum + ", lemma: " + searchLem + "\n"
+                report(logger, "not-in-base-text", logmsg, (bNum, vNum), searchLem)
+                not_found += 1
+                continue
 
-            print("Replacing lemma instances with the proper <app> tag...")
             if re.search("\([0-9]+\)", searchLem):
                 # this lemma does not apply to the first instance of the lemma text. of the form "lemma(#)"
 
@@ -1280,6 +778,7 @@ def main():
             # exclude lemma instances within other words. uses negative lookahead and lookbehind assertion.
             # this will throw an exception (caught below) if the lemma is not found
             replacePattern = "(?<![a-zA-Z])" + searchLem + "(?![a-zA-Z])"
+            lap('number')
 
             # store count of lem instances found
             foundCount = 0
@@ -1290,54 +789,108 @@ def main():
 
             # start iterating over <seg>s to find lemma instances
             segtags = section.findall(".//tei:seg", namespaces={'tei': 'http://www.tei-c.org/ns/1.0'})
-            while foundCount < lemNum and index < len(segtags) - 1:
-                prevFound = foundCount
-                index = index + 1
-                # make matching case-insensitive
-                matches = re.findall(replacePattern, "".join(segtags[index].itertext()), flags=re.IGNORECASE)
-                #print(matches)
-                for f in matches:
-                    foundCount = foundCount + 1
-
-            text = "".join(segtags[index].itertext())
-            #print("HERE IS THE TEXT WE ARE SEARCHING: " + text)
-            # insert the <app> tag into the text using a custom function defined above
+            # the lemma goes into the pattern unescaped, so the search runs within the budget of the row
             try:
-                newtext = replace_with_xml(text, replacePattern, new_entries, (lemNum - prevFound - 1))
+                with watchdog.row('locate', (bNum, vNum, searchLem), replacePattern):
+                    while foundCount < lemNum and index < len(segtags) - 1:
+                        prevFound = foundCount
+                        index = index + 1
+                        # make matching case-insensitive
+                        matches = re.findall(replacePattern, "".join(segtags[index].itertext()), flags=re.IGNORECASE)
+                        #print(matches)
+                        for f in matches:
+                            foundCount = foundCount + 1
+            except RowTimeout:
+                continue
+            lap('segs')
 
-            except:
-                # usually due to text/csv matching issue, meaning the script was unable to find the lemma in the base text
-                print("**** problem with finding lemma in section " + bNum + "." + vNum)
-                print("this is probably due to a text/csv mismatch")
+            if index < 0:
+                # the verse has no <seg> to put the <app> tag in
+                progress.problem("problem with finding lemma in section " + bNum + "." + vNum
+                                 + "; this is probably due to a text/csv mismatch", searchLem)
                 logmsg = " problem finding lemma for section " + bNum + "." + vNum + ", lemma: " + searchLem + "\n"
-                logger.error(logmsg.encode(encoding='utf-8'))
-                prevDiv = row[1]
+                report(logger, "lemma-not-found", logmsg, (bNum, vNum), searchLem)
                 not_found += 1
                 continue
 
-            # if we got here, replacement was successful
-            successful_rows += 1
+            # queue the <app> tag for this <seg>. The lemma is found, and the <seg> text rebuilt,
+            # once every row has been read (see below).
+            batch.add(segtags[index], replacePattern, lemNum - prevFound - 1, new_entries, (bNum, vNum, searchLem), fragment)
+            lap('queue')
 
     # we're done with the csv file now
     appFile.close()
-    logger.info("Finished encoding app. crit.")
-    # this is a workaround to deal with automatic escaping of < and >, and to clean up smart quotes
-    bigstr = ET.tostring(root, encoding="unicode").replace("&gt;", ">").replace("&lt;", "<").replace("”","\"")
 
-    print("Writing to a .xml file....")
-    logger.info(" Finishing up the XML.")
-    time.sleep(2)
+    # find every lemma against the original <seg> text and splice each <seg> once
+    progress.stage('Replacing lemma instances with the proper <app> tags', 'insert apps')
+    insertions = batch.apply()
+    for insertion in insertions:
+        bNum, vNum, searchLem = insertion.context
+        if insertion.status == INSERTED:
+            # if we got here, replacement was successful
+            successful_rows += 1
+        elif insertion.status == INVALID:
+            # with section validation, invalid app tags are only found when the <seg> is parsed
+            progress.problem("invalid XML was generated for section " + bNum + "." + vNum + ", lemma: " + searchLem
+                             + "; it was left unencoded for now.", insertion.entry)
+            invalid_tags += 1
+            logmsg = " invalid XML was generated for section " + bNum + "." + vNum + ", lemma: " + searchLem + "\n"
+            report(logger, "invalid-app", logmsg, (bNum, vNum), searchLem, insertion.entry)
+        elif insertion.status == TIMED_OUT:
+            # the watchdog has already reported the row and quarantined it
+            pass
+        elif insertion.status == BAD_LEMMA:
+            # the lemma goes into its pattern unescaped, so a lemma like 'a(b' can't be searched for at all
+            progress.problem("the lemma of section " + bNum + "." + vNum + " is not a valid regular expression ("
+                             + insertion.reason + "); it was left unencoded for now.", searchLem)
+
+            logmsg = " lemma is not a valid regular expression in section " + bNum + "." + vNum + ", lemma: " + searchLem + ": " + insertion.reason + "\n"
+            report(logger, "bad-lemma", logmsg, (bNum, vNum), searchLem, reason=insertion.reason)
+            not_found += 1
+        elif insertion.status == OVERLAP:
+            # the lemma overlaps a lemma that an earlier row of this <seg> already replaced,
+            # or cuts through markup that is already in the text
+            progress.problem("lemma overlaps an earlier entry or other markup in section " + bNum + "." + vNum
+                             + "; it was left unencoded for now.", searchLem)
+            logmsg = " lemma overlaps an earlier entry or other markup in section " + bNum + "." + vNum + ", lemma: " + searchLem + "\n"
+            report(logger, "overlap", logmsg, (bNum, vNum), searchLem)
+            not_found += 1
+        else:
+            # usually due to text/csv matching issue, meaning the script was unable to find the lemma in the base text
+            progress.problem("problem with finding lemma in section " + bNum + "." + vNum
+                             + "; this is probably due to a text/csv mismatch", searchLem)
+            logmsg = " problem finding lemma for section " + bNum + "." + vNum + ", lemma: " + searchLem + "\n"
+            report(logger, "lemma-not-found", logmsg, (bNum, vNum), searchLem)
+            not_found += 1
+
+    if options.validate:
+        # validate the sections that received <app> tags against the schema, and report errors per citation
+        progress.stage('Validating the changed sections against the schema', 'schema')
+        sections = {}
+        for insertion in insertions:
+            if insertion.status == INSERTED:
+                bNum, vNum, searchLem = insertion.context
+                sections.setdefault(insertion.section, "section " + bNum + "." + vNum)
+        try:
+            errors = SchemaValidator.load(options.schema, options.schema_cache).validate(tree, sections)
+        except SchemaUnavailable as error:
+            errors = [(None, "the schema is not available, so nothing was validated: " + str(error))]
+        for citation, message in errors:
+            progress.problem("schema error in " + (citation or "the rest of the text"), message)
+
+            logmsg = " schema error in " + (citation or "the rest of the text") + ": " + message + "\n"
+            report(logger, "schema", logmsg, (citation,) if citation else (), reason=message)
 
-    open("../kaster/str-output.txt", 'w', encoding='utf-8').write(bigstr)
+    logger.info("Finished encoding app. crit.")
+    # write the slowest rows and lemma patterns of the run to the log
+    watchdog.log_report()
 
-    # parse the newly cleaned up XML
-    newRoot = ET.fromstring(bigstr)
+    progress.stage('Writing to a .xml file', 'write')
+    logger.info(" Finishing up the XML.")
 
-    tree._setroot(newRoot)
-    # write the new XML to the appropriate file
-    tree.write("../kaster/test-output.xml", encoding='utf-8', xml_declaration=True)
+    # write the finished tree to the appropriate file
+    write_tree(tree, new_path)
 
-    print("Valid XML coming your way!")
     logger.info(" Valid XML generated, encoding is complete.")
 
     """
@@ -1349,15 +902,23 @@ def main():
     print("Two matches:", count_2_match)
     if count_lookups > 0: print("hit rate:", count_match/count_lookups)
     """
-    # print some quality metrics
-    print("Here are some quality metrics for overall execution: ")
-    print("total CSV rows processed:", rows_processed)
-    print("Rows processed successfully:", successful_rows)
-    print("Syntactically invalid app tags generated:", invalid_tags)
-    print("lemmas not found:", not_found)
-    if rows_processed > 0: print("Success rate:", successful_rows/rows_processed)
-    # automatically open the finished XML file.
-    os.system("open ../kaster/test-output.xml")
+    # report some quality metrics
+    metrics = {"rows": rows_processed, "successful": successful_rows, "invalid": invalid_tags,
+               "not found": not_found, "quarantined": len(watchdog.quarantined)}
+    summary = dict(metrics)
+    if rows_processed > 0: summary["success rate"] = successful_rows/rows_processed
+    summary["fragment cache"] = ENTRIES.fragments.summary()
+    progress.summary(summary)
+    # wait until the whole log has been written, so that it is complete when main() returns (e.g. to batch_encoding.py)
+    close_log()
+
+    # automatically open the finished XML file, unless --no-open was given (e.g. by batch_encoding.py)
+    if not options.no_open:
+        os.system("open " + OUTPUT)
+
+    # the quality metrics, for batch_encoding.py
+    return metrics
 
 if __name__ == '__main__':
-    main()
+    # with --watch, encode the text again whenever the base text or the apparatus is saved
+    run_encoder(main, (BASE_TEXT, APPARATUS))
@@ -0,0 +1,73 @@
+import re  # operations for regular expressions, i.e. very powerful text matching
+import functools  # memoizes parsed lists of sigla
+
+# upper and lowercase Greek letters, which are used as sigla along with Latin letters
+GREEK = '\u0391-\u03A9\u03B1-\u03C9'
+
+# The grammar of a siglum. A siglum is one token of a space-separated list of witnesses or sources.
+# An annotated siglum starts with one letter followed by its annotation in parentheses, e.g. A(ac) or Γ(spl).
+# Anything else is a plain siglum, e.g. A, ρh1 or Mommsen.
+ANNOTATED = re.compile('([A-Za-z' + GREEK + r'])\((ac|c|pc|spl|sbl|inmg|ir)\)')
+
+# the end of the <witDetail> tag for each annotation.
+# c and pc both mean correction-altered to maintain backwards compatibility as much as possible.
+# only pc is correct. our guidelines and specs reflect this.
+WIT_DETAILS = {
+    'ac': '" type="correction-original"/>',
+    'c': '" type="correction-altered"/>',
+    'pc': '" type="correction-altered"/>',
+    'spl': '">supra lineam</witDetail>',
+    'sbl': '">sub lineam</witDetail>',
+    'inmg': '">in margin</witDetail>',
+    'ir': '">in rasura</witDetail>',
+}
+
+# the spreadsheet markup of each annotation. c and pc are removed together.
+MARKUP = {'c': ('(c)', '(pc)'), 'pc': ('(c)', '(pc)')}
+
+
+class Siglum():
+    """one parsed siglum"""
+
+    def __init__(self, token):
+        """
+        :param token: the siglum as it is written in the spreadsheet, e.g. A(ac)
+        """
+        self.token = token
+        match = ANNOTATED.match(token)
+        if match:
+            # the letter of the witness, e.g. A, and its annotation, e.g. ac
+            self.letter, self.annotation = match.groups()
+            # the siglum without its spreadsheet markup
+            self.bare = token
+            for markup in MARKUP.get(self.annotation, ('(' + self.annotation + ')',)):
+                self.bare = self.bare.replace(markup, '')
+        else:
+            self.letter = None
+            self.annotation = None
+            self.bare = token
+
+    def latin_lowercase(self):
+        """
+        :return: True if the letter of an annotated siglum is a lowercase Latin letter
+        """
+        return self.letter is not None and 'a' <= self.letter <= 'z'
+
+    def detail(self, wit, target):
+        """
+        :param wit: the siglum to name in the tag
+        :param target: the xml:id of the lemma or reading
+        :return: the <witDetail> tag for this siglum's annotation
+        """
+        return '<witDetail wit="#' + wit + '" target="#' + target + WIT_DETAILS[self.annotation]
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_sigla(text):
+    """parses a list of witnesses or sources. Each siglum is matched once against the compiled grammar, and
+    the result is memoized, because the same lists (e.g. "F Γ" or "U S T V") come back throughout an edition.
+
+    :param text: sigla as one string, separated by spaces (e.g. "A B C(ac) D")
+    :return: a tuple with a Siglum for each siglum, in order
+    """
+    return tuple(Siglum(token) for token in text.strip().split(' '))
@@ -0,0 +1,468 @@
+import os  # 'operating system' - used for the paths of the generated files
+import sys  # command line arguments
+import csv  # writes the apparatus and the manifest
+import math  # rounds the number of sections up
+import random  # the generated text is random, but the same for the same --seed
+import argparse  # reads the flags of the generator
+
+# this script writes synthetic editions of any size, a base text and an apparatus CSV in the format of each
+# encoder, so that the encoders can be timed on much larger inputs than the sample editions (see benchmark.py).
+# Usage: python synthetic_corpus.py [--genre GENRE ...] [--rows N ...] [--density D] [--readings R]
+#                                   [--repeats F] [--markup F] [--seed S] directory
+#
+# For every genre and every --rows it writes e.g. directory/prose-10000.txt and directory/prose-10000.csv, and
+# it lists them in directory/manifest.csv, which batch_encoding.py and benchmark.py --manifest read.
+#   --density   the number of apparatus rows per sentence, line or comment (default 0.5)
+#   --readings  the average number of readings of each row (default 2)
+#   --repeats   the share of lemmas that are a later instance of a word, e.g. 'arma(2)' (default 0.05)
+#   --markup    the share of sentences and lines with editorial markup, e.g. †crux† (default 0.1)
+# The text is made of invented Latin-like words, so every lemma of the apparatus is in the base text exactly
+# where its row says it is, and a good run of an encoder finds all of them.
+
+# the genres, in the order they are written by default
+GENRES = ('prose', 'poetry', 'drama', 'mixed matter', 'servius')
+
+# the most readings each genre has columns for
+READINGS = {'prose': 7, 'poetry': 15, 'drama': 15, 'mixed matter': 4, 'servius': 4}
+
+# the words of the text are made of these syllables
+SYLLABLES = ('a', 'ae', 'am', 'an', 'ar', 'bi', 'ca', 'ce', 'cu', 'de', 'di', 'do', 'e', 'fa', 'fe', 'gi', 'i',
+             'in', 'la', 'le', 'li', 'lu', 'ma', 'me', 'mi', 'mo', 'na', 'ne', 'ni', 'no', 'o', 'pa', 'pe', 'po', 'qua',
+             'que', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'si', 'ta', 'te', 'ti', 'to', 'tu', 'u', 've', 'vi')
+ENDINGS = ('a', 'ae', 'am', 'as', 'at', 'em', 'es', 'et', 'i', 'is', 'it', 'o', 'os', 'um', 'unt', 'us')
+# the editorial markup: <addition>, †crux†, [deletion] and the *** of a lacuna, which replaces a word
+MARKUP = ('<%s>', '†%s†', '[%s]', '***%.0s')
+# the speakers of poetry and drama
+SPEAKERS = ('Corydon', 'Meliboeus', 'Simo', 'Sosia', 'Davus', 'Pamphilus', 'Mysis', 'Chremes')
+# the witnesses and the sources of the readings
+WITNESSES = ('M', 'U', 'S', 'T', 'V', 'N', 'P', 'G', 'D')
+SOURCES = ('Nipperdey', 'Castiglioni', 'Gruter', 'Gertz', 'Mommsen', 'Fromond')
+# Servius' witnesses, in the bold and italic markdown of its CSV
+SERVIUS_WITNESSES = ('**F**', '**Γ**', '*W*', '*Ah2*', '*Pah2*', '*N*')
+
+# the column labels of each apparatus
+PROSE_LABELS = (['STBA', 'Paragraph', 'Section', 'Lemma', 'Lemma_Witnesses', 'Lemma_Sources', 'Lemma_Annotations']
+                + [label for n in range(1, 8) for label in ('Reading_%d' % n, 'Reading_%d_Witnesses' % n,
+                                                            'Reading_%d_Sources' % n, 'Reading_%d_Annotations' % n)]
+                + ['General_Comment', 'Omissions', 'Complications'])
+LEMMA_LABELS = ['Lemma', 'Lemma_Witnesses', 'Lemma_Sources', 'Lemma_Annotations', 'General_Comment']
+
+
+def reading_labels(count):
+    """
+    :param count: the number of readings
+    :return: the column labels of that many readings
+    """
+    return [label for n in range(1, count + 1) for label in ('Reading_%d' % n, 'Reading_%d_Witnesses' % n,
+                                                             'Reading_%d_Sources' % n, 'Reading_%d_Annotations' % n)]
+
+
+POETRY_LABELS = ['Poem', 'Line'] + LEMMA_LABELS + reading_labels(15)
+DRAMA_LABELS = ['Act', 'Scene', 'Line'] + LEMMA_LABELS + reading_labels(15)
+MIXED_MATTER_LABELS = ['Section', 'Paragraph', 'Sentence', 'Poem', 'Line'] + LEMMA_LABELS + reading_labels(4)
+SERVIUS_LABELS = (['Book', 'Verse', 'Lemma', 'Witness', 'Source', 'Ed. Comment', 'Gen. Comment']
+                  + [label for name in ('Second R.', 'Third R.', 'Fourth R.', 'Fifth R.')
+                     for label in (name, 'Witness', 'Source', 'Comment')])
+
+
+class Writer():
+    """writes the sentences, lines and apparatus rows of one synthetic edition"""
+
+    def __init__(self, genre, options):
+        """
+        :param genre: one of GENRES
+        :param options: the flags of the generator
+        """
+        self.genre = genre
+        self.options = options
+        # the same seed gives the same edition, whatever else was generated before it
+        self.random = random.Random('%s-%s' % (options.seed, genre))
+        self.vocabulary = self.__vocabulary(2000)
+
+    def __vocabulary(self, size):
+        """
+        :param size: the number of words
+        :return: a list of distinct invented words of at least four letters
+        """
+        words = set()
+        while len(words) < size:
+            word = ''.join(self.random.choice(SYLLABLES) for i in range(self.random.randint(1, 3)))
+            word += self.random.choice(ENDINGS)
+            if len(word) >= 4:
+                words.add(word)
+        return sorted(words)
+
+    def count(self, average):
+        """
+        :param average: the average of the count
+        :return: a random whole number with that average, e.g. 0 or 1 for 0.5
+        """
+        return int(average) + (1 if self.random.random() < average - int(average) else 0)
+
+    def words(self, length):
+        """a sentence or a line: a list of words, some of them in editorial markup, and some repeated so that
+        lemmas like 'word(2)' can be made
+
+        :param length: the number of words
+        :return: the list of words
+        """
+        words = [self.random.choice(self.vocabulary) for i in range(length)]
+        if length > 3 and self.random.random() < self.options.repeats * 4:
+            # a word that occurs twice; --repeats is the share of lemmas, and about one in four of the lemmas of
+            # a sentence with a repeated word is its second instance
+            i = self.random.randrange(length // 2)
+            words[self.random.randrange(length // 2 + 1, length)] = words[i]
+        if self.random.random() < self.options.markup:
+            i = self.random.randrange(length)
+            # a line of verse with *** is a lacuna, so only prose has them
+            kinds = MARKUP if self.genre in ('prose', 'servius') else MARKUP[:3]
+            # a new word, so that no lemma is also found inside the markup
+            words[i] = self.random.choice(kinds) % self.random.choice(self.vocabulary)
+        return words
+
+    def lemmas(self, words, capitalized=False):
+        """chooses the lemmas of a sentence or a line
+
+        :param words: the words of the sentence or the line
+        :param capitalized: whether the first word will be capitalized in the text
+        :return: a list of lemmas, in the order of the text, e.g. ['arma virum', 'cano(2)']
+        """
+        plain = [word if word.isalpha() else None for word in words]
+        marked = set(word.strip('<>†[]') for word in words if not word.isalpha())
+        lemmas = []
+        used = -1
+        for i in range(self.count(self.options.density)):
+            # a lemma of one to three words after the previous one
+            start = self.random.randrange(used + 1, len(words)) if used + 1 < len(words) else None
+            if start is None:
+                break
+            length = self.random.choice((1, 1, 1, 2, 3))
+            span = plain[start:start + length]
+            if None in span or (capitalized and start == 0) or set(span) & marked:
+                continue
+            lemma = ' '.join(span)
+            # the instance of the lemma in the sentence or the line
+            n = 1 + sum(1 for j in range(start) if plain[j:j + len(span)] == span)
+            if n > 1:
+                if length > 1 or self.genre == 'drama':
+                    # only a single word can be numbered, and drama_encoding.py reads 'word(2)' as a speaker
+                    continue
+                lemma += '(%d)' % n
+            elif (self.random.random() < self.options.repeats and plain.count(span[0]) == 1 and length == 1
+                  and self.genre != 'drama'):
+                # an explicit first instance, e.g. 'arma(1)'
+                lemma += '(1)'
+            lemmas.append(lemma)
+            used = start + length
+        return lemmas
+
+    def variant(self, lemma):
+        """
+        :param lemma: the lemma, without its instance number
+        :return: a reading of it: a misspelling, the words in another order, or another word
+        """
+        words = lemma.split(' ')
+        choice = self.random.random()
+        if len(words) > 1 and choice < 0.3:
+            return ' '.join(reversed(words))
+        if choice < 0.8:
+            word = self.random.randrange(len(words))
+            letters = list(words[word])
+            vowels = [j for j, letter in enumerate(letters) if letter in 'aeiou']
+            if vowels:
+                letters[self.random.choice(vowels)] = self.random.choice('aeiou')
+            words[word] = ''.join(letters) + ('' if letters != list(words[word]) else 'que')
+            return ' '.join(words)
+        return self.random.choice(self.vocabulary)
+
+    def entry(self, lemma):
+        """
+        :param lemma: the lemma, e.g. 'cano(2)'
+        :return: the columns of the lemma (lemma, witnesses, sources, annotations), the general comment and the
+            columns of the readings, four each
+        """
+        sigla = WITNESSES if self.genre != 'servius' else SERVIUS_WITNESSES
+        count = min(READINGS[self.genre], max(1, self.count(self.options.readings)))
+        lem = [lemma, ' '.join(self.random.sample(sigla, self.random.randint(0, 2))), '', '']
+        readings = []
+        # the xml:id of each reading is made of its text, so no two readings are the same
+        texts = {lemma.split('(')[0]}
+        for i in range(count):
+            reading = self.variant(lemma.split('(')[0])
+            if reading in texts:
+                continue
+            texts.add(reading)
+            annotation = ''
+            if self.random.random() < 0.1:
+                annotation = '(cf. %s %d.%d)' % (self.random.choice(SOURCES), self.random.randint(1, 9),
+                                                 self.random.randint(1, 99))
+            readings.append([reading, ' '.join(self.random.sample(sigla, 1)),
+                             self.random.choice(SOURCES) if self.random.random() < 0.3 else '', annotation])
+        comment = 'the reading is uncertain' if self.random.random() < 0.05 else ''
+        return lem, comment, readings
+
+    def sentence(self, number=None):
+        """
+        :param number: the (n) of the sentence in its paragraph, or None for a sentence without one
+        :return: the words of the sentence, its lemmas and its text
+        """
+        words = self.words(self.random.randint(8, 20))
+        lemmas = self.lemmas(words, capitalized=True)
+        text = ' '.join(words)
+        text = text[0].upper() + text[1:] + '.'
+        return lemmas, text if number is None else '(%d) %s' % (number, text)
+
+    def line(self, speaker=False):
+        """
+        :param speaker: whether the line starts with a (Speaker)
+        :return: the lemmas of a line of verse and its text
+        """
+        words = self.words(self.random.randint(5, 9))
+        lemmas = self.lemmas(words)
+        text = ' '.join(words)
+        if speaker:
+            text = '(%s) %s' % (self.random.choice(SPEAKERS), text)
+        return lemmas, text
+
+
+def rows_of(writer, citation, lemmas, columns):
+    """
+    :param writer: the Writer
+    :param citation: the citation columns of the rows, e.g. ['', '12', '3']
+    :param lemmas: the lemmas of the sentence or the line
+    :param columns: how the lemma, the general comment and the readings are laid out, see the genre functions
+    :return: the apparatus rows of the lemmas
+    """
+    return [columns(citation, *writer.entry(lemma)) for lemma in lemmas]
+
+
+def flat(readings, count):
+    """
+    :param readings: the readings, four columns each
+    :param count: the number of readings the apparatus has columns for
+    :return: the columns of the readings, padded with empty ones
+    """
+    return [cell for reading in readings for cell in reading] + [''] * (4 * (count - len(readings)))
+
+
+def prose(writer, rows):
+    """
+    :param writer: the Writer
+    :param rows: about how many apparatus rows to write
+    :return: the base text and the apparatus rows
+    """
+    sentences = 6  # per paragraph
+    paragraphs = max(1, math.ceil(rows / writer.options.density / sentences))
+    columns = lambda citation, lem, comment, readings: citation + lem + flat(readings, 7) + [comment, '', '']
+    text = []
+    apparatus = [PROSE_LABELS]
+    for p in range(1, paragraphs + 1):
+        paragraph = []
+        for s in range(1, sentences + 1):
+            lemmas, sentence = writer.sentence(s)
+            paragraph.append(sentence)
+            apparatus += rows_of(writer, ['', str(p), str(s)], lemmas, columns)
+        text.append('%d %s' % (p, ' '.join(paragraph)))
+    return '\n\n'.join(text) + '\n', apparatus
+
+
+def poem(writer, lines, first=None):
+    """
+    :param writer: the Writer
+    :param lines: the number of lines
+    :param first: what the first line starts with, e.g. the number of the poem
+    :return: the text of the poem, in stanzas, and the lemmas of each line
+    """
+    text = []
+    lemmas = []
+    stanza = 0
+    for i in range(lines):
+        if stanza == 0 and i > 0:
+            # a blank line between stanzas
+            text.append('')
+        lineLemmas, line = writer.line(speaker=stanza == 0 and writer.genre == 'poetry' and writer.random.random() < 0.5)
+        if i == 0 and first is not None:
+            line = first + ' ' + line
+        text.append(line)
+        lemmas.append(lineLemmas)
+        stanza = (stanza + 1) % 4
+    return '\n'.join(text), lemmas
+
+
+def poetry(writer, rows):
+    """
+    :param writer: the Writer
+    :param rows: about how many apparatus rows to write
+    :return: the base text and the apparatus rows
+    """
+    lines = 40  # per poem
+    poems = max(1, math.ceil(rows / writer.options.density / lines))
+    columns = lambda citation, lem, comment, readings: citation + lem + [comment] + flat(readings, 15)
+    text = []
+    apparatus = [POETRY_LABELS]
+    for p in range(1, poems + 1):
+        verse, lemmas = poem(writer, lines, first=str(p))
+        text.append(verse)
+        for l, lineLemmas in enumerate(lemmas, 1):
+            apparatus += rows_of(writer, [str(p), str(l)], lineLemmas, columns)
+    return '\n\n'.join(text) + '\n', apparatus
+
+
+def drama(writer, rows):
+    """
+    :param writer: the Writer
+    :param rows: about how many apparatus rows to write
+    :return: the base text and the apparatus rows
+    """
+    # drama_encoding.py reads 'ACT 10' as 'ACT 1' and 'SCENE 10' as 'SCENE 1', so a play has at most nine acts of
+    # at most nine scenes, and larger plays have longer scenes
+    lines = max(1, math.ceil(rows / writer.options.density))
+    scenes = math.ceil(lines / 60)
+    acts = min(9, math.ceil(scenes / 5))
+    scenesPerAct = min(9, math.ceil(scenes / acts))
+    linesPerScene = math.ceil(lines / (acts * scenesPerAct))
+    columns = lambda citation, lem, comment, readings: citation + lem + [comment] + flat(readings, 15)
+    text = []
+    apparatus = [DRAMA_LABELS]
+    # drama_encoding.py numbers the lines and, after the first scene of each act, the scenes through the play
+    lineCount = 0
+    sceneCount = 0
+    for a in range(1, acts + 1):
+        text.append('ACT %d\n' % a)
+        for s in range(1, scenesPerAct + 1):
+            sceneCount += 1
+            text.append('SCENE %d' % s)
+            scene = 1 if s == 1 else sceneCount
+            for l in range(linesPerScene):
+                lineCount += 1
+                lineLemmas, line = writer.line()
+                # a speaker at the start of the scene, and now and then at the start of a line
+                if l == 0 or writer.random.random() < 0.2:
+                    line = '(%s) %s' % (writer.random.choice(SPEAKERS), line)
+                text.append(line)
+                apparatus += rows_of(writer, [str(a), str(scene), str(lineCount)], lineLemmas, columns)
+            text.append('')
+    return '\n'.join(text), apparatus
+
+
+def mixed_matter(writer, rows):
+    """
+    :param writer: the Writer
+    :param rows: about how many apparatus rows to write
+    :return: the base text and the apparatus rows
+    """
+    # each section is a paragraph, a poem and another paragraph
+    sentences = 5
+    lines = 8
+    sections = max(1, math.ceil(rows / writer.options.density / (2 * sentences + lines)))
+    columns = lambda citation, lem, comment, readings: citation + lem + [comment] + flat(readings, 4)
+    chunks = []
+    apparatus = [MIXED_MATTER_LABELS]
+    # mixed_matter_encoding.py numbers the paragraphs and the poems through the text
+    paragraphCount = 0
+    poemCount = 0
+    for section in range(1, sections + 1):
+        for chunk in ('prose', 'poetry', 'prose'):
+            if chunk == 'prose':
+                paragraphCount += 1
+                paragraph = []
+                for s in range(1, sentences + 1):
+                    lemmas, sentence = writer.sentence(s)
+                    paragraph.append(sentence)
+                    apparatus += rows_of(writer, [str(section), str(paragraphCount), str(s), '', ''], lemmas, columns)
+                # the section number starts the first paragraph of the section
+                chunks.append(('%d ' % section if paragraphCount % 2 == 1 else '') + ' '.join(paragraph))
+            else:
+                poemCount += 1
+                verse, lemmas = poem(writer, lines)
+                # a poem is one chunk, without blank lines
+                chunks.append('POEM\n' + verse.replace('\n\n', '\n'))
+                for l, lineLemmas in enumerate(lemmas, 1):
+                    apparatus += rows_of(writer, [str(section), '', '', str(poemCount), str(l)], lineLemmas, columns)
+    return '\n\n'.join(chunks) + '\n', apparatus
+
+
+def servius(writer, rows):
+    """
+    :param writer: the Writer
+    :param rows: about how many apparatus rows to write
+    :return: the base text, as in kaster/bk9.txt, and the apparatus rows, as in kaster/excel_as_word_gfm.csv
+    """
+    sentences = 3  # of commentary on each verse
+    verses = max(1, math.ceil(rows / writer.options.density / sentences))
+    columns = lambda citation, lem, comment, readings: citation + lem + [comment] + flat(readings, 4)
+    text = []
+    apparatus = [SERVIUS_LABELS]
+    for verse in range(1, verses + 1):
+        # the lemma of Vergil, in capitals, and the commentary on it, of which some is in an | anonymous block |
+        vergil = ' '.join(writer.random.sample(writer.vocabulary, writer.random.randint(1, 3))).upper()
+        commentary = []
+        for s in range(sentences):
+            lemmas, sentence = writer.sentence()
+            sentence = sentence[0].lower() + sentence[1:]
+            commentary.append('| %s |' % sentence if writer.random.random() < 0.2 else sentence)
+            apparatus += rows_of(writer, ['9', str(verse)], lemmas, columns)
+        text.append('%d. %s %s' % (verse, vergil, '\n\n'.join(commentary)))
+    return '\n\n'.join(text) + '\n', apparatus
+
+
+# the function that writes each genre
+GENERATORS = {'prose': prose, 'poetry': poetry, 'drama': drama, 'mixed matter': mixed_matter, 'servius': servius}
+
+
+def generate(genre, rows, directory, options):
+    """writes one synthetic edition
+
+    :param genre: one of GENRES
+    :param rows: about how many apparatus rows to write
+    :param directory: where to write the base text and the apparatus
+    :param options: the flags of the generator
+    :return: the base text, the apparatus and the number of rows written
+    """
+    text, apparatus = GENERATORS[genre](Writer(genre, options), rows)
+    name = os.path.join(directory, '%s-%d' % (genre.replace(' ', '-'), rows))
+    with open(name + '.txt', 'w', encoding='utf-8') as baseText:
+        baseText.write(text)
+    with open(name + '.csv', 'w', encoding='utf-8', newline='') as appCrit:
+        csv.writer(appCrit, lineterminator='\n').writerows(apparatus)
+    return name + '.txt', name + '.csv', len(apparatus) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='writes synthetic editions of any size for benchmarks')
+    parser.add_argument('directory', help='where to write the editions and manifest.csv')
+    parser.add_argument('--genre', action='append', choices=GENRES,
+                        help='a genre to write; may be given more than once (default: all of them)')
+    parser.add_argument('--rows', type=int, action='append',
+                        help='about how many apparatus rows each edition has; may be given more than once for '
+                             'editions of several sizes (default: 1000)')
+    parser.add_argument('--density', type=float, default=0.5,
+                        help='apparatus rows per sentence, line or comment (default: 0.5)')
+    parser.add_argument('--readings', type=float, default=2, help='readings per row (default: 2)')
+    parser.add_argument('--repeats', type=float, default=0.05,
+                        help="the share of lemmas with an instance number, e.g. 'arma(2)' (default: 0.05)")
+    parser.add_argument('--markup', type=float, default=0.1,
+                        help='the share of sentences and lines with editorial markup (default: 0.1)')
+    parser.add_argument('--seed', default='1', help='the same seed writes the same editions (default: 1)')
+    options = parser.parse_args(sys.argv[1:])
+    if options.density <= 0:
+        parser.error('--density must be more than 0')
+
+    os.makedirs(options.directory, exist_ok=True)
+    manifest = [['Genre', 'Base text', 'Apparatus', 'Output', 'Log']]
+    for genre in options.genre or GENRES:
+        for rows in options.rows or [1000]:
+            baseText, appCrit, written = generate(genre, rows, options.directory, options)
+            print("Wrote", os.path.basename(baseText), "and", os.path.basename(appCrit), "with", written, "rows")
+            if genre != 'servius':
+                # Servius reads its own hard-coded files, so it can't be run from a manifest
+                name = os.path.splitext(os.path.basename(baseText))[0]
+                manifest.append([genre, os.path.basename(baseText), os.path.basename(appCrit),
+                                 os.path.join('output', name + '.xml'), ''])
+    with open(os.path.join(options.directory, 'manifest.csv'), 'w', encoding='utf-8', newline='') as out:
+        csv.writer(out, lineterminator='\n').writerows(manifest)
+    print("The editions are listed in", os.path.join(options.directory, 'manifest.csv'))
+
+
+if __name__ == '__main__':
+    main()
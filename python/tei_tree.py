@@ -0,0 +1,222 @@
+import lxml.etree as ET  # used to build the XML tree of the encoded text
+import bisect  # finds the text slot that an offset in a flattened section falls in
+from profiling import span  # times serializing and writing the tree, with --profile
+
+
+def build_tree(tei, parser=None):
+    """builds the lxml tree for an encoded base text directly from the string, without a round trip through a file.
+
+    The encoders used to write the header, text and footer to the output file and immediately parse that file
+    again. Parsing the string in memory gives the same tree and leaves the output file to the final write.
+
+    :param tei: the whole encoded document (header + base text + footer) as a str
+    :param parser: the lxml parser to use. Defaults to a parser that keeps comments.
+    :return: an lxml ElementTree. Processing instructions before the root element (e.g. <?xml-model?>) are kept.
+    """
+
+    if parser is None:
+        # custom LXML parser that won't remove comments
+        parser = ET.XMLParser(remove_comments=False)
+
+    # lxml refuses str input that carries an encoding declaration (drama_encoding's header has one), so parse bytes
+    root = ET.fromstring(tei.encode('utf-8'), parser=parser)
+    return root.getroottree()
+
+
+def write_tree(tree, path):
+    """writes the finished tree to the output file. This is the only time the encoded text touches the disk.
+
+    :param tree: the lxml ElementTree to write
+    :param path: the path of the output .xml file
+    """
+    with span('serialize'):
+        data = ET.tostring(tree, encoding='UTF-8', xml_declaration=True)
+    with span('disk'):
+        with open(path, 'wb') as out:
+            out.write(data)
+
+
+# namespaces of the names that can appear in a section's markup
+TEI_NS = 'http://www.tei-c.org/ns/1.0'
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+
+def parse_fragment(markup):
+    """parses a piece of TEI markup (e.g. an <app> tag and its comment) into nodes that can go into the tree
+
+    :param markup: the markup, as a str. It may start and end with text, e.g. a line break.
+    :return: a (text, nodes) tuple: the text before the first node, and the list of nodes. Each node keeps the
+        text that follows it as its tail.
+    """
+    # wrap the markup so that it has one root, in the TEI namespace like the rest of the document
+    wrapper = ET.fromstring('<wrapper xmlns="' + TEI_NS + '">' + markup + '</wrapper>')
+    return wrapper.text or '', list(wrapper)
+
+
+def start_tag(node):
+    """
+    :param node: an element
+    :return: the start tag of the element as it is written in the encoded text, e.g. <supplied reason="lost">
+    """
+    tag = '<' + ET.QName(node).localname
+    for name, value in node.attrib.items():
+        qname = ET.QName(name)
+        if qname.namespace == XML_NS:
+            # xml:id, xml:lang
+            name = 'xml:' + qname.localname
+        else:
+            name = qname.localname
+        tag += ' ' + name + '="' + value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;') + '"'
+    return tag + '>'
+
+
+class FlatText():
+    """the content of a section (a <seg>, <l> or verse <div>) flattened into one string, with a map back to the tree.
+
+    The string is the section's text with the markup of its children written out, e.g.
+    'conspectu <supplied reason="lost">suorum</supplied>', which is what the CSV lemmas are written to match.
+    Every piece of text in it is a text or tail slot of some node, so an offset in the string can be turned
+    into a (node, 'text' or 'tail', offset) point, and <app> tags can be inserted as real nodes at those points.
+    Offsets inside a tag or a comment have no point.
+    """
+
+    def __init__(self, section):
+        """
+        :param section: the element to flatten
+        """
+        self.__section = section
+        self.__pieces = []
+        # where each text/tail slot starts in the string, in document order, and the slot itself
+        self.__starts = []
+        self.__slots = []
+        self.__length = 0
+        # (start, end) of every tag and comment in the string, in order
+        self.markup = []
+        # (element, start, end) of every element below the section, from its start tag to its end tag
+        self.elements = []
+        self.__flatten(section)
+        self.text = ''.join(self.__pieces)
+
+    def __add(self, piece, slot=None):
+        """adds a piece of the string; slot is (node, 'text' or 'tail') if the piece is a text slot"""
+        if slot is not None:
+            self.__starts.append(self.__length)
+            self.__slots.append(slot)
+        else:
+            self.markup.append((self.__length, self.__length + len(piece)))
+        self.__pieces.append(piece)
+        self.__length += len(piece)
+
+    def __flatten(self, node):
+        """writes out the content of node, and the markup and content of its children"""
+        self.__add(node.text or '', (node, 'text'))
+        for child in node:
+            if not isinstance(child.tag, str):
+                # comments and processing instructions can't contain an <app>, so they are written out whole
+                self.__add(ET.tostring(child, encoding='unicode', with_tail=False))
+            elif len(child) == 0 and not child.text:
+                # empty element, e.g. <gap reason="lost"/>
+                start = self.__length
+                self.__add(start_tag(child)[:-1] + '/>')
+                self.elements.append((child, start, self.__length))
+            else:
+                start = self.__length
+                self.__add(start_tag(child))
+                self.__flatten(child)
+                self.__add('</' + ET.QName(child).localname + '>')
+                self.elements.append((child, start, self.__length))
+            self.__add(child.tail or '', (child, 'tail'))
+
+    def point(self, offset):
+        """
+        :param offset: an offset in the flattened string
+        :return: the (node, slot, offset) point for that offset, where slot is 'text' or 'tail'; or None if
+            the offset is inside a tag or a comment
+        """
+        i = bisect.bisect_right(self.__starts, offset) - 1
+        node, slot = self.__slots[i]
+        value = getattr(node, slot) or ''
+        if offset - self.__starts[i] > len(value):
+            return None
+        return node, slot, offset - self.__starts[i]
+
+    def splittable(self, start, end):
+        """
+        :param start: where a span of the flattened string starts
+        :param end: where it ends
+        :return: True if the span can be replaced with new nodes, i.e. both ends are in text and the span
+            doesn't open or close a tag without the other (both ends are in the same element)
+        """
+        first = self.point(start)
+        last = self.point(end)
+        if first is None or last is None:
+            return False
+        return container(first)[0] is container(last)[0]
+
+    def replace(self, start, end, markup, parsed=None):
+        """replaces a span of the flattened string with the nodes parsed from markup.
+
+        The tree changes, but the flattened string and its offsets don't, so spans must be replaced from
+        the last to the first.
+
+        :param start: where the span starts
+        :param end: where it ends
+        :param markup: the markup to put in its place
+        :param parsed: the (text, nodes) tuple already parsed from the markup, if any
+        """
+        first = self.point(start)
+        last = self.point(end)
+        parent, before = container(first)
+        after = parent.index(last[0]) + 1 if last[1] == 'tail' else 0
+
+        # the text that stays before and after the span
+        head = (getattr(first[0], first[1]) or '')[:first[2]]
+        rest = (getattr(last[0], last[1]) or '')[last[2]:]
+
+        text, nodes = parse_fragment(markup) if parsed is None else parsed
+        if not nodes:
+            # nothing but text
+            setattr(first[0], first[1], head + text + rest)
+            del parent[before:after]
+            return
+
+        # the text of the fragment goes after the text that stays; the text after the span goes after the last node
+        setattr(first[0], first[1], head + text)
+        nodes[-1].tail = (nodes[-1].tail or '') + rest
+        # every child the span covered is replaced
+        parent[before:after] = nodes
+
+
+def container(point):
+    """
+    :param point: a (node, slot, offset) point
+    :return: a (parent, index) tuple: the element that contains the point and the index of the first child after it
+    """
+    node, slot, offset = point
+    if slot == 'text':
+        return node, 0
+    parent = node.getparent()
+    return parent, parent.index(node) + 1
+
+
+def replace_node(node, markup):
+    """replaces one node, e.g. a speaker <label>, with the nodes parsed from markup. The node's tail stays.
+
+    :param node: the node to replace
+    :param markup: the markup to put in its place
+    """
+    parent = node.getparent()
+    text, nodes = parse_fragment(markup)
+    index = parent.index(node)
+    # the text of the fragment goes at the end of whatever comes before the node
+    if index == 0:
+        parent.text = (parent.text or '') + text
+    else:
+        parent[index - 1].tail = (parent[index - 1].tail or '') + text
+    if nodes:
+        nodes[-1].tail = (nodes[-1].tail or '') + (node.tail or '')
+    elif index == 0:
+        parent.text += node.tail or ''
+    else:
+        parent[index - 1].tail += node.tail or ''
+    parent[index:index + 1] = nodes
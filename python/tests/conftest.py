@@ -0,0 +1,5 @@
+import os  # 'operating system' - used for the path of the scripts
+import sys  # the import path
+
+# the scripts import each other as top-level modules, so the tests import them the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
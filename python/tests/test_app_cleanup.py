@@ -0,0 +1,21 @@
+import random  # the strings the clean up is checked on
+from app_cleanup import APP_TAG, cleanup_tag
+from cleanup_benchmark import one_by_one
+
+# pieces of <app> tags that the rules look for, put together at random
+PIECES = ['†', '<', '>', '*', '***', '[', ']', '-', 'a', 'b', ' ', '  ', '</lem>', '</rdg>', '(', ')', '?', '"',
+          '>om.</rdg>', '>None</rdg>', 'wit="None"', 'source="None"', '<!-- NO A ANNOTATION -->',
+          '<rdg xml:id="rdg-1.2-"></rdg>', '<rdg wit="None" source="None" xml:id="rdg-1.2-"><!-- A --></rdg>',
+          'xml:id="lem-1.2-']
+
+
+def test_crux_of_an_element_before_crux_of_an_attribute():
+    # the empty crux before </lem> is replaced first, as the old clean up did, so the †ab of the xml:id stays
+    assert cleanup_tag(' -†ab††</lem>') == ' -†ab"><sic></sic></lem>'
+
+
+def test_passes_are_the_rules_one_by_one():
+    rnd = random.Random(1)
+    for i in range(20000):
+        entries = ''.join(rnd.choice(PIECES) for piece in range(rnd.randint(1, 12)))
+        assert APP_TAG.rewrite(entries) == one_by_one(APP_TAG.rules, entries), entries
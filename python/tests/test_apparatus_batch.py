@@ -0,0 +1,25 @@
+import lxml.etree as ET  # the sections of the batch
+from apparatus_batch import ApparatusBatch, BAD_LEMMA
+
+
+def test_queued_ids_are_whole_ids_of_their_section():
+    first = ET.fromstring('<seg>ut mihi defendendi</seg>')
+    second = ET.fromstring('<seg>ut mihi</seg>')
+    batch = ApparatusBatch()
+    entry = '<app><lem xml:id="lem-7.2-ut-mihi-defendendi">ut mihi defendendi</lem>' \
+            '<rdg xml:id="rdg-7.2-ut-tibi">ut tibi</rdg></app>'
+    batch.add(first, 'ut mihi defendendi', 0, entry, fragment=batch.check(entry))
+    assert batch.queued_id(first, 'xml:id="lem-7.2-ut-mihi-defendendi"')
+    assert batch.queued_id(first, 'xml:id="rdg-7.2-ut-tibi"')
+    assert not batch.queued_id(first, 'xml:id="lem-7.2-ut-mihi"')
+    assert not batch.queued_id(second, 'xml:id="rdg-7.2-ut-tibi"')
+
+
+def test_a_lemma_that_is_not_a_regex_is_reported_as_a_bad_lemma():
+    section = ET.fromstring('<seg>a(b c</seg>')
+    batch = ApparatusBatch()
+    entry = '<app><lem>a(b</lem></app>'
+    batch.add(section, '(?<![a-zA-Z])a(b(?![a-zA-Z])', 0, entry, fragment=batch.check(entry))
+    insertion, = batch.apply()
+    assert insertion.status == BAD_LEMMA
+    assert 'missing )' in insertion.reason
@@ -0,0 +1,17 @@
+import logging  # the loggers the log is written from
+import diagnostics
+
+
+def test_the_log_only_has_the_records_of_the_encoder(tmp_path):
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    log_file = str(tmp_path / 'run.log')
+    for run in range(3):
+        logger = diagnostics.open_log(log_file, 'Prose')
+        logger.info(" run %d", run)
+        logging.getLogger('some.library').info("not the encoder's")
+        diagnostics.close_log()
+    assert root.handlers == handlers
+    assert logging.getLogger('Prose').handlers == []
+    with open(log_file, encoding='utf-8') as log:
+        assert log.read() == "INFO:Prose: run 2\n"
@@ -0,0 +1,71 @@
+import time  # times the markup pattern on a long text
+from lemma_locator import LemmaLocator, MARKUP, leading_word, literal, WORD_START, WORD_END, PROSE_WORD_START, PROSE_WORD_END
+
+
+def prose(lemma):
+    """:return: the pattern prose_encoding.py builds for the lemma"""
+    return PROSE_WORD_START + lemma + PROSE_WORD_END
+
+
+def verse(lemma):
+    """:return: the pattern the verse encoders build for the lemma"""
+    return WORD_START + lemma + WORD_END
+
+
+def test_prose_pattern_has_a_leading_word():
+    assert leading_word(prose('ut mihi')) == 'ut'
+    assert leading_word(verse('ut mihi')) == 'ut'
+    assert leading_word(prose('<sic>obiectis</sic>')) is None
+
+
+def test_prose_pattern_uses_the_word_index():
+    locator = LemmaLocator.from_markup('<seg>ut mihi defendendi, ut-mihi, #ut mihi et Ut mihi</seg>')
+    # a regex lemma, so that it isn't found by prepare()
+    spans = locator.matches(prose('ut mih.'))
+    assert locator.indexed == 1
+    assert locator.scanned == 0
+    # the instances after - and # are not lemmas in prose
+    assert [locator.text[start:end] for start, end in spans] == ['ut mihi', 'Ut mihi']
+
+
+def test_indexed_matches_are_the_matches_of_a_full_scan():
+    text = '<seg>Caesar, caesaris Caesar-que et caesar</seg>'
+    for pattern in (prose('caesar'), verse('caesar'), prose('caes.r'), verse('caes.r')):
+        scanned = LemmaLocator.from_markup(text)
+        # a pattern without a leading word has to be searched for in the whole text
+        expected = scanned.matches('(?:)' + pattern)
+        assert scanned.scanned == 1
+        assert LemmaLocator.from_markup(text).matches(pattern) == expected
+
+
+def test_prose_pattern_is_a_literal():
+    assert literal(prose('ut mihi')) == 'ut mihi'
+    assert literal(verse('Ut Mihi')) == 'ut mihi'
+    # a lookbehind of one genre with the lookahead of the other isn't a pattern the encoders build
+    assert literal(PROSE_WORD_START + 'ut mihi' + WORD_END) is None
+    assert literal(prose('ut mih.')) is None
+
+
+def test_prose_literals_are_found_in_one_pass():
+    text = '<seg>ut mihi defendendi, ut-mihi, #ut mihi et Ut mihi <!-- ut mihi --> mihi</seg>'
+    patterns = [prose('ut mihi'), prose('mihi')]
+    locator = LemmaLocator.from_markup(text)
+    locator.prepare(patterns)
+    found = [locator.matches(pattern) for pattern in patterns]
+    assert locator.passes == 1
+    assert locator.indexed == 0 and locator.scanned == 0
+    # the same spans as the regex finds
+    scanned = LemmaLocator.from_markup(text)
+    assert found == [scanned.matches('(?:)' + pattern) for pattern in patterns]
+    assert [locator.text[start:end] for start, end in found[0]] == ['ut mihi', 'Ut mihi']
+
+
+def test_markup_is_found_in_one_pass():
+    text = 'ut <!-- a <b> c --><hi rend="x">mihi</hi> a < b'
+    assert [text[start:end] for start, end in (match.span() for match in MARKUP.finditer(text))] == \
+        ['<!-- a <b> c -->', '<hi rend="x">', '</hi>']
+    # a stray < is not the start of a tag that ends at a later >
+    assert [match.group() for match in MARKUP.finditer('a < b <i>c</i>')] == ['<i>', '</i>']
+    start = time.perf_counter()
+    assert MARKUP.search('<ab ' * 20000) is None
+    assert time.perf_counter() - start < 0.1
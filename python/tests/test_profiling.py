@@ -0,0 +1,54 @@
+import profiling
+
+
+class Clock():
+    """a perf_counter that only moves when the test moves it"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def seconds(profiler, path):
+    return round(profiler.times[path][0], 6)
+
+
+def test_laps_leave_out_the_spans_run_inside_them(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(profiling.time, 'perf_counter', clock)
+    profiler = profiling.Profiler()
+    profiler.stage('read rows')
+    clock.now += 1
+    profiler.lap('read')
+    clock.now += 2
+    profiler.enter('cleanup')
+    clock.now += 3
+    profiler.exit()
+    clock.now += 4
+    profiler.lap('build')
+    clock.now += 5
+    profiler.lap('cite')
+    profiler.finish()
+    assert seconds(profiler, ('read rows', 'read')) == 1
+    assert seconds(profiler, ('read rows', 'cleanup')) == 3
+    assert seconds(profiler, ('read rows', 'build')) == 6
+    assert seconds(profiler, ('read rows', 'cite')) == 5
+    assert seconds(profiler, ('read rows',)) == 15
+
+
+def test_laps_of_a_stage_start_with_the_stage(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(profiling.time, 'perf_counter', clock)
+    profiler = profiling.Profiler()
+    profiler.stage('parse')
+    profiler.enter('disk')
+    clock.now += 7
+    profiler.exit()
+    profiler.stage('read rows')
+    clock.now += 1
+    profiler.lap('read')
+    profiler.finish()
+    assert seconds(profiler, ('parse', 'disk')) == 7
+    assert seconds(profiler, ('read rows', 'read')) == 1
@@ -0,0 +1,24 @@
+import io  # the stream the events are written to
+import json  # reads the events back
+import progress
+
+
+def test_json_rows_are_throttled_but_the_last_row_is_kept(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(progress.time, 'perf_counter', lambda: clock[0])
+    stream = io.StringIO()
+    run = progress.Progress('prose', progress.JSONSink(stream))
+    run.rows(1000)
+    for n in range(1000):
+        clock[0] += 0.001
+        run.row('1', str(n))
+        if n == 499:
+            run.problem('lemma not found', 'ut')
+    run.summary({'rows': 1000})
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    rows = [event for event in events if event['event'] == 'row']
+    assert len(rows) < 15
+    assert rows[-1]['done'] == 1000
+    problem = [event['event'] for event in events].index('problem')
+    assert events[problem - 1]['event'] == 'row' and events[problem - 1]['done'] == 500
+    assert events[-1]['event'] == 'summary'
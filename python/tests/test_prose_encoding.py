@@ -0,0 +1,24 @@
+import re  # the pattern LEMMA_NUMBER replaced
+import random  # the lemmas the two patterns are compared on
+import time  # times the pattern on a long lemma
+from prose_encoding import LEMMA_NUMBER
+
+# the pattern that used to split a lemma of the form lem2, which backtracks exponentially
+OLD_LEMMA_NUMBER = re.compile(r'(([A-Za-z]+\s*)*)([0-9]+)')
+
+
+def test_lemma_number_finds_what_the_old_pattern_found():
+    assert LEMMA_NUMBER.match('ut mihi2').groups() == ('ut mihi', '2')
+    generator = random.Random(7)
+    for _ in range(20000):
+        lemma = ''.join(generator.choice('ab Z-\t19') for _ in range(generator.randint(0, 12)))
+        old = OLD_LEMMA_NUMBER.search(lemma)
+        new = LEMMA_NUMBER.match(lemma)
+        assert (old[1], old[3]) == new.groups() if old is not None else new is None, lemma
+
+
+def test_lemma_number_does_not_backtrack_on_a_long_lemma():
+    start = time.perf_counter()
+    assert LEMMA_NUMBER.match('a' * 5000 + '!') is None
+    assert LEMMA_NUMBER.match('ab ' * 2000 + '-3').groups() == ('', '3')
+    assert time.perf_counter() - start < 0.1
@@ -0,0 +1,33 @@
+import csv  # writes the table the check reads
+import regex_fuzz
+from regex_fuzz import Found, fuzz, read_table, check, COLUMNS, LINEAR, SUPER_LINEAR, CATASTROPHIC
+
+
+def row(pattern, verdict, flags=''):
+    return {'Pattern': pattern, 'Flags': flags, 'Lemma': '', 'Verdict': verdict, 'Exponent': '', 'Worst input': '',
+            'Length': '', 'Seconds': '', 'Where': 'prose_encoding.py:1'}
+
+
+def test_check_compares_the_verdicts_with_the_table(tmp_path):
+    path = str(tmp_path / 'regex-fuzz.csv')
+    with open(path, 'w', encoding='utf-8', newline='') as table:
+        writer = csv.DictWriter(table, COLUMNS)
+        writer.writeheader()
+        writer.writerows([row('a+', LINEAR), row('(a+)+$', CATASTROPHIC), row('\\w*<\\w+>', SUPER_LINEAR),
+                          row('a+', SUPER_LINEAR, 'IGNORECASE'), row('a(b', 'not compiled: missing )')])
+    known = read_table(path)
+    assert known[('a+', 'IGNORECASE')] == SUPER_LINEAR
+
+    rows = [row('a+', SUPER_LINEAR), row('(a+)+$', SUPER_LINEAR), row('\\w*<\\w+>', SUPER_LINEAR),
+            row('a+', LINEAR, 'IGNORECASE'), row('a(b', LINEAR), row('new+', CATASTROPHIC)]
+    worse, better = check(rows, known)
+    assert [(r['Pattern'], r['Flags']) for r in worse] == [('a+', ''), ('new+', '')]
+    assert [(r['Pattern'], r['Flags']) for r in better] == [('(a+)+$', ''), ('a+', 'IGNORECASE')]
+
+
+def test_fuzz_finds_a_catastrophic_pattern(monkeypatch):
+    monkeypatch.setattr(regex_fuzz, 'TIMING', 0.0001)
+    lengths = [16, 32, 64, 128]
+    assert fuzz(Found('(a+)+$', 0), lengths, 0.05)['Verdict'] == CATASTROPHIC
+    assert fuzz(Found('a+b', 0), lengths, 0.05)['Verdict'] == LINEAR
+    assert fuzz(Found('a(b', 0), lengths, 0.05)['Verdict'].startswith('not compiled')
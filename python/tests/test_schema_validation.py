@@ -0,0 +1,63 @@
+import os  # where the grammars of the tests are written
+import sys  # runs an encoder in its own process
+import subprocess  # runs an encoder, as from the command line
+import pytest
+from schema_validation import SchemaValidator, SchemaUnavailable
+
+MAIN = '''<grammar xmlns="http://relaxng.org/ns/structure/1.0">
+  <include href="parts/word.rng"/>
+  <start><element name="text"><ref name="word"/></element></start>
+</grammar>'''
+WORD = '''<grammar xmlns="http://relaxng.org/ns/structure/1.0">
+  <define name="word"><element name="w"><text/></element></define>
+</grammar>'''
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(content)
+
+
+def test_included_grammars_are_downloaded_into_the_cache(tmp_path):
+    write(str(tmp_path / 'site' / 'main.rng'), MAIN)
+    write(str(tmp_path / 'site' / 'parts' / 'word.rng'), WORD)
+    cache = str(tmp_path / 'cache')
+    validator = SchemaValidator.load((tmp_path / 'site' / 'main.rng').as_uri(), cache)
+    assert os.path.exists(os.path.join(cache, 'main.rng'))
+    assert os.path.exists(os.path.join(cache, 'parts', 'word.rng'))
+    assert validator.schematron is None
+    # nothing is written next to the schema
+    assert sorted(os.listdir(str(tmp_path / 'site'))) == ['main.rng', 'parts']
+
+
+def test_truncated_schema_is_unavailable(tmp_path):
+    write(str(tmp_path / 'site' / 'main.rng'), MAIN[:60])
+    cache = str(tmp_path / 'cache')
+    with pytest.raises(SchemaUnavailable):
+        SchemaValidator.load((tmp_path / 'site' / 'main.rng').as_uri(), cache)
+    # the broken copy isn't kept for the next run
+    assert not os.path.exists(os.path.join(cache, 'main.rng'))
+
+
+def test_schema_that_does_not_compile_is_unavailable(tmp_path):
+    write(str(tmp_path / 'main.rng'), MAIN.replace('parts/word.rng', 'missing.rng'))
+    with pytest.raises(SchemaUnavailable):
+        SchemaValidator.load(str(tmp_path / 'main.rng'), str(tmp_path / 'cache'))
+
+
+def test_missing_schema_is_unavailable(tmp_path):
+    with pytest.raises(SchemaUnavailable):
+        SchemaValidator.load(str(tmp_path / 'nope.rng'), str(tmp_path / 'cache'))
+
+
+def test_an_encoder_with_a_missing_schema_still_writes_its_output(tmp_path):
+    sources = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'sources')
+    encoder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poetry_encoding.py')
+    output = str(tmp_path / 'poetry.xml')
+    subprocess.run([sys.executable, encoder, os.path.join(sources, 'calp-sicc-carmen4.txt'),
+                    os.path.join(sources, 'poetry-test.csv'), output, str(tmp_path / 'poetry.log'), '--no-open',
+                    '--progress', 'silent', '--validate', '--schema', str(tmp_path / 'nope.rng')], check=True)
+    assert os.path.getsize(output) > 0
+    with open(str(tmp_path / 'poetry.log'), encoding='utf-8') as log:
+        assert 'nope.rng does not exist' in log.read()
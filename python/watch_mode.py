@@ -0,0 +1,93 @@
+import os  # 'operating system' - used to check when the input files were saved
+import sys  # command line arguments
+import io  # collects the encoder's output between runs
+import time  # polls the input files and times each run
+import contextlib  # redirects the encoder's output
+from command_line import parse_options  # finds --watch and the input files on the command line
+
+# how often the base text and the CSV are checked for changes, in seconds
+POLL = 0.1
+
+
+def run_encoder(main, inputs=None):
+    """runs an encoder once, or, with --watch, keeps running it whenever its base text or CSV is saved, e.g.
+    python prose_encoding.py --watch basetext.txt app-crit.csv out.xml out.log
+
+    Every run after the first is an --incremental run in the same process, so the encoder's modules, their
+    compiled patterns, the memoized lemma patterns and sigla, the cached <lem> and <rdg> tags and the tree written
+    by the previous run are all still in memory, and only the sections whose text or rows changed are encoded.
+    The output and the log are rewritten after each run.
+
+    :param main: the main function of the encoder
+    :param inputs: the paths of the base text and the CSV, for an encoder that doesn't take them from the command
+        line (e.g. servius_encoding.py, which also runs every section again each time)
+    """
+    argv = list(sys.argv)
+    options = parse_options(argv)
+    if not options.watch:
+        main()
+        return
+
+    # the base text and the CSV
+    watched = [os.path.abspath(path) for path in (inputs or argv[1:3])]
+    flags = [flag for flag in sys.argv[1:] if flag != '--watch']
+    # the first run opens the output as usual; the editor reloads it after that
+    command = [sys.argv[0]] + flags + ['--incremental', '--progress', 'silent']
+    first = True
+    while True:
+        stamps = stat(watched)
+        sys.argv = list(command) if first else list(command) + ['--no-open']
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                metrics = main()
+        except Exception as error:
+            # e.g. a CSV that was saved half way through; the next save will be tried again
+            print("**** the text could not be encoded:", type(error).__name__ + ":", error)
+        else:
+            print("Encoded in %.2f seconds: %d rows, %d successful, %d invalid, %d not found" %
+                  (time.perf_counter() - start, metrics['rows'], metrics['successful'], metrics['invalid'],
+                   metrics['not found']))
+        first = False
+
+        print("Watching", ' and '.join(os.path.basename(path) for path in watched), "for changes (Ctrl-C to stop) ...")
+        try:
+            wait_for_change(watched, stamps)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+            return
+
+
+def stat(paths):
+    """
+    :param paths: the watched files
+    :return: the modification time and size of each file, or None for a file that doesn't exist right now
+    """
+    stamps = []
+    for path in paths:
+        try:
+            info = os.stat(path)
+            stamps.append((info.st_mtime_ns, info.st_size))
+        except OSError:
+            # e.g. an editor that saves by deleting the file and writing it again
+            stamps.append(None)
+    return stamps
+
+
+def wait_for_change(paths, stamps):
+    """waits until one of the files has changed and stayed the same for one poll, so that a file that is still
+    being written isn't read
+
+    :param paths: the watched files
+    :param stamps: what stat() returned for them before the last run
+    """
+    current = stat(paths)
+    while current == stamps or None in current:
+        time.sleep(POLL)
+        current = stat(paths)
+    while True:
+        time.sleep(POLL)
+        latest = stat(paths)
+        if latest == current:
+            return
+        current = latest